@@ -15,6 +15,7 @@ from components.callbacks import register_callbacks
 from components.sidebar import sidebar
 from components.character_card import generate_character_cards
 from components.enemy_card import generate_enemy_card
+from utilities.instrumentation import register_metrics_endpoint
 
 # %%
 # Example
@@ -67,7 +68,7 @@ def simulate_rounds_input():
         dbc.Row([
             dbc.Col([
                 dbc.Label('Number Of Rounds'),
-                dbc.Input(type="number", value=10_000, min=1, max=100_000, step=1, style={'display': 'inline-block'},id="simulate-input"),
+                dbc.Input(type="number", value=10_000, min=1, max=10_000_000, step=1, style={'display': 'inline-block'},id="simulate-input"),
             ],width=2),
             dbc.Col([
                 dbc.Label("Graph Type"),
@@ -77,17 +78,33 @@ def simulate_rounds_input():
                         {"label": "DPR vs Armor Class", "value": "DPR vs Armor Class"},
                         {"label": "DPA Distribution", "value": "DPA Distribution",},
                         {"label": "DPA vs Armor Class", "value": "DPA vs Armor Class"},
+                        {"label": "DPR Difference (Paired)", "value": "DPR Difference (Paired)"},
+                        {"label": "DPR Design Of Experiments", "value": "DPR Design Of Experiments"},
+                        {"label": "Rounds To Kill", "value": "Rounds To Kill"},
+                        {"label": "DPR Adventuring Day", "value": "DPR Adventuring Day"},
+                        {"label": "Party Rounds To Kill", "value": "Party Rounds To Kill"},
                     ],
                     value="DPR Distribution",
                     id="simulate-type",
                     inline=True,
                     ),
             ],width=3),
+            dbc.Col([
+                dbc.Label("Experiment Grid"),
+                dbc.Input(type="text", placeholder="level=1:20; strength=16,18,20; GWM=off,on", id="experiment-grid"),
+                dbc.FormText("Fields of the first character to vary, 'attack.' fields apply to every attack"),
+                dbc.Label("Adventuring Day"),
+                dbc.Input(type="text", placeholder="3, 3, short, 3, 3; smite=every_hit; slot=lowest; surges=1", id="adventuring-day"),
+                dbc.FormText("Rounds of each encounter and short rests, smites and rages are limited by spell slots and rages per day, action surges per short rest"),
+            ],width=3),
             dbc.Col([
                 dbc.Label("Numerical Options"),
                 dbc.Checklist(
                     options=[
                         {"label": "Randomize Seed", "value": 1},
+                        {"label": "Exact DPR Distribution", "value": 2},
+                        {"label": "Numba Engine", "value": 3},
+                        {"label": "Adaptive Rounds", "value": 4},
                     ],
                     value=[1],
                     id="numerical-options",
@@ -106,6 +123,7 @@ def simulate_rounds_input():
 
 app = Dash(__name__, external_stylesheets=[style_sheet, dbc.icons.FONT_AWESOME])
 server = app.server
+register_metrics_endpoint(server) # Prometheus metrics of the simulation hot path at /metrics, only with INSTRUMENTATION=on and from localhost
 
 # Plot data
 fig = generate_plot_data(characters, df_by_rounds, template=template, title="Damage Per Round Distribution")
@@ -156,6 +174,11 @@ content = html.Div(dbc.Container([
                             {"label": "DPA Summary", "value": "DPA Summary"},
                             {"label": "DPA Distribution", "value": "DPA Distribution",},
                             {"label": "DPA vs Armor Class", "value": "DPA vs Armor Class"},
+                            {"label": "DPR Difference (Paired)", "value": "DPR Difference (Paired)"},
+                            {"label": "DPR Design Of Experiments", "value": "DPR Design Of Experiments"},
+                            {"label": "Rounds To Kill", "value": "Rounds To Kill"},
+                            {"label": "DPR Adventuring Day", "value": "DPR Adventuring Day"},
+                            {"label": "Party Rounds To Kill", "value": "Party Rounds To Kill"},
                             ],
                         value='DPR Summary', id='export-type'),
                     dbc.Button(dbc.Spinner(html.I(className="fa-solid fa-download"),color="secondary", id="export-spinner", size="sm"),color="secondary", id="export-results-button"),
@@ -7,15 +7,81 @@ import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
 from dash import dcc, html, Input, Output, State, Patch, MATCH, ALL, ctx, clientside_callback, ClientsideFunction
 from computations.models import Attack, Character, Enemy
-from computations.numerical_simulation import simulate_rounds_from_characters, set_seed, simulate_rounds_from_characters_multi_acs
+from computations.numerical_simulation import SEED, ADAPTIVE_TOLERANCE, simulate_rounds_from_characters, set_seed, simulate_rounds_from_characters_multi_acs, simulate_rounds_streaming, simulate_rounds_adaptive, simulate_rounds_paired
+from computations.analytic import damage_pmfs_from_characters
+from computations.cache import cached
+from computations.experiments import parse_grid, simulate_grid
+from computations.turns_to_kill import simulate_turns_to_kill_from_characters
+from computations.party import simulate_party, party_summary
+from computations.adventuring_day import AdventuringDay, DayResources, parse_day, simulate_adventuring_day_from_characters
 
 from utilities.helper_functions import timeit
+from utilities.instrumentation import span, increment, set_gauge, is_enabled
 from components.callback_helpers import get_active_ids_and_new_id, get_new_id, set_active_ids, max_from_list, try_and_except_alert, reformat_df_ac
-from components.plots import COLORS, generate_plot_data, add_tables, summary_stats, generate_line_plots, generate_damage_per_attack_histogram, build_tables_row
+from components.plots import COLORS, add_tables, summary_stats, generate_line_plots, build_tables_row, generate_pmf_plot, generate_attack_pmf_plot, pmf_summary_stats, generate_difference_pmf_plot, paired_summary_stats, generate_heatmap, party_tables
 from components.character_card import generate_character_card, set_attack_from_values, extract_attack_ui_values, extract_character_ui_values, characters_from_ui
 from components.enemy_card import extract_enemy_ui_values
 
 MAX_CHARACTERS = min(8,len(COLORS)) # There are 10 colors and 4 characters fit per row, so 8 is a good max
+MAX_MATERIALIZED_ROUNDS = 100_000 # Above this only streamed summaries are computed, since every round would have to be kept in memory
+ADAPTIVE_TIME_BUDGET = 10 # Seconds an adaptive simulation may run for, Number Of Rounds is the maximum per character or armor class
+
+def summary_results(characters, enemy, seed, num_rounds, numerical_options):
+    """ Cached streamed summaries, simulated adaptively with num_rounds as the maximum when Adaptive Rounds is on
+        Returns the results of simulate_rounds_streaming and the precision report of simulate_rounds_adaptive, or None """
+    engine = "numba" if 3 in numerical_options else "batched"
+    if 4 in numerical_options: # Adaptive Rounds
+        *res, report = cached("Adaptive Summary", simulate_rounds_adaptive, characters, enemy, seed=seed, max_rounds=num_rounds,
+                              tolerance=ADAPTIVE_TOLERANCE, time_budget=ADAPTIVE_TIME_BUDGET, engine=engine)
+        return res, report
+    return cached("Summary", simulate_rounds_streaming, characters, enemy, seed=seed, num_rounds=num_rounds, engine=engine), None
+
+def sweep_options(numerical_options):
+    """ Extra arguments of simulate_rounds_from_characters_multi_acs for the numerical options """
+    if 4 in numerical_options: # Adaptive Rounds
+        return {"tolerance": ADAPTIVE_TOLERANCE, "time_budget": ADAPTIVE_TIME_BUDGET}
+    return {}
+
+def paired_results(characters, enemy, seed, num_rounds):
+    """ Cached paired differences against the first character, always simulated by the batched engine since only it supports paired simulations """
+    if len(characters) < 2:
+        raise ValueError("Paired differences need at least two characters")
+    return cached("Paired Difference", simulate_rounds_paired, characters, enemy, seed=seed, num_rounds=num_rounds)
+
+def experiment_results(characters, enemy, seed, num_rounds, experiment_grid):
+    """ Cached design of experiments over the grid text, varying the first character, returns the tidy frame and the grid fields
+        Variants are paired, so they are always simulated by the batched engine """
+    grid = parse_grid(experiment_grid or "")
+    if not grid:
+        raise ValueError("The experiment grid is empty")
+    df = cached("Design Of Experiments", lambda chars, enemy, **kwargs: simulate_grid(chars[0], enemy, **kwargs), characters[:1], enemy,
+                seed=seed, grid=grid, num_rounds=num_rounds)
+    return df, list(grid)
+
+def turns_to_kill_results(characters, enemy, seed, num_rounds):
+    """ Cached turns to kill of each character, num_rounds is the number of fights
+        Hit points are part of the key, since compiled specs do not include them """
+    return cached("Turns To Kill", lambda chars, enemy, hit_points, **kwargs: simulate_turns_to_kill_from_characters(chars, enemy, **kwargs), characters, enemy,
+                  seed=seed, hit_points=enemy.hit_points, num_trials=num_rounds)
+
+def adventuring_day_results(characters, enemy, seed, num_rounds, adventuring_day):
+    """ Cached adventuring days of each character, num_rounds is the number of days
+        Resources are part of the key, since levels with the same compiled attacks can have different spell slots or rages """
+    day = parse_day(adventuring_day) if adventuring_day else AdventuringDay()
+    resources = [DayResources.from_character(c, action_surges=day.action_surges) for c in characters]
+    return cached("Adventuring Day", simulate_adventuring_day_from_characters, characters, enemy, seed=seed, day=day, resources=resources, num_trials=num_rounds)
+
+def party_results(characters, enemy, seed, num_rounds):
+    """ Cached party fights of every character against the enemy, num_rounds is the number of fights, returns the results of simulate_party and its summary
+        Initiative and hit points are part of the key, since the dexterity modifier of a strength build and the enemy's hit points do not change the compiled specs """
+    results = cached("Party", lambda chars, enemy, initiative, hit_points, **kwargs: simulate_party(chars, [enemy], **kwargs), characters, enemy, seed=seed,
+                     initiative=[(c.dexterity_ability_modifier, c.initiative) for c in characters], hit_points=enemy.hit_points, num_trials=num_rounds)
+    return results, party_summary(results)
+
+def precision_alert(report):
+    """ Info alert with the rounds used and standard error of mean DPR per character """
+    lines = [f"{name}: {row['Rounds']:,} rounds, DPR \u00b1{row['Std Error']:.3f}" + ("" if row['Converged'] else " (stopped early)") for name, row in report.iterrows()]
+    return dbc.Alert([html.Div(line) for line in lines], dismissable=True, is_open=True, color="info")
 
 # Note: Intellisense is not recognizing the callbacks as being accessed
 def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
@@ -389,17 +455,19 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
         State("enemy-card-body","children"),
         State("simulate-type","value"),
         State("numerical-options","value"),
+        State("experiment-grid","value"),
+        State("adventuring-day","value"),
         prevent_initial_call=True
     )
     @timeit
-    def simulate(clicked, num_rounds, attack_stores, characters_list, enemy_card_body, simulate_type, numerical_options):
+    def simulate(clicked, num_rounds, attack_stores, characters_list, enemy_card_body, simulate_type, numerical_options, experiment_grid, adventuring_day): # pylint: disable=too-many-arguments
         if clicked is None:
             raise PreventUpdate
 
         if 1 in numerical_options: # Randomize Seed
-            rng = set_seed(np.random.randint(0,100))
+            seed = np.random.randint(0,100)
         else:
-            rng = set_seed()
+            seed = SEED
 
         # Default Outputs
         fig = Patch()
@@ -415,13 +483,21 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
                 is_open=True,
                 color="danger")
             return fig, tables, alert, spinner
+        if num_rounds > MAX_MATERIALIZED_ROUNDS and simulate_type in ["DPR vs Armor Class","DPA vs Armor Class"] and 4 not in numerical_options:
+            alert = dbc.Alert(
+                f"{simulate_type} supports at most {MAX_MATERIALIZED_ROUNDS:,} rounds",
+                dismissable=True,
+                is_open=True,
+                color="danger")
+            return fig, tables, alert, spinner
 
         # Parse characters
-        characters, alert = try_and_except_alert(
-            "Could not parse characters, please check that all fields are filled out correctly",
-            characters_from_ui,
-            *[characters_list, attack_stores]
-            )
+        with span("parse"):
+            characters, alert = try_and_except_alert(
+                "Could not parse characters, please check that all fields are filled out correctly",
+                characters_from_ui,
+                *[characters_list, attack_stores]
+                )
         if alert is not None:
             return fig, tables, alert, spinner
 
@@ -436,48 +512,124 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
             return fig, tables, alert, spinner
 
         # Parse enemy
-        enemy, alert = try_and_except_alert(
-            "Could not parse enemy, please check that all fields are filled out correctly",
-            Enemy,
-            **extract_enemy_ui_values(enemy_card_body),
-            )
+        with span("parse"):
+            enemy, alert = try_and_except_alert(
+                "Could not parse enemy, please check that all fields are filled out correctly",
+                Enemy,
+                **extract_enemy_ui_values(enemy_card_body),
+                )
         if alert is not None:
             return fig, tables, alert, spinner
 
-        # Simulate
-        if simulate_type in ["DPR Distribution","DPA Distribution"]:
+        # Simulate, results are cached so repeated clicks and exports with the same inputs and seed are not simulated again
+        if simulate_type == "DPR Distribution" and 2 in numerical_options: # Exact DPR Distribution
+            res, alert = try_and_except_alert(
+                "Could not compute combat distributions, please check that all fields are filled out correctly",
+                cached,
+                *["Exact DPR Distribution", damage_pmfs_from_characters, characters, enemy],
+                )
+            if alert is not None:
+                return fig, tables, alert, spinner
+
+            _, pmfs_by_round = res
+            fig = generate_pmf_plot(characters, pmfs_by_round, title="Damage Per Round Distribution (Exact)")
+            tables = build_tables_row(characters, pmf_summary_stats(pmfs_by_round), width=3, by_round=True)
+        elif simulate_type in ["DPR Distribution","DPA Distribution"]:
             res, alert = try_and_except_alert(
                 "Could not simulate combat, please check that all fields are filled out correctly",
-                simulate_rounds_from_characters,
-                *[characters,enemy],
-                num_rounds=num_rounds,
-                save_memory=True,
-                rng=rng
+                summary_results,
+                *[characters, enemy, seed, num_rounds, numerical_options],
                 )
             if alert is not None:
                 return fig, tables, alert, spinner
 
-            dfs, df_by_rounds, df_by_attacks = res
-            del res
+            (hists_by_round, hists_by_attack, df_by_rounds, df_by_attacks), report = res
+            if report is not None:
+                alert = precision_alert(report)
             if simulate_type == "DPR Distribution":
-                fig = generate_plot_data(characters, df_by_rounds, title="Damage Per Round Distribution")
-                tables = add_tables(df_by_rounds,characters,by_round=True, width=3)
+                fig = generate_pmf_plot(characters, [{col: h.to_pmf() for col, h in hists.items()} for hists in hists_by_round], title="Damage Per Round Distribution")
+                tables = add_tables(df_by_rounds,characters,by_round=True, width=3, summarized=True)
             elif simulate_type == "DPA Distribution":
-                fig = generate_damage_per_attack_histogram(characters, dfs, title="Damage Per Attack Distribution")
+                pmfs_by_attack = [{name: hists["Damage"].to_pmf() for name, hists in by_attack.items()} for by_attack in hists_by_attack]
+                fig = generate_attack_pmf_plot(characters, pmfs_by_attack, title="Damage Per Attack Distribution")
                 tables = add_tables(df_by_attacks,characters,by_round=False, width=3)
-            print(f"dfs : {sum([d.memory_usage(deep=True).sum() for d in dfs])/1000000} MB")
-            print(f"df_by_rounds : {sum([d.memory_usage(deep=True).sum() for d in df_by_rounds])/1000000} MB")
-            del dfs, df_by_rounds, df_by_attacks
+        elif simulate_type == "DPR Difference (Paired)":
+            res, alert = try_and_except_alert(
+                "Could not simulate combat, paired differences need at least two characters and the first character is the baseline",
+                paired_results,
+                *[characters, enemy, seed, num_rounds],
+                )
+            if alert is not None:
+                return fig, tables, alert, spinner
+
+            _, hists_difference, summary = res
+            others = characters[1:]
+            fig = generate_difference_pmf_plot(characters, hists_difference, characters[0], title="Paired Damage Per Round Difference")
+            tables = build_tables_row(others, paired_summary_stats(hists_difference, summary), width=3, by_round=True)
+        elif simulate_type == "Rounds To Kill":
+            # Number Of Rounds is the number of fights, each fight lasts until the enemy's hit points run out
+            res, alert = try_and_except_alert(
+                "Could not simulate combat, please check that all fields are filled out correctly",
+                turns_to_kill_results,
+                *[characters, enemy, seed, num_rounds],
+                )
+            if alert is not None:
+                return fig, tables, alert, spinner
+
+            results, summaries = res
+            fig = generate_pmf_plot(characters, [{"Rounds To Kill": r[0].to_pmf()} for r in results], column="Rounds To Kill",
+                                    title=f"Rounds To Kill {enemy.name} ({enemy.hit_points} HP)")
+            tables = build_tables_row(characters, [df.round(2) for df in summaries], width=3, title="Per Fight")
+        elif simulate_type == "DPR Adventuring Day":
+            res, alert = try_and_except_alert(
+                "Could not simulate the adventuring day, encounters are separated by ',' and options by ';', i.e. 3, 3, short, 3; smite=crit_only",
+                adventuring_day_results,
+                *[characters, enemy, seed, num_rounds, adventuring_day],
+                )
+            if alert is not None:
+                return fig, tables, alert, spinner
+
+            results, summaries = res
+            fig = generate_pmf_plot(characters, [{"Damage Per Day": hists["Day"].to_pmf()} for hists, _ in results], column="Damage Per Day",
+                                    title="Damage Per Adventuring Day")
+            tables = build_tables_row(characters, [df.round(2) for df in summaries], width=6, title="Per Encounter")
+        elif simulate_type == "Party Rounds To Kill":
+            # Number Of Rounds is the number of fights, every character fights together in initiative order
+            res, alert = try_and_except_alert(
+                "Could not simulate the party, please check that all fields are filled out correctly",
+                party_results,
+                *[characters, enemy, seed, num_rounds],
+                )
+            if alert is not None:
+                return fig, tables, alert, spinner
+
+            (_, member_hists, members, _), summary = res
+            fig = generate_pmf_plot(characters, [{"Damage Per Round": h.to_pmf()} for h in member_hists], column="Damage Per Round",
+                                    title=f"Party Damage Per Round Against {enemy.name} ({enemy.hit_points} HP)")
+            tables = party_tables(summary.round(2), members.round(3))
+        elif simulate_type == "DPR Design Of Experiments":
+            res, alert = try_and_except_alert(
+                "Could not simulate the experiment grid, fields are separated by ';' and values by ',', i.e. level=1:20; GWM=off,on",
+                experiment_results,
+                *[characters, enemy, seed, num_rounds, experiment_grid],
+                )
+            if alert is not None:
+                return fig, tables, alert, spinner
+
+            df_grid, grid_fields = res
+            fig = generate_heatmap(df_grid, grid_fields, title=f"{characters[0].name} Mean Damage Per Round")
+            tables = build_tables_row(characters[:1], [df_grid.round(2).set_index(grid_fields)], width=12, by_round=True)
         elif simulate_type in ["DPR vs Armor Class","DPA vs Armor Class"]:
             by_round = simulate_type == "DPR vs Armor Class"
             df_acs, alert = try_and_except_alert(
                 "Could not simulate combat, please check that all fields are filled out correctly",
-                simulate_rounds_from_characters_multi_acs,
-                *[characters,enemy],
-                armor_classes = range(10,26),
+                cached,
+                *["Armor Class Sweep", simulate_rounds_from_characters_multi_acs, characters, enemy],
+                seed=seed,
+                armor_classes = list(range(10,26)),
                 num_rounds=num_rounds,
                 by_round=by_round,
-                rng=rng
+                **sweep_options(numerical_options),
                 )
             if alert is not None:
                 return fig, tables, alert, spinner
@@ -501,14 +653,15 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
                     data_summary.append(pd.concat(c_summary,axis=1))
 
             tables = build_tables_row(characters, data_summary, width=3, by_round=by_round)
-            print(f"df_acs : {df_acs.memory_usage(deep=True).sum()/1000000} MB")
-            print(f"data_summary : {sum([d.memory_usage(deep=True).sum() for d in data_summary])/1000000} MB")
+            if is_enabled():
+                set_gauge('result_bytes', df_acs.memory_usage(deep=True).sum(), kind=f"{simulate_type} Data")
+                set_gauge('result_bytes', sum(d.memory_usage(deep=True).sum() for d in data_summary), kind=f"{simulate_type} Tables")
             del df_acs, data_summary
-        print(f"Simulated {clicked} times")
+        increment('callbacks_total', callback='simulate', type=simulate_type)
         return fig, tables, alert, spinner
 
 
-    # Resimulate since storing data is very memory intensive. Could implment client side callbacks, but this is sufficient for now
+    # Summaries come from the result cache shared with simulate, raw distributions are resimulated since storing them is very memory intensive
     @app.callback(
         Output('export-results','data'),
         Output('simulate-alerts',"children", allow_duplicate=True),
@@ -520,17 +673,19 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
         State("character_row","children"),
         State("enemy-card-body","children"),
         State("numerical-options","value"),
+        State("experiment-grid","value"),
+        State("adventuring-day","value"),
         prevent_initial_call=True
     )
     @timeit
-    def export_results(clicked, export_type, num_rounds, attack_stores, characters_list, enemy_card_body, numerical_options):
+    def export_results(clicked, export_type, num_rounds, attack_stores, characters_list, enemy_card_body, numerical_options, experiment_grid, adventuring_day): # pylint: disable=too-many-arguments
         if clicked is None:
             raise PreventUpdate
 
         if 1 in numerical_options: # Randomize Seed
-            rng=set_seed(np.random.randint(0,100))
+            seed = np.random.randint(0,100)
         else:
-            rng = set_seed()
+            seed = SEED
 
         # Default Outputs
         export = Patch()
@@ -546,13 +701,22 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
                 is_open=True,
                 color="danger")
             return export, alert, spinner
+        materialized = ["DPR Distribution", "DPA Distribution"] if 4 in numerical_options else ["DPR Distribution", "DPA Distribution", "DPR vs Armor Class", "DPA vs Armor Class"]
+        if num_rounds > MAX_MATERIALIZED_ROUNDS and export_type in materialized:
+            alert = dbc.Alert(
+                f"{export_type} supports at most {MAX_MATERIALIZED_ROUNDS:,} rounds",
+                dismissable=True,
+                is_open=True,
+                color="danger")
+            return export, alert, spinner
 
         # Parse characters
-        characters, alert = try_and_except_alert(
-            "Could not parse characters, please check that all fields are filled out correctly",
-            characters_from_ui,
-            *[characters_list, attack_stores]
-            )
+        with span("parse"):
+            characters, alert = try_and_except_alert(
+                "Could not parse characters, please check that all fields are filled out correctly",
+                characters_from_ui,
+                *[characters_list, attack_stores]
+                )
         if alert is not None:
             return export, alert, spinner
 
@@ -567,11 +731,12 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
             return export, alert, spinner
 
         # Parse enemy
-        enemy, alert = try_and_except_alert(
-            "Could not parse enemy, please check that all fields are filled out correctly",
-            Enemy,
-            **extract_enemy_ui_values(enemy_card_body),
-            )
+        with span("parse"):
+            enemy, alert = try_and_except_alert(
+                "Could not parse enemy, please check that all fields are filled out correctly",
+                Enemy,
+                **extract_enemy_ui_values(enemy_card_body),
+                )
         if alert is not None:
             return export, alert, spinner
 
@@ -579,31 +744,44 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
         dfs = []
         names = [c.name for c in characters]
         export_kwargs = {}
-        if export_type in ["DPR Summary", "DPA Summary", "DPR Distribution","DPA Distribution"]:
+        if export_type in ["DPR Summary", "DPA Summary"]:
             res, alert = try_and_except_alert(
                 "Could not simulate combat, please check that all fields are filled out correctly",
-                simulate_rounds_from_characters,
-                *[characters,enemy],
-                num_rounds=num_rounds,
-                rng=rng
+                summary_results,
+                *[characters, enemy, seed, num_rounds, numerical_options],
                 )
             if alert is not None:
                 return export, alert, spinner
 
-            df_all, df_by_rounds, df_by_attacks = res
+            (_, _, df_by_rounds, df_by_attacks), _ = res
             del res
 
             if export_type == "DPR Summary":
-                df_summary = summary_stats(df_by_rounds, by_round=True)
+                df_summary = summary_stats(df_by_rounds, by_round=True, summarized=True)
                 for name, data in zip(names,df_summary):
                     data.insert(0, 'Name', name)
                     dfs.append(data)
-            elif export_type == "DPR Distribution":
-                for name, data in zip(names,df_by_rounds):
-                    data.insert(0, 'Name', name)
-                    dfs.append(data)
             elif export_type == "DPA Summary":
                 for name, data in zip(names,df_by_attacks):
+                    data = data.copy() # Cached results are shared, so are not modified
+                    data.insert(0, 'Name', name)
+                    dfs.append(data)
+        elif export_type in ["DPR Distribution","DPA Distribution"]:
+            res, alert = try_and_except_alert(
+                "Could not simulate combat, please check that all fields are filled out correctly",
+                simulate_rounds_from_characters,
+                *[characters,enemy],
+                num_rounds=num_rounds,
+                rng=set_seed(seed)
+                )
+            if alert is not None:
+                return export, alert, spinner
+
+            df_all, df_by_rounds, df_by_attacks = res
+            del res
+
+            if export_type == "DPR Distribution":
+                for name, data in zip(names,df_by_rounds):
                     data.insert(0, 'Name', name)
                     dfs.append(data)
             elif export_type == "DPA Distribution":
@@ -611,17 +789,72 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
                     data.insert(0, 'Name', name)
                     dfs.append(data.sort_values(by=["Name","Round"]))
 
+        elif export_type == "DPR Difference (Paired)":
+            res, alert = try_and_except_alert(
+                "Could not simulate combat, paired differences need at least two characters and the first character is the baseline",
+                paired_results,
+                *[characters, enemy, seed, num_rounds],
+                )
+            if alert is not None:
+                return export, alert, spinner
+            _, hists_difference, summary = res
+            dfs = [pd.concat(paired_summary_stats(hists_difference, summary), axis=1).T]
+        elif export_type == "Rounds To Kill":
+            res, alert = try_and_except_alert(
+                "Could not simulate combat, please check that all fields are filled out correctly",
+                turns_to_kill_results,
+                *[characters, enemy, seed, num_rounds],
+                )
+            if alert is not None:
+                return export, alert, spinner
+            for name, data in zip(names, res[1]):
+                data = data.copy() # Cached results are shared, so are not modified
+                data.insert(0, 'Name', name)
+                dfs.append(data)
+        elif export_type == "DPR Adventuring Day":
+            res, alert = try_and_except_alert(
+                "Could not simulate the adventuring day, encounters are separated by ',' and options by ';', i.e. 3, 3, short, 3; smite=crit_only",
+                adventuring_day_results,
+                *[characters, enemy, seed, num_rounds, adventuring_day],
+                )
+            if alert is not None:
+                return export, alert, spinner
+            for name, data in zip(names, res[1]):
+                data = data.copy() # Cached results are shared, so are not modified
+                data.insert(0, 'Name', name)
+                dfs.append(data)
+        elif export_type == "Party Rounds To Kill":
+            res, alert = try_and_except_alert(
+                "Could not simulate the party, please check that all fields are filled out correctly",
+                party_results,
+                *[characters, enemy, seed, num_rounds],
+                )
+            if alert is not None:
+                return export, alert, spinner
+            (_, _, members, _), summary = res
+            dfs = [summary, members]
+        elif export_type == "DPR Design Of Experiments":
+            export_kwargs = {"index": False}
+            res, alert = try_and_except_alert(
+                "Could not simulate the experiment grid, fields are separated by ';' and values by ',', i.e. level=1:20; GWM=off,on",
+                experiment_results,
+                *[characters, enemy, seed, num_rounds, experiment_grid],
+                )
+            if alert is not None:
+                return export, alert, spinner
+            dfs = [res[0]]
         elif export_type in ["DPR vs Armor Class","DPA vs Armor Class"]:
             export_kwargs = {} #{"index": False}
             by_round = export_type == "DPR vs Armor Class"
             df_acs, alert = try_and_except_alert(
                 "Could not simulate combat, please check that all fields are filled out correctly",
-                simulate_rounds_from_characters_multi_acs,
-                *[characters,enemy],
-                armor_classes = range(10,26),
+                cached,
+                *["Armor Class Sweep", simulate_rounds_from_characters_multi_acs, characters, enemy],
+                seed=seed,
+                armor_classes = list(range(10,26)),
                 num_rounds=num_rounds,
                 by_round=by_round,
-                rng=rng
+                **sweep_options(numerical_options),
                 )
             if alert is not None:
                 return export, alert, spinner
@@ -643,9 +876,10 @@ def register_callbacks(app, sidebar=True): # pylint: disable=too-many-statements
             raise PreventUpdate
 
         # Export to csv
-        print(f"Exported {clicked} times")
+        increment('callbacks_total', callback='export', type=export_type)
         filename = f"{export_type}.csv"
-        export = dcc.send_data_frame(pd.concat(dfs).to_csv, filename, **export_kwargs)
+        with span("serialize"):
+            export = dcc.send_data_frame(pd.concat(dfs).to_csv, filename, **export_kwargs)
         return export, None, spinner
 
 # TODO: Add multiple graph options. Add a simulate for multiple enemy armor classes
@@ -8,6 +8,9 @@ import plotly.graph_objects as go
 import pandas as pd
 from dash import html
 import dash_bootstrap_components as dbc
+from computations.analytic import describe_pmfs
+from computations.numerical_simulation import describe
+from utilities.instrumentation import timed, set_gauge, is_enabled
 
 # Color Palette
 COLORS = px.colors.qualitative.Plotly
@@ -20,6 +23,7 @@ def calc_opacity(num_categories, o_init=0.75, o_slope=0.2, o_min=0.25, per_categ
     # print(f"Opacity: {opacity}")
     return opacity
 
+@timed(name="figure")
 def generate_plot_data(characters, df_by_rounds, template='plotly_dark',**kwargs):
     """ Generates the plot data for the DPR Distribution Histogram"""
     data = pd.concat([pd.DataFrame({'Damage': df_by_round["Damage"], 'Type': c.name}) for c, df_by_round in zip(characters,df_by_rounds)]).reset_index(drop=True)
@@ -35,9 +39,69 @@ def generate_plot_data(characters, df_by_rounds, template='plotly_dark',**kwargs
 
     return fig
 
+@timed(name="figure")
+def generate_pmf_plot(characters, pmfs, template='plotly_dark', column="Damage", **kwargs):
+    """ Generates a bar plot of exact distributions, the analytic counterpart of generate_plot_data """
+    fig = go.Figure()
+    opacity = calc_opacity(len(characters))
+    for ii, (c, pmf) in enumerate(zip(characters, pmfs)):
+        pmf = pmf[column].trim()
+        fig.add_trace(go.Bar(name=c.name, x=pmf.support, y=pmf.probs*100, marker_color=COLORS[ii], opacity=opacity))
+    fig.update_layout(barmode='overlay', bargap=0, xaxis_title=column, yaxis_title='Percent', legend_title_text='Type', template=template, **kwargs)
+    return fig
+
+@timed(name="figure")
+def generate_attack_pmf_plot(characters, pmfs_by_attack, template='plotly_dark', **kwargs):
+    """ Generates a bar plot of the damage distribution of each attack, the histogram counterpart of generate_damage_per_attack_histogram """
+    fig = go.Figure()
+    opacity = calc_opacity(sum(len(pmfs) for pmfs in pmfs_by_attack), o_slope=0.25)
+    for ii, (c, pmfs) in enumerate(zip(characters, pmfs_by_attack)):
+        for name, pmf in pmfs.items():
+            pmf = pmf.trim()
+            fig.add_trace(go.Bar(name=f"{c.name}-{name}", x=pmf.support, y=pmf.probs*100, marker_color=COLORS[ii].lower(), opacity=opacity))
+    fig.update_layout(barmode='overlay', bargap=0, xaxis_title="Damage", yaxis_title='Percent', legend_title_text='Type', template=template, **kwargs)
+    return fig
+
+@timed(name="figure")
+def generate_difference_pmf_plot(characters, hists_difference, baseline, template='plotly_dark', **kwargs):
+    """ Generates a bar plot of each character's paired damage per round minus the baseline character's, hists_difference is keyed by character index """
+    fig = go.Figure()
+    opacity = calc_opacity(len(characters))
+    for ii, c in enumerate(characters):
+        if ii not in hists_difference:
+            continue
+        pmf = hists_difference[ii].to_pmf().trim()
+        fig.add_trace(go.Bar(name=f"{c.name} - {baseline.name}", x=pmf.support, y=pmf.probs*100, marker_color=COLORS[ii], opacity=opacity))
+    fig.update_layout(barmode='overlay', bargap=0, xaxis_title="Damage Difference", yaxis_title='Percent', legend_title_text='Type', template=template, **kwargs)
+    return fig
+
+def paired_summary_stats(hists_difference, summary):
+    """ Summary stats of each paired difference with its standard errors, one table per compared character, hists_difference is keyed by character index """
+    df_summary = []
+    # Rows of the summary are in the same order as hists_difference, comparisons of characters with the same name have the same label
+    for h, (comparison, row) in zip(hists_difference.values(), summary.iterrows()):
+        desc = h.describe()
+        for col in ['Std Error (Paired)', 'Std Error (Independent)', 'Variance Reduction']:
+            desc[col] = row[col]
+        df_summary.append(desc.round(3).to_frame(comparison))
+    return df_summary
+
+@timed(name="figure")
+def generate_heatmap(df, grid_fields, z='mean', template='plotly_dark', **kwargs):
+    """ Generates a heatmap of a design of experiments frame over its first two fields, averaged over any other fields """
+    x = grid_fields[0]
+    if len(grid_fields) > 1:
+        pivot = df.pivot_table(index=grid_fields[1], columns=x, values=z, aggfunc='mean')
+    else:
+        pivot = df.groupby(x)[z].mean().to_frame(z).T
+    fig = go.Figure(go.Heatmap(z=pivot.to_numpy(), x=[str(v) for v in pivot.columns], y=[str(v) for v in pivot.index], colorbar={'title': z}))
+    fig.update_layout(xaxis_title=x, yaxis_title=grid_fields[1] if len(grid_fields) > 1 else '', template=template, **kwargs)
+    return fig
+
 def generate_histogram(data, x, color, marginal='violin', histnorm='percent', barmode='overlay', opacity=0.75, **kwargs):
     """ Generic histogram helper function with marginal plot"""
-    print(f"Plot data in hist: {data.memory_usage(deep=True).sum()/1000000} MB")
+    if is_enabled():
+        set_gauge('result_bytes', data.memory_usage(deep=True).sum(), kind='Histogram Plot Data')
     with warnings.catch_warnings():
         warnings.simplefilter(action='ignore', category=FutureWarning)
         fig = px.histogram(
@@ -83,19 +147,22 @@ def generate_cdf_plot(data):
 
 
 
-def summary_stats(data: List, by_round=True):
-    """ Extracts summary stats to be used for tables and exports"""
+def summary_stats(data: List, by_round=True, summarized=False):
+    """ Extracts summary stats to be used for tables and exports
+        summarized=True means the per round data is already summary stats, e.g. from simulate_rounds_streaming """
     df_summary = []
     for datac in data:
         if by_round:
             datac = datac.drop(["Attack Roll", "Attack Roll (Die)", "Hit (Non-Crit)", "Hit (Crit)"], axis=1)
             datac.rename(columns={"Hit": "Num Hits","Hit (Non-Crit)": "Num Hits (Non-Crit)","Hit (Crit)": "Num Hits (Crit)"}, inplace=True)
-            df_summaryc = datac.describe().drop(["count","std"],axis=0).round(2).T
+            if not summarized:
+                datac = describe(datac)
+            df_summaryc = datac.round(2).T
             df_summaryc.index.set_names([""], inplace=True)
             df_summary.append(df_summaryc)
         else:
             # Assume this is already summary stats
-            datac.rename(columns={"Hit": "Num Hits"}, inplace=True)
+            datac = datac.rename(columns={"Hit": "Num Hits"})
             datac = datac.T
             datac.index.set_names([""], inplace=True)
             df_summary.append(datac.round(2))
@@ -103,9 +170,22 @@ def summary_stats(data: List, by_round=True):
 
 
 
-def build_tables_row(characters, data_summary, by_round=True, width=12):
-    """ Builds the tables section from simulation data """
-    if by_round:
+def pmf_summary_stats(pmfs):
+    """ Summary stats of exact per round distributions, in the same layout as summary_stats """
+    df_summary = []
+    for pmfs_c in pmfs:
+        pmfs_c = {("Num Hits" if col == "Hit" else col): pmf for col, pmf in pmfs_c.items() if col != "Hit (Crit)"}
+        df_summaryc = describe_pmfs(pmfs_c).round(2).T
+        df_summaryc.index.set_names([""], inplace=True)
+        df_summary.append(df_summaryc)
+    return df_summary
+
+@timed(name="tables")
+def build_tables_row(characters, data_summary, by_round=True, width=12, title=None):
+    """ Builds the tables section from simulation data, title replaces the Per Round/Per Attack heading """
+    if title:
+        table_list = [dbc.Row(dbc.Col(html.H4(title)))]
+    elif by_round:
         table_list = [dbc.Row(dbc.Col(html.H4("Per Round")))]
     else:
         table_list = [dbc.Row(dbc.Col(html.H4("Per Attack")))]
@@ -120,9 +200,15 @@ def build_tables_row(characters, data_summary, by_round=True, width=12):
     table_list.append(dbc.Row(row))
     return table_list
 
-def add_tables(data, characters, by_round=True, width=12):
+@timed(name="tables")
+def party_tables(summary, members):
+    """ Builds the tables section of a party simulation, the fight summary next to each member's share of the damage """
+    tables = [dbc.Table.from_dataframe(df, striped=True, bordered=True, hover=True, responsive=True, index=True) for df in [summary, members]]
+    return [dbc.Row(dbc.Col(html.H4("Party"))), dbc.Row([dbc.Col(t, width={"size": 6}) for t in tables])]
+
+def add_tables(data, characters, by_round=True, width=12, summarized=False):
     """ Processes the data and then builds the tables section from simulation data"""
-    data_summary = summary_stats(data, by_round=by_round)
+    data_summary = summary_stats(data, by_round=by_round, summarized=summarized)
 
     return build_tables_row(characters, data_summary, width=width, by_round=by_round)
 
@@ -143,6 +229,7 @@ def data_from_store(store):
         dfs.append(pd.DataFrame(data))
     return names, dfs
 
+@timed(name="figure")
 def generate_line_plots(df_acs, groupby='Character', template='plotly_dark', order=None):
     """ Generates a line plot of damage vs armor class, used by DPR vs Armor Class and DPA vs Armor Class"""
     fig = go.Figure()
@@ -241,7 +328,6 @@ def generate_damage_per_attack_histogram(characters, dfs ,template='plotly_dark'
             attack_color_map[a] = COLORS[ii].lower()
 
     df_attacks = pd.concat(attacks).reset_index(drop=True)
-    df_attacks["Damage"] = df_attacks["Damage"].astype('int16') # This plot is very memory sensitive, need to reduce the size as much as possible
     df_attacks["Type"] = df_attacks["Type"].astype('category')
     fig = generate_histogram(df_attacks, x="Damage", color="Type", marginal='box',opacity=calc_opacity(len(df_attacks["Type"].unique()),o_slope=0.25), template=template,**kwargs)
     # Manually override colors
@@ -0,0 +1,215 @@
+""" Adventuring day simulation, a day of encounters and short rests with limited resources, run for many days at once as arrays
+    Every trial (day) keeps its own spell slots, rages and action surges, and each spending decision is a boolean mask over the trials,
+    so a day is a short python loop over encounters, rounds and attack slots while every trial is simulated at once """
+from dataclasses import dataclass, field, replace
+import numpy as np
+import pandas as pd
+
+from computations.context_table import compile_context_table, simulate_context_table
+from computations.numerical_simulation import RNG, estimate_bytes_per_round
+from computations.samplers import dice_sum_sampler
+from computations.stats import RunningHistogram
+
+SHORT_REST = 'short'
+MAX_SMITE_DICE = 5
+# Paladin spell slots of each level from 1st, by character level
+PALADIN_SPELL_SLOTS = {
+    1: [], 2: [2], 3: [3], 4: [3], 5: [4, 2], 6: [4, 2], 7: [4, 3], 8: [4, 3], 9: [4, 3, 2], 10: [4, 3, 2],
+    11: [4, 3, 3], 12: [4, 3, 3], 13: [4, 3, 3, 1], 14: [4, 3, 3, 1], 15: [4, 3, 3, 2], 16: [4, 3, 3, 2],
+    17: [4, 3, 3, 3, 1], 18: [4, 3, 3, 3, 1], 19: [4, 3, 3, 3, 2], 20: [4, 3, 3, 3, 2],
+}
+# Barbarian rages per long rest by character level, unlimited at 20
+BARBARIAN_RAGES = {1: 2, 3: 3, 6: 4, 12: 5, 17: 6, 20: 1000}
+
+def _smite_never(hit, crit, smited):
+    return np.zeros_like(hit)
+
+def _smite_every_hit(hit, crit, smited):
+    return hit
+
+def _smite_crit_only(hit, crit, smited):
+    return crit
+
+def _smite_first_hit(hit, crit, smited):
+    return hit & ~smited
+
+# Spending policies, given the hit and crit masks of one attack slot and whether the trial already smote this round, return the trials that want to smite
+SMITE_POLICIES = {
+    'never': _smite_never,
+    'every_hit': _smite_every_hit,
+    'crit_only': _smite_crit_only,
+    'first_hit': _smite_first_hit,
+}
+
+@dataclass
+class DayResources:
+    """ Resources available at the start of an adventuring day, after a long rest """
+    spell_slots: list[int] = field(default_factory=list) # Slots of each level from 1st
+    rages: int = 0
+    action_surges: int = 0 # Regained on a short rest
+
+    @classmethod
+    def from_character(cls, character, action_surges=0):
+        """ Paladin spell slots if the character can smite and barbarian rages if it rages, by level """
+        slots = PALADIN_SPELL_SLOTS[min(max(character.level, 1), 20)] if character.divine_smite else []
+        rages = max(r for level, r in BARBARIAN_RAGES.items() if level <= character.level) if character.raging else 0
+        return cls(spell_slots=list(slots), rages=rages, action_surges=action_surges)
+
+@dataclass
+class AdventuringDay:
+    """ Encounters of a day in order, each is its number of rounds or SHORT_REST, and how resources are spent
+        Rages are used at the start of every encounter and action surges on the first round of every encounter, while they last """
+    encounters: list = field(default_factory=lambda: [3, 3, SHORT_REST, 3, 3])
+    smite_policy: str = 'every_hit'
+    smite_slot: str = 'lowest' # 'lowest' or 'highest' spell slot available
+    action_surges: int = 0 # Per short rest, the character has no class so this is part of the day
+
+    @property
+    def encounter_rounds(self):
+        """ Number of rounds of each encounter, without the rests """
+        return [e for e in self.encounters if e != SHORT_REST]
+
+def parse_day(text):
+    """ Parses an adventuring day from text, encounters are separated by ',' and options by ';'
+        Example Usage:
+            parse_day("3, 4, short, 2, 5; smite=crit_only; slot=highest; surges=1")
+    """
+    entries = [e.strip() for e in text.split(';')]
+    encounters = []
+    for e in filter(None, (e.strip().lower() for e in entries[0].split(','))):
+        if e == SHORT_REST:
+            encounters.append(SHORT_REST)
+        elif e.isdigit() and int(e) > 0:
+            encounters.append(int(e))
+        else:
+            raise ValueError(f"Expected a number of rounds or '{SHORT_REST}', got '{e}'")
+    options = {}
+    for entry in filter(None, entries[1:]):
+        if '=' not in entry:
+            raise ValueError(f"Expected option=value, got '{entry}'")
+        name, value = (part.strip().lower() for part in entry.split('=', 1))
+        if name == 'smite' and value in SMITE_POLICIES:
+            options['smite_policy'] = value
+        elif name == 'slot' and value in ['lowest', 'highest']:
+            options['smite_slot'] = value
+        elif name == 'surges' and value.isdigit():
+            options['action_surges'] = int(value)
+        else:
+            raise ValueError(f"Unknown option '{entry}', options are smite={'/'.join(SMITE_POLICIES)}, slot=lowest/highest and surges=<number>")
+    if not any(e != SHORT_REST for e in encounters):
+        raise ValueError("The adventuring day has no encounters")
+    return AdventuringDay(encounters=encounters, **options)
+
+def spend_slots(slots, spend, highest=False):
+    """ Spends one spell slot of each trial in spend, slots has shape (trials, levels) and is updated in place
+        Returns the level (1 based) of the slot spent by each trial, 0 where none was """
+    available = slots > 0
+    if highest:
+        index = available.shape[1] - 1 - available[:, ::-1].argmax(axis=1)
+    else:
+        index = available.argmax(axis=1)
+    spend = spend & available.any(axis=1)
+    trials = np.flatnonzero(spend)
+    slots[trials, index[trials]] -= 1
+    return np.where(spend, index + 1, 0)
+
+def smite_damage(levels, crit, multiplier, rng):
+    """ Divine smite damage of slots of the given levels, 2d8 at 1st level plus 1d8 per level above, up to 5d8, with the dice doubled on a crit
+        The multiplier truncates the smite on its own rather than together with the attack's damage, which can differ by 1 with resistance """
+    damage = np.zeros(len(levels), dtype='int32')
+    num_die = np.minimum(levels + 1, MAX_SMITE_DICE) * np.where(crit, 2, 1)
+    num_die[levels == 0] = 0
+    for n in np.unique(num_die[num_die > 0]):
+        trials = np.flatnonzero(num_die == n)
+        damage[trials] = dice_sum_sampler(int(n), 8).sample(len(trials), rng)
+    if multiplier != 1:
+        damage = (damage * multiplier).astype('int32')
+    return damage
+
+def simulate_adventuring_day(character, enemy, day=None, resources=None, num_trials=10000, memory_budget=256_000_000, rng=RNG):
+    """ Simulates num_trials adventuring days of character against enemy, spending resources as the day's policies say
+        Divine smite and rage are only applied while resources last, instead of on every attack as in the other simulations
+        Returns a dictionary of histograms of the damage of each encounter and of the whole day, and the mean resources spent per encounter as a frame """
+    day = AdventuringDay() if day is None else day
+    resources = DayResources.from_character(character, action_surges=day.action_surges) if resources is None else resources
+    smite_policy = SMITE_POLICIES[day.smite_policy]
+    # Smites and rages are added by the engine, so the tables hold the character without them, then raging
+    base = replace(character, divine_smite=False, raging=False)
+    variants = [base] + ([replace(base, raging=True)] if resources.rages > 0 else [])
+    tables = [compile_context_table([v], enemy) for v in variants]
+    table = tables[0]
+    num_attacks = len(table.attack_names[0])
+    can_smite = np.array([character.divine_smite and a.type == 'weapon (melee)' for a in character.attacks], dtype=bool)
+    multiplier = float(table.damage_multiplier[0]) if num_attacks else 1.0
+
+    encounter_names = [f"Encounter {ii+1}" for ii in range(len(day.encounter_rounds))]
+    hists = {name: RunningHistogram() for name in encounter_names + ['Day']}
+    spent = pd.DataFrame(0.0, index=encounter_names, columns=['Smites', 'Slot Levels', 'Rages', 'Action Surges'])
+    chunk_size = max(int(memory_budget // max(estimate_bytes_per_round(table), 1)), 1)
+    for start in range(0, num_trials, chunk_size):
+        n = min(chunk_size, num_trials - start)
+        slots = np.tile(np.array(resources.spell_slots, dtype='int32').reshape(1, -1), (n, 1))
+        rages = np.full(n, resources.rages, dtype='int32')
+        surges = np.full(n, resources.action_surges, dtype='int32')
+        day_damage = np.zeros(n, dtype='int64')
+        encounter = 0
+        for rounds in day.encounters:
+            if rounds == SHORT_REST:
+                surges[:] = resources.action_surges
+                continue
+            name = encounter_names[encounter]
+            encounter += 1
+            raging = rages > 0
+            rages -= raging
+            spent.loc[name, 'Rages'] += raging.sum()
+            damage = np.zeros(n, dtype='int64')
+            for r in range(rounds):
+                # An action surge repeats the round's attacks
+                turns = [np.ones(n, dtype=bool)]
+                if r == 0 and resources.action_surges > 0:
+                    surging = surges > 0
+                    surges -= surging
+                    spent.loc[name, 'Action Surges'] += surging.sum()
+                    turns.append(surging)
+                # An action surge is an extra turn in the same round, so smites of every turn count towards the round
+                smited = np.zeros(n, dtype=bool)
+                for taking_turn in turns:
+                    if num_attacks == 0:
+                        break
+                    # Each table is only rolled for the trials taking this turn in its rage state
+                    attack_damage = np.zeros((num_attacks, n), dtype='int32')
+                    hit = np.zeros((num_attacks, n), dtype=bool)
+                    crit = np.zeros((num_attacks, n), dtype=bool)
+                    for variant_table, in_variant in zip(tables, [~raging, raging]):
+                        trials = np.flatnonzero(taking_turn & in_variant)
+                        if len(trials) == 0:
+                            continue
+                        results = simulate_context_table(variant_table, len(trials), rng)
+                        attack_damage[:, trials] = results['Damage'][0, :num_attacks]
+                        hit[:, trials] = results['Hit'][0, :num_attacks]
+                        crit[:, trials] = results['Hit (Crit)'][0, :num_attacks]
+                    damage += attack_damage.sum(axis=0)
+                    for a in np.flatnonzero(can_smite):
+                        levels = spend_slots(slots, smite_policy(hit[a], crit[a], smited) & hit[a], highest=day.smite_slot == 'highest')
+                        smited |= levels > 0
+                        damage += smite_damage(levels, crit[a], multiplier, rng)
+                        spent.loc[name, 'Smites'] += (levels > 0).sum()
+                        spent.loc[name, 'Slot Levels'] += levels.sum()
+            hists[name].update(damage)
+            day_damage += damage
+        hists['Day'].update(day_damage)
+    return hists, spent / num_trials
+
+def adventuring_day_summary(results):
+    """ Summary stats of the damage of each encounter and the day, followed by the mean resources spent per encounter """
+    hists, spent = results
+    df = pd.DataFrame({name: h.describe() for name, h in hists.items()})
+    return pd.concat([df, spent.T])
+
+def simulate_adventuring_day_from_characters(characters, enemy, day=None, resources=None, num_trials=10000, rng=RNG):
+    """ Adventuring day of each character, resources is a list of DayResources per character and defaults to DayResources.from_character
+        with the day's action surges. Returns the results of simulate_adventuring_day and summary stats per character """
+    day = AdventuringDay() if day is None else day
+    resources = [DayResources.from_character(c, action_surges=day.action_surges) for c in characters] if resources is None else resources
+    results = [simulate_adventuring_day(c, enemy, day=day, resources=r, num_trials=num_trials, rng=rng) for c, r in zip(characters, resources)]
+    return results, [adventuring_day_summary(r) for r in results]
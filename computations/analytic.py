@@ -1,6 +1,11 @@
 """ Analytic Computations """
+from dataclasses import dataclass, field
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 
+from computations.models import calculate_attack_and_damage_context
+
 # Analytic Values
 def expected_value(die_size):
     """ Returns the expected value of a die roll, which is a uniform distribution"""
@@ -35,3 +40,220 @@ def crit_chart():
         crit_w_adv = 1-crit_miss_w_adv
         crit_data.append([crit_on, crit_chance, crit_w_adv])
     return pd.DataFrame(crit_data, columns=['crit_on', 'crit_chance', 'crit_w_adv'])
+
+### Exact Distributions ###
+# Damage is a small integer, so distributions are stored as a dense array of probabilities starting at an integer offset
+# and combined by discrete convolution instead of sampling
+
+@dataclass
+class DiscretePMF:
+    """ Probability mass function over consecutive integers, probs[i] is the probability of the value offset + i """
+    offset: int = 0
+    probs: np.ndarray = field(default_factory=lambda: np.ones(1))
+
+    # pylint: disable=missing-function-docstring
+    @property
+    def support(self):
+        return np.arange(self.offset, self.offset + len(self.probs))
+
+    def mean(self):
+        return float(np.dot(self.support, self.probs))
+
+    def variance(self):
+        return float(np.dot((self.support - self.mean())**2, self.probs))
+
+    def cdf(self):
+        return np.cumsum(self.probs)
+
+    def quantile(self, q):
+        """ Smallest value whose cumulative probability is at least q """
+        # Small tolerance so values like 0.5 are not pushed up a bin by floating point error in the cumsum
+        index = np.searchsorted(self.cdf(), np.asarray(q) - 1e-12, side='left')
+        return self.offset + np.minimum(index, len(self.probs) - 1)
+
+    def trim(self, tol=0.0):
+        """ Removes leading and trailing values with a probability of tol or less """
+        nonzero = np.flatnonzero(self.probs > tol)
+        if len(nonzero) == 0:
+            return DiscretePMF(0, np.ones(1))
+        return DiscretePMF(self.offset + nonzero[0], self.probs[nonzero[0]:nonzero[-1]+1])
+
+def point_mass(value=0):
+    """ Distribution of a constant """
+    return DiscretePMF(int(value), np.ones(1))
+
+def convolve(*pmfs):
+    """ Distribution of the sum of independent random variables """
+    result = point_mass(0)
+    for pmf in pmfs:
+        result = DiscretePMF(result.offset + pmf.offset, np.convolve(result.probs, pmf.probs))
+    return result
+
+def mixture(weights, pmfs):
+    """ Distribution that is pmfs[i] with probability weights[i] """
+    pmfs = [p for w, p in zip(weights, pmfs) if w > 0]
+    weights = [w for w in weights if w > 0]
+    if not pmfs:
+        return point_mass(0)
+    low = min(p.offset for p in pmfs)
+    high = max(p.offset + len(p.probs) for p in pmfs)
+    probs = np.zeros(high - low)
+    for w, p in zip(weights, pmfs):
+        probs[p.offset-low:p.offset-low+len(p.probs)] += w * p.probs
+    return DiscretePMF(low, probs)
+
+def multiply_pmf(pmf, *multipliers):
+    """ Distribution of the damage after multipliers, truncated towards zero the same way the numerical simulation casts to int """
+    if all(m == 1 for m in multipliers):
+        return pmf
+    values = pmf.support.astype(float)
+    for m in multipliers:
+        values = values * m
+    values = np.trunc(values).astype(int)
+    low = values.min()
+    return DiscretePMF(int(low), np.bincount(values - low, weights=pmf.probs))
+
+@lru_cache(maxsize=None)
+def die_pmf(die_size=20, reroll_on=0, advantage=False, disadvantage=False):
+    """ Distribution of a single die, rerolling once on reroll_on or lower, optionally with advantage or disadvantage """
+    faces = np.arange(1, die_size+1)
+    reroll_on = min(max(reroll_on, 0), die_size)
+    probs = np.full(die_size, reroll_on/die_size**2)
+    probs[faces > reroll_on] += 1/die_size
+    if advantage != disadvantage:
+        cdf = np.cumsum(probs)
+        if advantage:
+            cdf = cdf**2
+        else:
+            cdf = 1 - (1 - cdf)**2
+        probs = np.diff(cdf, prepend=0)
+    probs.setflags(write=False)
+    return DiscretePMF(1, probs)
+
+@lru_cache(maxsize=256)
+def dice_sum_pmf(num_die, die_size, reroll_on=0, advantage=False, disadvantage=False):
+    """ Distribution of the sum of num_die dice, each rolled independently """
+    single = die_pmf(die_size, reroll_on=reroll_on, advantage=advantage, disadvantage=disadvantage)
+    total = convolve(*[single]*num_die)
+    total.probs.setflags(write=False)
+    return total
+
+def dice_pmf(num_die=None, die_size=None, modifier=0, **kwargs):
+    """ Distribution of multiple dice groups plus a flat modifier, i.e. num_die=[2,1], die_size=[6,8] is 2d6+1d8 """
+    num_die = [] if num_die is None else num_die
+    die_size = [] if die_size is None else die_size
+    pmf = convolve(*[dice_sum_pmf(nd, ds, **kwargs) for nd, ds in zip(num_die, die_size)])
+    return DiscretePMF(pmf.offset + modifier, pmf.probs)
+
+def attack_outcome_probabilities(attack_context, saving_throw=False):
+    """ Returns the exact probability of a miss, a hit that is not a crit, and a crit for an AttackContext
+        Follows the same rules as numerical_simulation.attack_roll """
+    if attack_context.always_crit:
+        return 0.0, 0.0, 1.0
+    if attack_context.always_hit:
+        return 0.0, 1.0, 0.0
+
+    # Bonus attack dice are rolled with the same advantage and rerolls as the d20
+    roll_kwargs = {"reroll_on": attack_context.reroll_on, "advantage": attack_context.advantage, "disadvantage": attack_context.disadvantage}
+    d20 = die_pmf(20, **roll_kwargs)
+    bonus = dice_pmf(attack_context.num_die, attack_context.die_size, modifier=attack_context.modifier, **roll_kwargs)
+    # Probability that the bonus dice and modifier are at least some value, survival[i] = P(bonus >= bonus.offset + i)
+    survival = np.append(np.cumsum(bonus.probs[::-1])[::-1], 0)
+
+    p_hit = 0.0
+    p_crit = 0.0
+    for roll, p_roll in zip(d20.support, d20.probs):
+        # Lowest bonus needed to meet the difficulty class with this roll
+        needed = attack_context.difficulty_class - roll - bonus.offset
+        p_meets_dc = survival[min(max(needed, 0), len(survival)-1)]
+        if saving_throw:
+            # Saving throws hit when the roll is below the difficulty class and can not crit
+            p_hit += p_roll * (1 - p_meets_dc)
+        elif roll == 1:
+            continue
+        elif roll >= attack_context.crit_on:
+            p_crit += p_roll
+        else:
+            p_hit += p_roll * p_meets_dc
+    return 1 - p_hit - p_crit, p_hit, p_crit
+
+def damage_component_pmfs(damage_context):
+    """ Returns the exact damage distributions for a hit, the additional damage on a crit, and a miss for a DamageContext
+        Follows the same rules as numerical_simulation.damage_roll """
+    roll_kwargs = {"reroll_on": damage_context.reroll_on, "advantage": damage_context.advantage, "disadvantage": damage_context.disadvantage}
+    hit = dice_pmf(damage_context.num_die, damage_context.die_size, modifier=damage_context.modifier, **roll_kwargs)
+    hit = multiply_pmf(hit, damage_context.damage_multiplier)
+    # Crits roll the hit dice again, plus any bonus crit dice, but not the hit modifier
+    crit = dice_pmf(
+        damage_context.num_die + damage_context.crit_num_die,
+        damage_context.die_size + damage_context.crit_damage_die,
+        modifier=damage_context.crit_damage_modifier,
+        **roll_kwargs)
+    crit = multiply_pmf(crit, damage_context.damage_multiplier)
+    miss = dice_pmf(damage_context.miss_num_die, damage_context.miss_damage_die, modifier=damage_context.miss_damage_modifier, **roll_kwargs)
+    miss = multiply_pmf(miss, damage_context.failed_multiplier, damage_context.damage_multiplier)
+    return hit, crit, miss
+
+def attack_pmfs(attack_context, damage_context, **kwargs):
+    """ Exact distributions of a single attack, keyed the same as the columns of numerical_simulation.simulate_rounds """
+    p_miss, p_hit, p_crit = attack_outcome_probabilities(attack_context, **kwargs)
+    hit, crit, miss = damage_component_pmfs(damage_context)
+    p_any_hit = p_hit + p_crit
+    return {
+        "Damage": mixture([p_miss, p_hit, p_crit], [miss, hit, convolve(hit, crit)]),
+        "Damage (From Hit)": mixture([1 - p_any_hit, p_any_hit], [point_mass(0), hit]),
+        "Damage (From Crit)": mixture([1 - p_crit, p_crit], [point_mass(0), crit]),
+        "Damage (Miss/Fail)": mixture([p_any_hit, p_miss], [point_mass(0), miss]),
+        "Hit": mixture([1 - p_any_hit, p_any_hit], [point_mass(0), point_mass(1)]),
+        "Hit (Crit)": mixture([1 - p_crit, p_crit], [point_mass(0), point_mass(1)]),
+    }
+
+def expected_damage(attack_context, damage_context, **kwargs):
+    """ Exact mean damage of a single attack, without building its full distribution """
+    p_miss, p_hit, p_crit = attack_outcome_probabilities(attack_context, **kwargs)
+    hit, crit, miss = damage_component_pmfs(damage_context)
+    return p_miss * miss.mean() + (p_hit + p_crit) * hit.mean() + p_crit * crit.mean()
+
+def expected_damage_per_round(character, enemy, **kwargs):
+    """ Exact mean damage per round of a character, the sum of the mean damage of its attacks """
+    attack_contexts, damage_contexts = calculate_attack_and_damage_context(character, enemy)
+    return sum(expected_damage(a, d, **kwargs) for a, d in zip(attack_contexts, damage_contexts))
+
+def round_pmfs(attack_contexts, damage_contexts, attack_names, **kwargs):
+    """ Exact distributions per attack name and per round, attacks are independent so rounds are a convolution of the attacks
+        Attacks with the same name are pooled, the same as numerical_simulation.simulate_rounds_from_contexts """
+    per_attack = [attack_pmfs(a, d, **kwargs) for a, d in zip(attack_contexts, damage_contexts)]
+    by_round = {col: convolve(*[p[col] for p in per_attack]) for col in per_attack[0]} if per_attack else {}
+
+    by_name = {}
+    for name, pmfs in zip(attack_names, per_attack):
+        by_name.setdefault(name, []).append(pmfs)
+    by_attack = {}
+    for name, pmfs_list in by_name.items():
+        weights = [1/len(pmfs_list)]*len(pmfs_list)
+        by_attack[name] = {col: mixture(weights, [p[col] for p in pmfs_list]) for col in pmfs_list[0]}
+    return by_attack, by_round
+
+def damage_pmfs_from_characters(characters, enemy, **kwargs):
+    """ Exact damage distributions for a list of characters against an enemy, the analytic counterpart of simulate_rounds_from_characters
+        Returns a list of per attack distributions and a list of per round distributions """
+    pmfs_by_attack = []
+    pmfs_by_round = []
+    for c in characters:
+        attack_contexts, damage_contexts = calculate_attack_and_damage_context(c, enemy)
+        by_attack, by_round = round_pmfs(attack_contexts, damage_contexts, [a.name for a in c.attacks], **kwargs)
+        pmfs_by_attack.append(by_attack)
+        pmfs_by_round.append(by_round)
+    return pmfs_by_attack, pmfs_by_round
+
+def describe_pmf(pmf):
+    """ Exact counterpart of numerical_simulation.describe for a single distribution """
+    pmf = pmf.trim()
+    quartiles = pmf.quantile([0.25, 0.5, 0.75])
+    return pd.Series(
+        [pmf.mean(), pmf.offset, *quartiles, pmf.offset + len(pmf.probs) - 1],
+        index=['mean','min','25%','50%','75%','max'])
+
+def describe_pmfs(pmfs):
+    """ Summary stats for a dictionary of distributions, in the same layout as numerical_simulation.describe """
+    return pd.DataFrame({col: describe_pmf(pmf) for col, pmf in pmfs.items()})
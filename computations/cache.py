@@ -0,0 +1,131 @@
+""" Content addressed cache of simulation results
+    Results are keyed by a hash of the parsed characters, enemy and simulation parameters, so the same inputs and seed are only simulated once.
+    Only compact results (histograms and summary stats) should be cached, the cache evicts the least recently used results above a size budget """
+from collections import OrderedDict
+from dataclasses import asdict, is_dataclass
+import hashlib
+import json
+import sys
+from threading import Lock
+import numpy as np
+import pandas as pd
+
+from computations.stats import RunningHistogram
+from computations.analytic import DiscretePMF
+from computations.models import compile_spec
+from utilities.instrumentation import increment, is_enabled, set_gauge, span
+
+MAX_CACHE_BYTES = 64_000_000
+
+def _canonical(obj):
+    """ JSON serializable form of obj with a stable ordering, used for hashing """
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return {'__type__': type(obj).__name__, **{k: _canonical(v) for k, v in asdict(obj).items()}}
+    if isinstance(obj, dict):
+        return {str(k): _canonical(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, range)):
+        return [_canonical(v) for v in obj]
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+def canonical_key(*objects, **params):
+    """ Hash of the objects and parameters, equal inputs always give equal keys """
+    payload = json.dumps(_canonical([objects, params]), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def nbytes(obj):
+    """ Approximate memory used by a cached result """
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(np.sum(obj.memory_usage(deep=True)))
+    if isinstance(obj, RunningHistogram):
+        return obj.counts.nbytes + sys.getsizeof(obj)
+    if isinstance(obj, DiscretePMF):
+        return obj.probs.nbytes + sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(nbytes(k) + nbytes(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(nbytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+class ResultCache:
+    """ Least recently used cache with a budget in bytes instead of a number of entries """
+    def __init__(self, max_bytes=MAX_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict() # key -> (value, size)
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """ Returns the cached value and marks it as recently used """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                increment('result_cache_requests_total', outcome='miss')
+                return default
+            self.hits += 1
+            increment('result_cache_requests_total', outcome='hit')
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value):
+        """ Caches value, evicting the least recently used values until it fits. Values larger than the whole budget are not cached """
+        size = nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return value
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            set_gauge('result_cache_bytes', self.current_bytes)
+        return value
+
+    def get_or_compute(self, key, f, *args, **kwargs):
+        """ Returns the cached value for key, or computes it with f(*args, **kwargs) and caches it """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = self.put(key, f(*args, **kwargs))
+        return value
+
+    def clear(self):
+        """ Removes every cached value """
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+# Shared by the simulate and export callbacks
+RESULT_CACHE = ResultCache()
+
+def cached(kind, f, characters, enemy, seed=None, cache=RESULT_CACHE, **params):
+    """ Runs f(characters, enemy, **params) once per distinct compiled characters, kind, seed and params
+        Characters are keyed by their compiled specs, so fields that do not change the simulation do not change the key
+        When seed is given, f is also passed a new random generator seeded with it, so cached results are the same as recomputed ones """
+    key = canonical_key([compile_spec(c, enemy) for c in characters], kind=kind, seed=seed, **params)
+    if seed is not None:
+        params['rng'] = np.random.default_rng(seed)
+
+    def compute(*args, **kwargs):
+        """ f timed as a span named after the kind of result, recording the size of the result """
+        with span(kind):
+            value = f(*args, **kwargs)
+        if is_enabled():
+            set_gauge('result_bytes', nbytes(value), kind=kind)
+        return value
+    return cache.get_or_compute(key, compute, characters, enemy, **params)
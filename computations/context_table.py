@@ -0,0 +1,292 @@
+""" Struct-of-arrays table of attack and damage contexts and a batched numpy kernel that simulates every row at once
+    Every character and attack is one row of the table, so the whole simulation is a handful of array operations
+    instead of a python loop with a DataFrame per attack """
+from dataclasses import dataclass, field
+import numpy as np
+
+from computations.dice import DiceSource, MAX_CARVED_DIE
+from computations.models import calculate_attack_and_damage_context
+from computations.samplers import die_sampler, dice_sum_sampler
+from utilities.instrumentation import timed, increment, counting_rng
+
+# Columns of the simulation results, in the same order as numerical_simulation.simulate_rounds
+RESULT_COLUMNS = ['Damage', 'Damage (From Hit)', 'Damage (From Crit)', 'Damage (Miss/Fail)', 'Attack Roll', 'Attack Roll (Die)', 'Hit', 'Hit (Non-Crit)', 'Hit (Crit)']
+
+@dataclass
+class ContextTable:
+    """ Attack and damage contexts of every character and attack, one row per (character, attack slot)
+        Characters with fewer attacks are padded with inactive rows, so row c*max_attacks + a is attack a of character c
+        Dice are stored as padded (rows, terms) arrays of die counts and die sizes, i.e. 2d6+1d8 is num_die=[2,1], die_size=[6,8] """
+    num_characters: int = 0
+    max_attacks: int = 0
+    attack_names: list = field(default_factory=list) # Attack names per character
+    active: np.ndarray = None
+    # Attack roll
+    modifier: np.ndarray = None
+    difficulty_class: np.ndarray = None
+    crit_on: np.ndarray = None
+    reroll_on: np.ndarray = None
+    advantage: np.ndarray = None
+    disadvantage: np.ndarray = None
+    always_hit: np.ndarray = None
+    always_crit: np.ndarray = None
+    saving_throw: np.ndarray = None
+    attack_num_die: np.ndarray = None
+    attack_die_size: np.ndarray = None
+    # Hit damage
+    damage_num_die: np.ndarray = None
+    damage_die_size: np.ndarray = None
+    damage_modifier: np.ndarray = None
+    damage_multiplier: np.ndarray = None
+    damage_advantage: np.ndarray = None
+    damage_disadvantage: np.ndarray = None
+    damage_reroll_on: np.ndarray = None
+    # Additional crit damage, the hit dice are rolled again plus any bonus crit dice
+    crit_num_die: np.ndarray = None
+    crit_die_size: np.ndarray = None
+    crit_modifier: np.ndarray = None
+    # Miss damage
+    miss_num_die: np.ndarray = None
+    miss_die_size: np.ndarray = None
+    miss_modifier: np.ndarray = None
+    failed_multiplier: np.ndarray = None
+
+    @property
+    def num_rows(self):
+        """ Number of rows, including padding """
+        return self.num_characters * self.max_attacks
+
+def _pad_dice(num_die_lists, die_size_lists):
+    """ Pads lists of dice terms to a (rows, terms) array of counts and sizes, dropping empty terms """
+    rows = [[(n, s) for n, s in zip(nds, dss) if n > 0 and s > 0] for nds, dss in zip(num_die_lists, die_size_lists)]
+    num_terms = max([len(r) for r in rows], default=0)
+    num_die = np.zeros((len(rows), num_terms), dtype='int32')
+    die_size = np.zeros((len(rows), num_terms), dtype='int32')
+    for ii, r in enumerate(rows):
+        for jj, (n, s) in enumerate(r):
+            num_die[ii, jj] = n
+            die_size[ii, jj] = s
+    return num_die, die_size
+
+@timed(name="contexts")
+def compile_context_table(characters, enemy, contexts=None, saving_throw=False):
+    """ Compiles the attack and damage contexts of every character's attacks into a ContextTable
+        contexts can be a list of precomputed (attack_contexts, damage_contexts) per character """
+    if contexts is None:
+        contexts = [calculate_attack_and_damage_context(c, enemy) for c in characters]
+    max_attacks = max([len(a) for a, _ in contexts], default=0)
+    # Padding rows never hit and do no damage
+    rows = []
+    for attack_contexts, damage_contexts in contexts:
+        for ii in range(max_attacks):
+            if ii < len(attack_contexts):
+                rows.append((True, attack_contexts[ii], damage_contexts[ii]))
+            else:
+                rows.append((False, None, None))
+
+    def column(get, default, dtype):
+        return np.array([get(a, d) if is_active else default for is_active, a, d in rows], dtype=dtype)
+
+    def dice(get):
+        terms = [get(a, d) if is_active else ([], []) for is_active, a, d in rows]
+        return _pad_dice([t[0] for t in terms], [t[1] for t in terms])
+
+    attack_num_die, attack_die_size = dice(lambda a, d: (a.num_die, a.die_size))
+    damage_num_die, damage_die_size = dice(lambda a, d: (d.num_die, d.die_size))
+    crit_num_die, crit_die_size = dice(lambda a, d: (d.num_die + d.crit_num_die, d.die_size + d.crit_damage_die))
+    miss_num_die, miss_die_size = dice(lambda a, d: (d.miss_num_die, d.miss_damage_die))
+    return ContextTable(
+        num_characters=len(contexts),
+        max_attacks=max_attacks,
+        attack_names=[[a.name for a in c.attacks] for c in characters],
+        active=column(lambda a, d: True, False, bool),
+        modifier=column(lambda a, d: a.modifier, 0, 'int32'),
+        difficulty_class=column(lambda a, d: a.difficulty_class, np.iinfo('int32').max, 'int32'),
+        crit_on=column(lambda a, d: a.crit_on, 21, 'int32'),
+        reroll_on=column(lambda a, d: a.reroll_on, 0, 'int32'),
+        advantage=column(lambda a, d: a.advantage, False, bool),
+        disadvantage=column(lambda a, d: a.disadvantage, False, bool),
+        always_hit=column(lambda a, d: a.always_hit, False, bool),
+        always_crit=column(lambda a, d: a.always_crit, False, bool),
+        saving_throw=column(lambda a, d: saving_throw, False, bool),
+        attack_num_die=attack_num_die,
+        attack_die_size=attack_die_size,
+        damage_num_die=damage_num_die,
+        damage_die_size=damage_die_size,
+        damage_modifier=column(lambda a, d: d.modifier, 0, 'int32'),
+        damage_multiplier=column(lambda a, d: d.damage_multiplier, 1, float),
+        damage_advantage=column(lambda a, d: d.advantage, False, bool),
+        damage_disadvantage=column(lambda a, d: d.disadvantage, False, bool),
+        damage_reroll_on=column(lambda a, d: d.reroll_on, 0, 'int32'),
+        crit_num_die=crit_num_die,
+        crit_die_size=crit_die_size,
+        crit_modifier=column(lambda a, d: d.crit_damage_modifier, 0, 'int32'),
+        miss_num_die=miss_num_die,
+        miss_die_size=miss_die_size,
+        miss_modifier=column(lambda a, d: d.miss_damage_modifier, 0, 'int32'),
+        failed_multiplier=column(lambda a, d: d.failed_multiplier, 0, float),
+    )
+
+### Kernel ###
+
+def _dice_from_uniforms(uniforms, die_size):
+    """ Maps uniforms in [0, 1) to die faces 1..die_size """
+    return (uniforms * die_size).astype('int32') + 1
+
+def _pack_keys(die_size, reroll_on, advantage, disadvantage):
+    """ Packs the parameters of a die into one small non-negative integer per row """
+    return ((die_size.astype('int64') * 64 + np.clip(reroll_on, 0, 63)) * 2 + advantage) * 2 + disadvantage
+
+def roll_cells(die_size, shape, advantage, disadvantage, reroll_on, rng, uniforms=None):
+    """ Rolls dice for many cells at once, every argument has one row per cell and is broadcast against shape
+        Rerolls happen once on reroll_on or lower, and advantage/disadvantage take the max/min of two independently rerolled dice
+        These transformed dice are drawn from cached alias tables of their exact distributions, so every die is a single uniform
+        A DiceSource rng carves a single die size from raw bits as uint8
+        Given uniforms, every die is an increasing function of its uniform (inverse CDF), so dice rolled from the same uniforms are as correlated as possible """
+    def per_row(x):
+        return np.broadcast_to(x, (shape[0], 1))[:, 0]
+    use_advantage = per_row(advantage & ~disadvantage)
+    use_disadvantage = per_row(disadvantage & ~advantage)
+    row_reroll_on = per_row(reroll_on)
+    row_die_size = per_row(die_size)
+    transformed = (use_advantage | use_disadvantage | (row_reroll_on > 0)) & (row_die_size > 0)
+
+    monotonic = uniforms is not None
+    if not transformed.any():
+        if not monotonic and isinstance(getattr(rng, 'unwrapped', rng), DiceSource) and np.isscalar(die_size) and die_size <= MAX_CARVED_DIE:
+            return rng.dice(die_size, shape)
+        return _dice_from_uniforms(rng.random(shape) if uniforms is None else uniforms, die_size)
+
+    uniforms = rng.random(shape) if uniforms is None else uniforms
+    rolls = _dice_from_uniforms(uniforms, die_size)
+    keys = np.where(transformed, _pack_keys(row_die_size, row_reroll_on, use_advantage, use_disadvantage), -1)
+    for key in np.flatnonzero(np.bincount(keys[transformed])):
+        rows = np.flatnonzero(keys == key)
+        params = int(row_die_size[rows[0]]), int(row_reroll_on[rows[0]]), bool(use_advantage[rows[0]]), bool(use_disadvantage[rows[0]])
+        # Alias tables are faster but do not map uniforms to dice in order
+        sampler = dice_sum_sampler(1, *params) if monotonic else die_sampler(*params)
+        rolls[rows] = sampler.lookup(uniforms[rows])
+    return rolls
+
+def roll_terms(rows, num_die, die_size, advantage, disadvantage, reroll_on, rng, draw=None):
+    """ Sum of padded dice terms for each cell, rows is the table row of each cell
+        num_die and die_size have shape (table rows, terms) and the other arguments shape (table rows,)
+        Each term is drawn as one sum from the exact distribution of its dice, so it takes one uniform per cell instead of one per die
+        draw() can replace rng.random(len(rows)) as the source of each term's uniforms """
+    total = np.zeros(len(rows), dtype='int32')
+    use_advantage = advantage & ~disadvantage
+    use_disadvantage = disadvantage & ~advantage
+    for k in range(num_die.shape[1]):
+        # Table rows with the same dice share a sampler, there are only a few distinct ones
+        params = list(zip(num_die[:, k].tolist(), die_size[:, k].tolist(), reroll_on.tolist(), use_advantage.tolist(), use_disadvantage.tolist()))
+        groups = list(dict.fromkeys(p for p in params if p[0] > 0 and p[1] > 0))
+        if not groups:
+            continue
+        group_of_row = np.array([groups.index(p) if p in groups else -1 for p in params])
+        cell_groups = group_of_row[rows]
+        uniforms = rng.random(len(rows)) if draw is None else draw()
+        for g, p in enumerate(groups):
+            cells = np.flatnonzero(cell_groups == g)
+            total[cells] += dice_sum_sampler(*p).lookup(uniforms[cells])
+    return total
+
+def _damage_cells(mask, num_die, die_size, modifier, multipliers, table, rng, shared_uniforms=None):
+    """ Rolls damage only for the (row, round) cells in mask and returns it as a full (rows, rounds) array
+        shared_uniforms(rows, rounds) can replace rng as the source of uniforms for the given cells """
+    damage = np.zeros(mask.shape, dtype='int32')
+    rows, rounds = np.nonzero(mask)
+    if len(rows) == 0:
+        return damage
+    sums = modifier[rows] + roll_terms(
+        rows,
+        num_die,
+        die_size,
+        table.damage_advantage,
+        table.damage_disadvantage,
+        table.damage_reroll_on,
+        rng,
+        draw=None if shared_uniforms is None else lambda: shared_uniforms(rows, rounds))
+    multipliers = [m for m in multipliers if (m != 1).any()]
+    if multipliers:
+        values = sums.astype(float)
+        for m in multipliers:
+            values = values * m[rows]
+        sums = values.astype('int32') # Truncate towards zero, the same as numerical_simulation.damage_roll
+    damage[mask] = sums
+    return damage
+
+@timed(name="roll")
+def simulate_context_table(table, num_rounds, rng, paired=False):
+    """ Simulates num_rounds rounds of every row of the table at once
+        With paired, every character sees the same uniforms for the same attack slot and round (common random numbers),
+        and dice are increasing functions of their uniforms, so differences between characters have far less noise than independent simulations
+        Returns a dictionary of RESULT_COLUMNS, each a (characters, attacks, rounds) array """
+    increment('rounds_simulated_total', num_rounds * table.num_characters, engine='batched')
+    rng = counting_rng(rng)
+    n = table.num_rows
+    shape = (n, num_rounds)
+    def column(x):
+        return x[:, np.newaxis]
+
+    shared_uniforms = None
+    d20_uniforms = None
+    if paired:
+        num_slots = max(table.max_attacks, 1)
+        slots = np.arange(n) % num_slots
+        def shared_uniforms(rows, rounds):
+            """ One uniform per (attack slot, round), indexed for the given cells """
+            return rng.random((num_slots, num_rounds))[slots[rows], rounds]
+        d20_uniforms = rng.random((num_slots, num_rounds))[slots]
+
+    # Attack rolls
+    rolls = roll_cells(20, shape, column(table.advantage), column(table.disadvantage), column(table.reroll_on), rng, uniforms=d20_uniforms)
+    attack_rolls = rolls + column(table.modifier)
+    if table.attack_num_die.size > 0 and table.attack_num_die.any():
+        # Bonus attack dice use the same advantage and rerolls as the d20
+        rows, rounds = np.repeat(np.arange(n), num_rounds), np.tile(np.arange(num_rounds), n)
+        attack_rolls += roll_terms(
+            rows,
+            table.attack_num_die,
+            table.attack_die_size,
+            table.advantage,
+            table.disadvantage,
+            table.reroll_on,
+            rng,
+            draw=None if shared_uniforms is None else lambda: shared_uniforms(rows, rounds)).reshape(shape)
+    hit = np.logical_and(attack_rolls >= column(table.difficulty_class), rolls != 1)
+    crit = np.logical_and(rolls >= column(table.crit_on), rolls != 1)
+    hit |= crit
+    # Saving throws hit when the roll is below the difficulty class and can not crit
+    saving_throw = table.saving_throw
+    if saving_throw.any():
+        hit[saving_throw] = attack_rolls[saving_throw] < column(table.difficulty_class[saving_throw])
+        crit[saving_throw] = False
+    # Special cases
+    special = table.always_hit | table.always_crit
+    if special.any():
+        rolls[special] = 20
+        attack_rolls[special] = 20 + column(table.modifier[special])
+        hit[special] = True
+        crit[special] = column(table.always_crit[special])
+    hit &= column(table.active)
+    crit &= column(table.active)
+
+    # Damage
+    hit_damage = _damage_cells(hit, table.damage_num_die, table.damage_die_size, table.damage_modifier, [table.damage_multiplier], table, rng, shared_uniforms)
+    crit_damage = _damage_cells(crit, table.crit_num_die, table.crit_die_size, table.crit_modifier, [table.damage_multiplier], table, rng, shared_uniforms)
+    miss_damage = _damage_cells(~hit & column(table.active), table.miss_num_die, table.miss_die_size, table.miss_modifier,
+                                [table.failed_multiplier, table.damage_multiplier], table, rng, shared_uniforms)
+
+    results = {
+        'Damage': hit_damage + crit_damage + miss_damage,
+        'Damage (From Hit)': hit_damage,
+        'Damage (From Crit)': crit_damage,
+        'Damage (Miss/Fail)': miss_damage,
+        'Attack Roll': attack_rolls,
+        'Attack Roll (Die)': rolls,
+        'Hit': hit,
+        'Hit (Non-Crit)': hit != crit,
+        'Hit (Crit)': crit,
+    }
+    tensor_shape = (table.num_characters, table.max_attacks, num_rounds)
+    return {k: v.reshape(tensor_shape) for k, v in results.items()}
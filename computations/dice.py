@@ -0,0 +1,98 @@
+""" Bit efficient dice source
+    Dice are carved out of the raw 64-bit words of a numpy BitGenerator, eight one-byte dice per word, instead of drawing one int64 per die.
+    Bytes at or above the largest multiple of the die size below 256 are rejected so every face is equally likely,
+    the rest are mapped to faces with a 256 entry lookup table """
+from functools import lru_cache
+from time import perf_counter
+import numpy as np
+
+BIT_GENERATORS = {
+    'PCG64': np.random.PCG64,
+    'SFC64': np.random.SFC64,
+    'Philox': np.random.Philox,
+}
+MAX_CARVED_DIE = 255 # Dice up to this size fit in uint8 and are carved, larger ranges use Generator.integers
+
+@lru_cache(maxsize=None)
+def carving_table(die_size):
+    """ Lookup table from a random byte to a die face, rejected bytes map to 0
+        Returns the table and the fraction of bytes that are accepted """
+    limit = (256 // die_size) * die_size
+    table = np.zeros(256, dtype='uint8')
+    table[:limit] = np.arange(limit) % die_size + 1
+    table.flags.writeable = False
+    return table, limit / 256
+
+class DiceSource:
+    """ Random number source that carves uint8 dice from raw bits
+        It has the same integers and random methods as np.random.Generator, so it can be passed anywhere an rng is used
+        Example Usage:
+            rng = DiceSource(seed=1, bit_generator='SFC64', method='carve')
+            rng.dice(6, 1000) # 1000 d6 as uint8
+            rng.integers(1, 21, size=1000) # 1000 d20, the same as np.random.Generator.integers
+    """
+    def __init__(self, seed=None, bit_generator='PCG64', method='numpy'):
+        """ method is 'carve' to carve dice from raw bits with a lookup table, or 'numpy' to use Generator.integers with a uint8 dtype,
+            which splits buffered 32-bit words into bytes in C and is usually the fastest, see benchmark_bit_generators """
+        self.method = method
+        self.bit_generator = BIT_GENERATORS[bit_generator](seed)
+        self.generator = np.random.Generator(self.bit_generator)
+
+    def dice(self, die_size, size):
+        """ Rolls size dice with faces 1..die_size, returned as uint8 """
+        shape = (size,) if np.isscalar(size) else tuple(size)
+        num = int(np.prod(shape))
+        if self.method == 'numpy':
+            return self.generator.integers(1, die_size + 1, size=shape, dtype='uint8')
+        table, acceptance = carving_table(die_size)
+        dice = np.empty(num, dtype='uint8')
+        filled = 0
+        while filled < num:
+            # Enough words for the remaining dice on average plus a small margin, so one pass is usually enough
+            num_words = int((num - filled) * 1.01 / (8 * acceptance)) + 1
+            faces = table[self.bit_generator.random_raw(num_words).view('uint8')]
+            if acceptance < 1:
+                faces = faces[faces != 0]
+            faces = faces[:num - filled]
+            dice[filled:filled+len(faces)] = faces
+            filled += len(faces)
+        return dice.reshape(shape)
+
+    def integers(self, low, high=None, size=None, dtype=np.int64, endpoint=False):
+        """ Same as np.random.Generator.integers, small ranges are carved from raw bits """
+        if high is None:
+            low, high = 0, low
+        if endpoint:
+            high = high + 1
+        if not (np.isscalar(low) and np.isscalar(high)) or size is None or high - low > MAX_CARVED_DIE:
+            return self.generator.integers(low, high, size=size, dtype=dtype)
+        values = self.dice(int(high - low), size)
+        # Shift in the requested dtype, the uint8 dice would overflow for most offsets
+        return np.add(values, low - 1, dtype=dtype)
+
+    def random(self, size=None, dtype=np.float64, out=None):
+        """ Same as np.random.Generator.random """
+        return self.generator.random(size=size, dtype=dtype, out=out)
+
+def benchmark_bit_generators(die_size=6, num_dice=10_000_000, seed=1):
+    """ Dice per second for each bit generator, carved from raw bits and with Generator.integers as int64 and uint8 for comparison """
+    def draws_per_second(f):
+        start = perf_counter()
+        f()
+        return num_dice / (perf_counter() - start)
+
+    report = {}
+    for name, bit_generator in BIT_GENERATORS.items():
+        source = DiceSource(seed, name)
+        generator = np.random.Generator(bit_generator(seed))
+        report[name] = {
+            'carved': draws_per_second(lambda: source.dice(die_size, num_dice)),
+            'integers (int64)': draws_per_second(lambda: generator.integers(1, die_size + 1, size=num_dice)),
+            'integers (uint8)': draws_per_second(lambda: generator.integers(1, die_size + 1, size=num_dice, dtype='uint8')),
+        }
+    return report
+
+if __name__ == '__main__':
+    for die in [6, 20]:
+        for bit_generator_name, rates in benchmark_bit_generators(die).items():
+            print(f"d{die} {bit_generator_name}: " + ", ".join(f"{method} {rate/1e6:.0f}M dice/sec" for method, rate in rates.items()))
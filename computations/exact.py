@@ -0,0 +1,107 @@
+""" Brute force exact distributions for small configurations, the reference that the simulation engines and the analytic convolutions are checked against
+    Every face of every physical die is enumerated, including the second die of advantage/disadvantage and the die rolled again on a reroll,
+    so every outcome is equally likely and the rules are applied to the outcomes directly, the same way the kernels apply them to random dice.
+    The attack roll, hit, crit and miss dice are independent, so each is enumerated as its own block and the blocks are joined by enumerating every pair of values.
+    Nothing is shared with computations/analytic.py besides the DiscretePMF container, so the two are independent checks of each other """
+import numpy as np
+
+from computations.analytic import DiscretePMF
+from computations.models import calculate_attack_and_damage_context
+
+MAX_OUTCOMES = 2_000_000 # Outcomes of one enumerated block, larger configurations raise a ValueError
+
+def enumerate_dice(die_sizes, reroll_on=0, advantage=False, disadvantage=False):
+    """ Every equally likely outcome of the logical dice of die_sizes, as an array of shape (dice, outcomes) of each die's value
+        A die that rerolls is two physical dice, the second replacing the first on reroll_on or lower, and advantage/disadvantage
+        take the max/min of two such dice, so a d20 with advantage and a reroll is four physical d20 """
+    rerolls = 2 if reroll_on > 0 else 1
+    copies = 2 if advantage != disadvantage else 1
+    physical = [s for s in die_sizes for _ in range(rerolls * copies)]
+    num_outcomes = int(np.prod(physical, dtype=float))
+    if num_outcomes > MAX_OUTCOMES:
+        raise ValueError(f"{num_outcomes:,} outcomes is too many to enumerate, the limit is {MAX_OUTCOMES:,}")
+    if not physical:
+        return np.zeros((0, 1), dtype='int16')
+    faces = np.indices(physical, dtype='int16').reshape(len(physical), -1) + 1
+    faces = faces.reshape(len(die_sizes), copies, rerolls, -1)
+    values = np.where(faces[:, :, 0] <= reroll_on, faces[:, :, -1], faces[:, :, 0]) # (dice, copies, outcomes)
+    if advantage and not disadvantage:
+        return values.max(axis=1)
+    if disadvantage and not advantage:
+        return values.min(axis=1)
+    return values[:, 0]
+
+def _logical_dice(num_die, die_size):
+    """ Die size of every logical die of padded terms, i.e. [2, 1], [6, 8] is [6, 6, 8] """
+    return [s for n, s in zip(num_die, die_size) if n > 0 and s > 0 for _ in range(n)]
+
+def _distribution(values, weights):
+    """ DiscretePMF of integer values with the given weights """
+    values = np.asarray(values, dtype='int64').ravel()
+    low = int(values.min())
+    return DiscretePMF(low, np.bincount(values - low, weights=np.asarray(weights, dtype=float).ravel()))
+
+def _join(*pmfs):
+    """ Distribution of the sum of independent distributions, by enumerating every combination of their values """
+    values, weights = np.zeros(1, dtype='int64'), np.ones(1)
+    for pmf in pmfs:
+        values = np.add.outer(values, pmf.support).ravel()
+        weights = np.multiply.outer(weights, pmf.probs).ravel()
+    return _distribution(values, weights)
+
+def attack_outcome_probabilities(attack_context, saving_throw=False):
+    """ Exact probability of a miss, a hit that is not a crit, and a crit, by enumerating the d20 and any bonus attack dice
+        Follows the same rules as context_table.simulate_context_table """
+    if attack_context.always_crit:
+        return 0.0, 0.0, 1.0
+    if attack_context.always_hit:
+        return 0.0, 1.0, 0.0
+    # Bonus attack dice are rolled with the same advantage and rerolls as the d20
+    dice = enumerate_dice([20] + _logical_dice(attack_context.num_die, attack_context.die_size),
+                          attack_context.reroll_on, attack_context.advantage, attack_context.disadvantage)
+    rolls = dice[0]
+    attack_rolls = dice.sum(axis=0, dtype='int64') + attack_context.modifier
+    if saving_throw:
+        hit = attack_rolls < attack_context.difficulty_class
+        crit = np.zeros_like(hit)
+    else:
+        hit = (attack_rolls >= attack_context.difficulty_class) & (rolls != 1)
+        crit = (rolls >= attack_context.crit_on) & (rolls != 1)
+        hit |= crit
+    num_outcomes = rolls.size
+    p_crit = crit.sum() / num_outcomes
+    p_hit = hit.sum() / num_outcomes - p_crit
+    return 1 - p_hit - p_crit, p_hit, p_crit
+
+def damage_pmf(num_die, die_size, modifier=0, multipliers=(), reroll_on=0, advantage=False, disadvantage=False):
+    """ Exact distribution of a damage roll, the enumerated dice plus the modifier, times every multiplier and truncated towards zero once """
+    dice = enumerate_dice(_logical_dice(num_die, die_size), reroll_on, advantage, disadvantage)
+    values = dice.sum(axis=0, dtype='int64') + modifier
+    if any(m != 1 for m in multipliers):
+        values = values.astype(float)
+        for m in multipliers:
+            values = values * m
+        values = np.trunc(values).astype('int64')
+    return _distribution(values, np.full(values.shape, 1 / values.size))
+
+def exact_attack_pmf(attack_context, damage_context, saving_throw=False):
+    """ Exact damage distribution of a single attack, a miss does the miss damage, a hit the hit damage and a crit the hit damage plus the crit damage """
+    p_miss, p_hit, p_crit = attack_outcome_probabilities(attack_context, saving_throw=saving_throw)
+    roll_kwargs = {'reroll_on': damage_context.reroll_on, 'advantage': damage_context.advantage, 'disadvantage': damage_context.disadvantage}
+    hit = damage_pmf(damage_context.num_die, damage_context.die_size, damage_context.modifier, [damage_context.damage_multiplier], **roll_kwargs)
+    # Crits roll the hit dice again plus any bonus crit dice, without the hit modifier
+    crit = damage_pmf(damage_context.num_die + damage_context.crit_num_die, damage_context.die_size + damage_context.crit_damage_die,
+                      damage_context.crit_damage_modifier, [damage_context.damage_multiplier], **roll_kwargs)
+    miss = damage_pmf(damage_context.miss_num_die, damage_context.miss_damage_die, damage_context.miss_damage_modifier,
+                      [damage_context.failed_multiplier, damage_context.damage_multiplier], **roll_kwargs)
+    outcomes = [(p_miss, miss), (p_hit, hit), (p_crit, _join(hit, crit))]
+    return _distribution(np.concatenate([pmf.support for _, pmf in outcomes]), np.concatenate([p * pmf.probs for p, pmf in outcomes]))
+
+def exact_round_pmf(character, enemy, **kwargs):
+    """ Exact distribution of a character's damage per round, every combination of its independent attacks """
+    attack_contexts, damage_contexts = calculate_attack_and_damage_context(character, enemy)
+    return _join(*[exact_attack_pmf(a, d, **kwargs) for a, d in zip(attack_contexts, damage_contexts)])
+
+def exact_round_pmfs(characters, enemy, **kwargs):
+    """ Exact distribution of the damage per round of each character """
+    return [exact_round_pmf(c, enemy, **kwargs) for c in characters]
@@ -0,0 +1,114 @@
+""" Design of experiments, simulating every point of a grid of Character or Attack field values in one batched pass
+    Each grid point is a variant of one character, and all variants are compiled into one table and simulated with common random numbers,
+    so dice that do not depend on the varied fields are identical at every grid point and the differences between points are smooth """
+from dataclasses import fields, replace
+from itertools import product
+import numpy as np
+import pandas as pd
+
+from computations.models import Attack, Character
+from computations.context_table import compile_context_table
+from computations.numerical_simulation import RNG, SUMMARY_COLUMNS, estimate_bytes_per_round, table_simulator
+from computations.stats import RunningHistogram
+
+ATTACK_PREFIX = 'attack.' # Fields with this prefix are set on every attack of the character
+MAX_GRID_POINTS = 400
+
+def _field_types(cls):
+    """ Default value of every settable field of a dataclass, used to validate names and parse values """
+    defaults = cls()
+    return {f.name: getattr(defaults, f.name) for f in fields(cls) if f.init and not f.name.startswith('additional_') and f.name != 'attacks'}
+
+def vary(character, **values):
+    """ Copy of character with fields replaced, 'attack.<field>' replaces the field of every attack
+        Example Usage:
+            vary(character, strength=18, GWM=True, **{'attack.advantage': True})
+    """
+    character_fields = _field_types(Character)
+    attack_fields = _field_types(Attack)
+    character_values = {}
+    attack_values = {}
+    for name, value in values.items():
+        if name.startswith(ATTACK_PREFIX) and name[len(ATTACK_PREFIX):] in attack_fields:
+            attack_values[name[len(ATTACK_PREFIX):]] = value
+        elif name in character_fields:
+            character_values[name] = value
+        else:
+            raise ValueError(f"Unknown Character or Attack field '{name}'")
+    attacks = [replace(a, **attack_values) for a in character.attacks] if attack_values else character.attacks
+    return replace(character, attacks=attacks, **character_values)
+
+def expand_grid(grid):
+    """ Every combination of the values of a grid, i.e. {'strength': [16, 18], 'GWM': [False, True]} has 4 points, returned as dictionaries """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in product(*grid.values())]
+
+def point_name(point):
+    """ Label of a grid point, such as 'strength=18, GWM=True' """
+    return ", ".join(f"{name}={value}" for name, value in point.items())
+
+def _parse_value(text, default):
+    """ Parses text as the type of a field's default value """
+    text = text.strip()
+    if isinstance(default, bool):
+        if text.lower() not in ['true', 'false', 'on', 'off', '1', '0']:
+            raise ValueError(f"Expected a boolean, got '{text}'")
+        return text.lower() in ['true', 'on', '1']
+    if isinstance(default, int):
+        return int(text)
+    if isinstance(default, float):
+        return float(text)
+    return text
+
+def parse_grid(text):
+    """ Parses a grid from text, fields are separated by ';' and values by ',', and an integer range is written start:stop (inclusive)
+        Example Usage:
+            parse_grid("level=1:20; strength=16,18,20; GWM=off,on; attack.advantage=False,True")
+    """
+    character_fields = _field_types(Character)
+    attack_fields = _field_types(Attack)
+    grid = {}
+    for entry in filter(str.strip, text.split(';')):
+        if '=' not in entry:
+            raise ValueError(f"Expected field=values, got '{entry.strip()}'")
+        name, values = (part.strip() for part in entry.split('=', 1))
+        if name.startswith(ATTACK_PREFIX) and name[len(ATTACK_PREFIX):] in attack_fields:
+            default = attack_fields[name[len(ATTACK_PREFIX):]]
+        elif name in character_fields:
+            default = character_fields[name]
+        else:
+            raise ValueError(f"Unknown Character or Attack field '{name}'")
+        if ':' in values and not isinstance(default, (bool, str)):
+            start, stop = (int(v) for v in values.split(':'))
+            grid[name] = list(range(start, stop + 1))
+        else:
+            grid[name] = [_parse_value(v, default) for v in values.split(',')]
+    return grid
+
+def simulate_variants(variants, enemy, num_rounds=10000, memory_budget=256_000_000, engine='batched', rng=RNG):
+    """ Simulates characters together in one table with common random numbers, returns the histogram of damage per round of each """
+    simulate_table = table_simulator(engine, paired=True)
+    table = compile_context_table(variants, enemy)
+    chunk_size = max(int(memory_budget // max(estimate_bytes_per_round(table), 1)), 1)
+    hists = [RunningHistogram() for _ in variants]
+    for start in range(0, num_rounds, chunk_size):
+        results = simulate_table(table, min(chunk_size, num_rounds - start), rng)
+        damage = results['Damage'].sum(axis=1, dtype='int32') # (variants, rounds)
+        for h, values in zip(hists, damage):
+            h.update(values)
+        del results
+    return hists
+
+def simulate_grid(character, enemy, grid, num_rounds=10000, memory_budget=256_000_000, engine='batched', rng=RNG):
+    """ Simulates every point of a grid of field values for a character in one batched pass, with common random numbers across the grid
+        Returns a tidy frame with one row per grid point: a column per field, then summary stats of damage per round and its standard error """
+    points = expand_grid(grid)
+    if len(points) > MAX_GRID_POINTS:
+        raise ValueError(f"The grid has {len(points)} points, at most {MAX_GRID_POINTS} are supported")
+    variants = [replace(vary(character, **point), name=point_name(point)) for point in points]
+    hists = simulate_variants(variants, enemy, num_rounds=num_rounds, memory_budget=memory_budget, engine=engine, rng=rng)
+
+    df = pd.DataFrame(points)
+    df[SUMMARY_COLUMNS] = np.array([h.describe().to_numpy() for h in hists])
+    df['Std Error'] = [h.std_error() for h in hists]
+    return df
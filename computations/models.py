@@ -1,5 +1,6 @@
 """ Dataclasses and associated helper functions for containing character and enemy data """
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, fields, asdict, replace
+from functools import lru_cache
 from typing import Literal, List
 
 ### Utility functions ###
@@ -9,6 +10,7 @@ def die_from_str(die_str):
     num_die, rem = die_str.split('d')
     if '+' in rem:
         die_size, die_mod = rem.split('+')
+        die_mod = int(die_mod)
     elif '-' in rem:
         die_size, die_mod = rem.split('-')
         die_mod = -int(die_mod)
@@ -19,10 +21,17 @@ def die_from_str(die_str):
 
 def multiple_die_and_mod_from_list(die_list):
     """Returns a list of the number of dice, die size, and total modifier from a list of strings of the form ['2d6',-3,'2d6+3']"""
+    num_die, die_sizes, total_mod = parse_die_mod_list(tuple(die_list))
+    return list(num_die), list(die_sizes), total_mod
+
+@lru_cache(maxsize=4096)
+def parse_die_mod_list(die_tuple):
+    """ Cached parse of a tuple of dice and modifiers, returns interned tuples of the number of dice and die sizes, and the total modifier
+        Equal dice strings are only parsed once, and always return the same tuple objects """
     num_die = []
     die_sizes = []
     total_mod = 0
-    for elem in die_list:
+    for elem in die_tuple:
         if isinstance(elem, int):
             m = elem
         elif len(elem) == 0:
@@ -32,17 +41,18 @@ def multiple_die_and_mod_from_list(die_list):
             elem = elem.lower().replace(" ","")
             if 'd' in elem:
                 n,s,m = die_from_str(elem)
-                num_die.append(n)
-                die_sizes.append(s)
+                # Remove zeros
+                if n != 0 and s != 0:
+                    num_die.append(n)
+                    die_sizes.append(s)
             else:
                 m = int(elem)
         total_mod += m
-    # Remove zeros
-    for ii, elem in enumerate(num_die):
-        if elem == 0 or die_sizes[ii] == 0:
-            num_die.pop(ii)
-            die_sizes.pop(ii)
-    return num_die, die_sizes, total_mod
+    return tuple(num_die), tuple(die_sizes), total_mod
+
+def targets_armor_class(attack):
+    """Returns True if the attack roll is made against the enemy armor class, rather than a spell save difficulty class"""
+    return not (attack.saving_throw and attack.type == 'spell')
 
 ### Classes ###
 
@@ -71,6 +81,7 @@ class Attack:
     saving_throw: bool = False
     saving_throw_stat: Literal["strength","dexterity","constitution","intelligence","wisdom","charisma"] = 'dexterity'
     saving_throw_success_multiplier: float = 0.5
+    area_of_effect: bool = False # Damage is rolled once and every target makes its own saving throw, see computations/multi_target.py
     # Unused
     damage_type: str = 'slashing'
     bonus_crit_die_mod_list: list[str,int] = field(default_factory=list) # Format is ['1d6', 2]
@@ -132,22 +143,23 @@ class Creature:
     additional_miss_damage_die_sizes: list[int] = field(default_factory=list)
 
     def __post_init__(self):
+        # Assigned rather than accumulated, so dataclasses.replace does not add the bonus dice a second time
         num_die, die_sizes, total_mod = multiple_die_and_mod_from_list(self.bonus_attack_die_mod_list)
-        self.additional_attack_modifier += total_mod
-        self.additional_attack_num_die += num_die
-        self.additional_attack_die_sizes += die_sizes
+        self.additional_attack_modifier = total_mod
+        self.additional_attack_num_die = num_die
+        self.additional_attack_die_sizes = die_sizes
         num_die, die_sizes, total_mod = multiple_die_and_mod_from_list(self.bonus_damage_die_mod_list)
-        self.additional_damage_modifier += total_mod
-        self.additional_damage_num_die += num_die
-        self.additional_damage_die_sizes += die_sizes
+        self.additional_damage_modifier = total_mod
+        self.additional_damage_num_die = num_die
+        self.additional_damage_die_sizes = die_sizes
         num_die, die_sizes, total_mod = multiple_die_and_mod_from_list(self.bonus_crit_die_mod_list)
-        self.additional_crit_damage_modifier += total_mod
-        self.additional_crit_damage_num_die += num_die
-        self.additional_crit_damage_die_sizes += die_sizes
+        self.additional_crit_damage_modifier = total_mod
+        self.additional_crit_damage_num_die = num_die
+        self.additional_crit_damage_die_sizes = die_sizes
         num_die, die_sizes, total_mod = multiple_die_and_mod_from_list(self.bonus_miss_die_mod_list)
-        self.additional_miss_damage_modifier += total_mod
-        self.additional_miss_damage_num_die += num_die
-        self.additional_miss_damage_die_sizes += die_sizes
+        self.additional_miss_damage_modifier = total_mod
+        self.additional_miss_damage_num_die = num_die
+        self.additional_miss_damage_die_sizes = die_sizes
 
     # pylint: disable=missing-function-docstring
     @property
@@ -292,180 +304,249 @@ class DamageContext:
     # Special cases
     # TODO: Kill on hp remaining
 
-def calculate_attack_and_damage_context(character, enemy, **kwargs):
-    """ Extracts the attack and damage contexts for a given character and enemy """
-    attack_contexts = []
-    damage_contexts = []
-
+def attack_and_damage_context(character, attack, enemy, **kwargs):
+    """ Extracts the attack and damage context of one of the character's attacks against the enemy """
     # Character Specific
     c_attack_num_die, c_attack_die_sizes, c_bonus_attack_mod = multiple_die_and_mod_from_list(character.bonus_attack_die_mod_list)
     c_damage_num_die, c_damage_die_sizes, c_bonus_damage_mod = multiple_die_and_mod_from_list(character.bonus_damage_die_mod_list)
     c_miss_num_die, c_miss_damage_die, c_miss_damage_modifier = multiple_die_and_mod_from_list(character.bonus_miss_die_mod_list)
     c_crit_num_die, c_crit_damage_die, c_crit_damage_modifier = multiple_die_and_mod_from_list(character.bonus_crit_die_mod_list)
 
-    for attack in character.attacks:
-        # From character
-        ability_modifier = character.ability_modifier(attack.ability_stat)
-        # Attack Roll
-        attack_modifier = ability_modifier
-        ## Proficiency, Spellcasting and unarmed attacks always add proficiency bonus
-        if attack.proficent or attack.type in ['spell','unarmed']:
-            attack_modifier += character.proficiency_bonus
-        # Damage
-        damage_modifier = 0
-        damage_adv = False
-        damage_dis = False
-        damage_reroll_on = character.damage_reroll_on
-        damage_multiplier = 1
-
-        damage_failed_multiplier = 0
-
-        # Attack Specific
-        attack_num_die, attack_die_sizes, bonus_attack_mod = multiple_die_and_mod_from_list(attack.bonus_attack_die_mod_list)
-        damage_num_die, damage_die_sizes, bonus_damage_mod = multiple_die_and_mod_from_list([attack.damage] + attack.bonus_damage_die_mod_list)
-        miss_num_die, miss_damage_die, miss_damage_modifier = multiple_die_and_mod_from_list(attack.bonus_miss_die_mod_list)
-        crit_num_die, crit_damage_die, crit_damage_modifier = multiple_die_and_mod_from_list(attack.bonus_crit_die_mod_list)
-
-        # Join character and attack specific modifiers
-        bonus_attack_mod += c_bonus_attack_mod
-        attack_num_die += c_attack_num_die
-        attack_die_sizes += c_attack_die_sizes
-        damage_num_die += c_damage_num_die
-        damage_die_sizes += c_damage_die_sizes
-        bonus_damage_mod += c_bonus_damage_mod
-        miss_num_die += c_miss_num_die
-        miss_damage_die += c_miss_damage_die
-        miss_damage_modifier += c_miss_damage_modifier
-        crit_num_die += c_crit_num_die
-        crit_damage_die += c_crit_damage_die
-        crit_damage_modifier += c_crit_damage_modifier
-
-        # Add flat modifiers
-        attack_modifier += bonus_attack_mod
-        damage_modifier += bonus_damage_mod
-
-        ## Weapon attacks
+    # From character
+    ability_modifier = character.ability_modifier(attack.ability_stat)
+    # Attack Roll
+    attack_modifier = ability_modifier
+    ## Proficiency, Spellcasting and unarmed attacks always add proficiency bonus
+    if attack.proficent or attack.type in ['spell','unarmed']:
+        attack_modifier += character.proficiency_bonus
+    # Damage
+    damage_modifier = 0
+    damage_adv = False
+    damage_dis = False
+    damage_reroll_on = character.damage_reroll_on
+    damage_multiplier = 1
+
+    damage_failed_multiplier = 0
+
+    # Attack Specific
+    attack_num_die, attack_die_sizes, bonus_attack_mod = multiple_die_and_mod_from_list(attack.bonus_attack_die_mod_list)
+    damage_num_die, damage_die_sizes, bonus_damage_mod = multiple_die_and_mod_from_list([attack.damage] + attack.bonus_damage_die_mod_list)
+    miss_num_die, miss_damage_die, miss_damage_modifier = multiple_die_and_mod_from_list(attack.bonus_miss_die_mod_list)
+    crit_num_die, crit_damage_die, crit_damage_modifier = multiple_die_and_mod_from_list(attack.bonus_crit_die_mod_list)
+
+    # Join character and attack specific modifiers
+    bonus_attack_mod += c_bonus_attack_mod
+    attack_num_die += c_attack_num_die
+    attack_die_sizes += c_attack_die_sizes
+    damage_num_die += c_damage_num_die
+    damage_die_sizes += c_damage_die_sizes
+    bonus_damage_mod += c_bonus_damage_mod
+    miss_num_die += c_miss_num_die
+    miss_damage_die += c_miss_damage_die
+    miss_damage_modifier += c_miss_damage_modifier
+    crit_num_die += c_crit_num_die
+    crit_damage_die += c_crit_damage_die
+    crit_damage_modifier += c_crit_damage_modifier
+
+    # Add flat modifiers
+    attack_modifier += bonus_attack_mod
+    damage_modifier += bonus_damage_mod
+
+    ## Weapon attacks
+    if character.raging:
+        rage_modifier = 2
+        if character.level >= 9:
+            rage_modifier = 3
+
+    if attack.type == 'weapon (melee)':
+        damage_modifier += ability_modifier
+        if attack.weapon_enhancement:
+            attack_modifier += attack.weapon_enhancement
+            damage_modifier += attack.weapon_enhancement
+        if character.GWM and attack.two_handed:
+            attack_modifier -= 5
+            damage_modifier += 10
+        if character.savage_attacker:
+            damage_adv=True
+        if character.dueling and not attack.two_handed:
+            damage_modifier += 2
+        if character.GWF and attack.two_handed:
+            damage_reroll_on = max(damage_reroll_on, 2)
+        if attack.offhand:
+            damage_modifier -= ability_modifier
+            if character.TWF and not attack.two_handed:
+                damage_modifier += ability_modifier
+        # Barbarian
+        if character.raging:
+            damage_modifier += rage_modifier
+        if character.brutal_critical:
+            crit_num_die.append(1)
+            _, weapon_die, _ = die_from_str(attack.damage)
+            crit_damage_die.append(weapon_die)
+        # Paladin
+        if character.divine_smite:
+            damage_num_die.append(min(2 + character.divine_smite_level-1,5))
+            damage_die_sizes.append(8)
+        if character.improved_divine_smite:
+            damage_num_die.append(1)
+            damage_die_sizes.append(8)
+        # Warlock
+        if character.lifedrinker:
+            damage_modifier += character.charisma_ability_modifier
+        # Half-Orc
+        if character.savage_attacks_half_orc:
+            crit_num_die.append(1)
+            _, weapon_die, _ = die_from_str(attack.damage)
+            crit_damage_die.append(weapon_die)
+    elif attack.type == 'weapon (ranged)':
+        damage_modifier += ability_modifier
+        if character.archery:
+            attack_modifier += 2
+        if character.sharpshooter:
+            attack_modifier -= 5
+        if attack.offhand:
+            damage_modifier -= character.ability_modifier
+            if character.TWF and not attack.two_handed:
+                damage_modifier += ability_modifier
+    elif attack.type == 'unarmed':
+        damage_modifier += ability_modifier
+        if character.tavern_brawler:
+            attack_modifier += character.strength_ability_modifier
+            damage_modifier += character.strength_ability_modifier
+    elif attack.type == 'thrown': # TODO: Implement improvised thrown weapons
+        damage_modifier += ability_modifier
+        if character.tavern_brawler:
+            attack_modifier += character.strength_ability_modifier
+            damage_modifier += character.strength_ability_modifier
         if character.raging:
-            rage_modifier = 2
-            if character.level >= 9:
-                rage_modifier = 3
-
-        if attack.type == 'weapon (melee)':
-            damage_modifier += ability_modifier
-            if attack.weapon_enhancement:
-                attack_modifier += attack.weapon_enhancement
-                damage_modifier += attack.weapon_enhancement
-            if character.GWM and attack.two_handed:
-                attack_modifier -= 5
-                damage_modifier += 10
-            if character.savage_attacker:
-                damage_adv=True
-            if character.dueling and not attack.two_handed:
-                damage_modifier += 2
-            if character.GWF and attack.two_handed:
-                damage_reroll_on = max(damage_reroll_on, 2)
-            if attack.offhand:
-                damage_modifier -= ability_modifier
-                if character.TWF and not attack.two_handed:
-                    damage_modifier += ability_modifier
-            # Barbarian
-            if character.raging:
-                damage_modifier += rage_modifier
-            if character.brutal_critical:
-                crit_num_die.append(1)
-                _, weapon_die, _ = die_from_str(attack.damage)
-                crit_damage_die.append(weapon_die)
-            # Paladin
-            if character.divine_smite:
-                damage_num_die.append(min(2 + character.divine_smite_level-1,5))
-                damage_die_sizes.append(8)
-            if character.improved_divine_smite:
-                damage_num_die.append(1)
-                damage_die_sizes.append(8)
-            # Warlock
-            if character.lifedrinker:
-                damage_modifier += character.charisma_ability_modifier
-            # Half-Orc
-            if character.savage_attacks_half_orc:
-                crit_num_die.append(1)
-                _, weapon_die, _ = die_from_str(attack.damage)
-                crit_damage_die.append(weapon_die)
-        elif attack.type == 'weapon (ranged)':
-            damage_modifier += ability_modifier
-            if character.archery:
-                attack_modifier += 2
-            if character.sharpshooter:
-                attack_modifier -= 5
-            if attack.offhand:
-                damage_modifier -= character.ability_modifier
-                if character.TWF and not attack.two_handed:
-                    damage_modifier += ability_modifier
-        elif attack.type == 'unarmed':
-            damage_modifier += ability_modifier
-            if character.tavern_brawler:
-                attack_modifier += character.strength_ability_modifier
-                damage_modifier += character.strength_ability_modifier
-        elif attack.type == 'thrown': # TODO: Implement improvised thrown weapons
-            damage_modifier += ability_modifier
-            if character.tavern_brawler:
-                attack_modifier += character.strength_ability_modifier
-                damage_modifier += character.strength_ability_modifier
-            if character.raging:
-                damage_modifier += rage_modifier
-        elif attack.type == 'spell':
-            if character.agonizing_blast:
-                damage_modifier += character.charisma_ability_modifier
-            if character.empowered_evocation:
-                damage_modifier += character.intelligence_ability_modifier
-            if attack.saving_throw:
-                #TODO: This is not right
-                damage_failed_multiplier = attack.saving_throw_success_multiplier
-
-        # Enemy Specific
-        # TODO: Make this per attack
-        if enemy.resistance:
-            damage_multiplier *= 0.5
-        if enemy.vulnerability:
-            damage_multiplier *= 2
-
-        # Difficulty Class
-        difficulty_class = enemy.armor_class
-        if attack.saving_throw and attack.type == 'spell':
-            difficulty_class = character.spell_difficulty_class(attack.ability_stat)
-            attack_roll_modifier = enemy.ability_modifier(attack.saving_throw_stat)
-            if enemy.saving_throw_proficent:
-                attack_roll_modifier += enemy.proficiency_bonus
-
-        attack_context = AttackContext(
-            num_die=attack_num_die,
-            die_size=attack_die_sizes,
-            modifier=attack_modifier,
-            advantage=(character.advantage or attack.advantage),
-            disadvantage=(character.disadvantage or attack.disadvantage),
-            crit_on=min(character.crit_on, attack.crit_on),
-            reroll_on=character.attack_reroll_on,
-            difficulty_class=difficulty_class,
-            **kwargs
-        )
-        # TODO: Add enemy damage reduction, resistance, and vulnerability, etc.
-        damage_context = DamageContext(
-            num_die=damage_num_die,
-            die_size=damage_die_sizes,
-            modifier=damage_modifier,
-            damage_multiplier=damage_multiplier,
-            advantage=damage_adv,
-            disadvantage=damage_dis,
-            reroll_on=damage_reroll_on,
-            failed_multiplier=damage_failed_multiplier,
-            crit_num_die=crit_num_die,
-            crit_damage_die=crit_damage_die,
-            crit_damage_modifier=crit_damage_modifier,
-            miss_num_die=miss_num_die,
-            miss_damage_die=miss_damage_die,
-            miss_damage_modifier=miss_damage_modifier,
-            **kwargs
-        )
+            damage_modifier += rage_modifier
+    elif attack.type == 'spell':
+        if character.agonizing_blast:
+            damage_modifier += character.charisma_ability_modifier
+        if character.empowered_evocation:
+            damage_modifier += character.intelligence_ability_modifier
+        if attack.saving_throw:
+            #TODO: This is not right
+            damage_failed_multiplier = attack.saving_throw_success_multiplier
+
+    # Enemy Specific
+    # TODO: Make this per attack
+    if enemy.resistance:
+        damage_multiplier *= 0.5
+    if enemy.vulnerability:
+        damage_multiplier *= 2
+
+    # Difficulty Class
+    difficulty_class = enemy.armor_class
+    if not targets_armor_class(attack):
+        difficulty_class = character.spell_difficulty_class(attack.ability_stat)
+        attack_roll_modifier = enemy.ability_modifier(attack.saving_throw_stat)
+        if enemy.saving_throw_proficent:
+            attack_roll_modifier += enemy.proficiency_bonus
+
+    attack_context = AttackContext(
+        num_die=attack_num_die,
+        die_size=attack_die_sizes,
+        modifier=attack_modifier,
+        advantage=(character.advantage or attack.advantage),
+        disadvantage=(character.disadvantage or attack.disadvantage),
+        crit_on=min(character.crit_on, attack.crit_on),
+        reroll_on=character.attack_reroll_on,
+        difficulty_class=difficulty_class,
+        **kwargs
+    )
+    # TODO: Add enemy damage reduction, resistance, and vulnerability, etc.
+    damage_context = DamageContext(
+        num_die=damage_num_die,
+        die_size=damage_die_sizes,
+        modifier=damage_modifier,
+        damage_multiplier=damage_multiplier,
+        advantage=damage_adv,
+        disadvantage=damage_dis,
+        reroll_on=damage_reroll_on,
+        failed_multiplier=damage_failed_multiplier,
+        crit_num_die=crit_num_die,
+        crit_damage_die=crit_damage_die,
+        crit_damage_modifier=crit_damage_modifier,
+        miss_num_die=miss_num_die,
+        miss_damage_die=miss_damage_die,
+        miss_damage_modifier=miss_damage_modifier,
+        **kwargs
+    )
+    return attack_context, damage_context
 
+def calculate_attack_and_damage_context(character, enemy, **kwargs):
+    """ Extracts the attack and damage contexts for a given character and enemy """
+    attack_contexts = []
+    damage_contexts = []
+    for attack in character.attacks:
+        attack_context, damage_context = attack_and_damage_context(character, attack, enemy, **kwargs)
         attack_contexts.append(attack_context)
         damage_contexts.append(damage_context)
     return attack_contexts, damage_contexts
+
+### Compiled Specs ###
+
+_INTERNED_DICE = {}
+
+def intern_dice(dice):
+    """ Returns a single shared tuple for equal lists of dice """
+    dice = tuple(dice)
+    return _INTERNED_DICE.setdefault(dice, dice)
+
+ATTACK_CONTEXT_FIELDS = [f.name for f in fields(AttackContext)]
+
+@dataclass(frozen=True, slots=True)
+class CompiledAttack:
+    """ Immutable attack and damage context of one attack, the values are stored in AttackContext and DamageContext field order with dice as interned tuples """
+    name: str
+    targets_armor_class: bool
+    attack: tuple
+    damage: tuple
+
+    @classmethod
+    def from_contexts(cls, name, targets_ac, attack_context, damage_context):
+        """ Freezes a pair of contexts """
+        def values(context):
+            return tuple(intern_dice(v) if isinstance(v, list) else v for v in (getattr(context, f.name) for f in fields(context)))
+        return cls(name, targets_ac, values(attack_context), values(damage_context))
+
+    def contexts(self):
+        """ New mutable AttackContext and DamageContext """
+        def thaw(values):
+            return [list(v) if isinstance(v, tuple) else v for v in values]
+        return AttackContext(*thaw(self.attack)), DamageContext(*thaw(self.damage))
+
+    def with_armor_class(self, armor_class):
+        """ Same attack against a different armor class, without recompiling """
+        if not self.targets_armor_class:
+            return self
+        index = ATTACK_CONTEXT_FIELDS.index('difficulty_class')
+        return replace(self, attack=self.attack[:index] + (armor_class,) + self.attack[index+1:])
+
+@dataclass(frozen=True, slots=True)
+class CompiledSpec:
+    """ Immutable, hashable compilation of a character's attacks against an enemy, equal specs always simulate the same way """
+    character_name: str
+    attacks: tuple
+
+    @property
+    def attack_names(self):
+        """ Names of the attacks, in order """
+        return [a.name for a in self.attacks]
+
+    def contexts(self):
+        """ Attack and damage contexts, the same as calculate_attack_and_damage_context """
+        contexts = [a.contexts() for a in self.attacks]
+        return [a for a, _ in contexts], [d for _, d in contexts]
+
+    def with_armor_class(self, armor_class):
+        """ Same spec against a different enemy armor class """
+        return replace(self, attacks=tuple(a.with_armor_class(armor_class) for a in self.attacks))
+
+def compile_spec(character, enemy):
+    """ Compiles every attack of the character against the enemy """
+    return CompiledSpec(character.name, tuple(
+        CompiledAttack.from_contexts(a.name, targets_armor_class(a), *attack_and_damage_context(character, a, enemy))
+        for a in character.attacks
+    ))
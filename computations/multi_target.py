@@ -0,0 +1,211 @@
+""" Multi target simulation, a character against several enemies that each have their own armor class, saving throws, resistances and hit points
+    Enemy hit points are a (trials, targets) array. Single target attacks are simulated once per round against the lowest armor class of the enemies,
+    then checked against the armor class of the target each trial picks, so their cost does not grow with the number of enemies.
+    Saving throw attacks make the target roll its own saving throw instead. Area of effect attacks roll damage once per trial
+    and every living target makes its own saving throw """
+from dataclasses import dataclass, field, replace
+import numpy as np
+import pandas as pd
+
+from computations.models import targets_armor_class
+from computations.context_table import ContextTable, compile_context_table, simulate_context_table, roll_terms, _damage_cells
+from computations.numerical_simulation import RNG, estimate_bytes_per_round
+from computations.stats import RunningHistogram
+from computations.turns_to_kill import MAX_FIGHT_ROUNDS
+
+def _target_focus_fire(hit_points, rng):
+    return (hit_points > 0).argmax(axis=1)
+
+def _target_lowest_hp(hit_points, rng):
+    return np.where(hit_points > 0, hit_points, np.iinfo('int64').max).argmin(axis=1)
+
+def _target_highest_hp(hit_points, rng):
+    return hit_points.argmax(axis=1)
+
+def _target_random(hit_points, rng):
+    return np.where(hit_points > 0, rng.random(hit_points.shape), -1).argmax(axis=1)
+
+# Target selection policies, given the (trials, targets) hit points return the target of a single target attack in each trial
+# Dead targets are only picked when every target is dead
+TARGET_POLICIES = {
+    'focus_fire': _target_focus_fire, # The first living enemy, in order
+    'lowest_hp': _target_lowest_hp,
+    'highest_hp': _target_highest_hp,
+    'random': _target_random,
+}
+
+def target_names(enemies):
+    """ Enemy names, numbered when several enemies share a name """
+    names = [e.name for e in enemies]
+    return [f"{name} {names[:ii+1].count(name)}" if names.count(name) > 1 else name for ii, name in enumerate(names)]
+
+@dataclass
+class TargetTable:
+    """ Defensive stats of every enemy as arrays, one entry per target """
+    names: list = field(default_factory=list)
+    armor_class: np.ndarray = None
+    hit_points: np.ndarray = None
+    damage_multiplier: np.ndarray = None
+    saving_throw_modifiers: dict = field(default_factory=dict) # Ability -> modifier of every target
+
+    @classmethod
+    def from_enemies(cls, enemies):
+        """ Builds the table from a list of Enemy """
+        abilities = ["strength", "dexterity", "constitution", "intelligence", "wisdom", "charisma"]
+        return cls(
+            names=target_names(enemies),
+            armor_class=np.array([e.armor_class for e in enemies], dtype='int32'),
+            hit_points=np.array([e.hit_points for e in enemies], dtype='int64'),
+            damage_multiplier=np.array([(0.5 if e.resistance else 1) * (2 if e.vulnerability else 1) for e in enemies], dtype=float),
+            saving_throw_modifiers={a: np.array([e.ability_modifier(a) + (e.proficiency_bonus if e.saving_throw_proficent else 0) for e in enemies], dtype='int32')
+                                    for a in abilities},
+        )
+
+    @property
+    def num_targets(self):
+        """ Number of enemies """
+        return len(self.names)
+
+@dataclass
+class Attacker:
+    """ A character's attacks compiled once for any set of targets
+        Single target attacks are compiled against a neutral enemy with the lowest armor class, area of effect attacks only for their damage dice """
+    character: object = None
+    single: ContextTable = None
+    area: ContextTable = None
+    rows: list = field(default_factory=list) # Row of each attack in its table
+    targets_armor_class: np.ndarray = None # Whether each row of single rolls against armor class
+
+    @classmethod
+    def from_character(cls, character, enemies):
+        """ Compiles the character's attacks against the enemies """
+        neutral = replace(enemies[0], armor_class=min(e.armor_class for e in enemies), resistance=False, vulnerability=False)
+        single = [a for a in character.attacks if not a.area_of_effect]
+        area = [a for a in character.attacks if a.area_of_effect]
+        # Equal attacks are separate rows, so rows are counted rather than looked up
+        rows = [sum(b.area_of_effect == a.area_of_effect for b in character.attacks[:ii]) for ii, a in enumerate(character.attacks)]
+        return cls(
+            character=character,
+            single=compile_context_table([replace(character, attacks=single)], neutral),
+            area=compile_context_table([replace(character, attacks=area)], neutral),
+            rows=rows,
+            targets_armor_class=np.array([targets_armor_class(a) for a in single], dtype=bool),
+        )
+
+    def simulate(self, num_trials, rng):
+        """ Single target attack results of num_trials turns against the lowest armor class, see simulate_context_table """
+        return simulate_context_table(self.single, num_trials, rng) if self.single.max_attacks else {}
+
+def saving_throw_multiplier(attacker, attack, modifiers, size, rng):
+    """ Damage multiplier of targets with the given saving throw modifiers, the attack's saving throw success multiplier
+        for those that roll at least the spell save DC and 1 for those that fail """
+    difficulty_class = attacker.character.spell_difficulty_class(attack.ability_stat)
+    saves = rng.integers(1, 21, size=size, dtype='int32') + modifiers
+    return np.where(saves >= difficulty_class, attack.saving_throw_success_multiplier, 1.0)
+
+def single_target_damage(attacker, row, results, target, targets, rng):
+    """ Damage of one single target attack in every trial against the target each trial picked
+        results are of Attacker.simulate, rolled against the lowest armor class. Saving throw attacks are rolled here instead,
+        with the target's own saving throw, the same way as area_damage """
+    table = attacker.single
+    if not attacker.targets_armor_class[row]:
+        attack = [a for a in attacker.character.attacks if not a.area_of_effect][row]
+        rolled = table.damage_modifier[row] + roll_terms(np.full(len(target), row), table.damage_num_die, table.damage_die_size,
+                                                         table.damage_advantage, table.damage_disadvantage, table.damage_reroll_on, rng)
+        multiplier = targets.damage_multiplier[target] * saving_throw_multiplier(
+            attacker, attack, targets.saving_throw_modifiers[attack.saving_throw_stat][target], len(target), rng)
+        return (rolled * multiplier).astype('int64')
+    damage = results['Damage'][0, row].astype('int64')
+    crit = results['Hit (Crit)'][0, row]
+    hit_lowest = results['Hit'][0, row]
+    hit = crit | (hit_lowest & (results['Attack Roll'][0, row] >= targets.armor_class[target]))
+    # Hits against the lowest armor class that miss the target do miss damage instead, which was not rolled for them
+    missed = hit_lowest & ~hit
+    damage[missed] = 0
+    if missed.any() and (table.miss_num_die[row].any() or table.miss_modifier[row] != 0):
+        mask = np.zeros((table.num_rows, len(target)), dtype=bool)
+        mask[row] = missed
+        damage[missed] = _damage_cells(mask, table.miss_num_die, table.miss_die_size, table.miss_modifier,
+                                       [table.failed_multiplier, table.damage_multiplier], table, rng)[row, missed]
+    # The neutral table truncated with a multiplier of 1, so truncating again after the target's multiplier is the same as truncating once
+    return (damage * targets.damage_multiplier[target]).astype('int64')
+
+def area_damage(attacker, row, targets, num_trials, rng):
+    """ Damage of one area of effect attack to every target, as a (trials, targets) array
+        The damage is rolled once per trial, and each target that succeeds on its saving throw against the spell save DC takes
+        the saving throw success multiplier of it. Area attacks without a saving throw hit every target for full damage """
+    table = attacker.area
+    attack = [a for a in attacker.character.attacks if a.area_of_effect][row]
+    rolled = table.damage_modifier[row] + roll_terms(np.full(num_trials, row), table.damage_num_die, table.damage_die_size,
+                                                     table.damage_advantage, table.damage_disadvantage, table.damage_reroll_on, rng)
+    multiplier = np.broadcast_to(targets.damage_multiplier, (num_trials, targets.num_targets))
+    if attack.saving_throw:
+        multiplier = multiplier * saving_throw_multiplier(attacker, attack, targets.saving_throw_modifiers[attack.saving_throw_stat],
+                                                          (num_trials, targets.num_targets), rng)
+    return (rolled[:, np.newaxis] * multiplier).astype('int64')
+
+def take_turn(attacker, targets, hit_points, rng, target_policy='focus_fire', results=None):
+    """ Makes every attack of the attacker in order, in every trial at once, hit_points is a (trials, targets) array that is updated in place
+        Each single target attack picks its target with the target policy from the hit points left, and dead targets take no damage
+        results can be precomputed Attacker.simulate results for these trials
+        Returns the damage dealt to each target as a (trials, targets) array, including damage past the target's remaining hit points """
+    num_trials = len(hit_points)
+    results = attacker.simulate(num_trials, rng) if results is None else results
+    pick_target = TARGET_POLICIES[target_policy]
+    trials = np.arange(num_trials)
+    dealt = np.zeros(hit_points.shape, dtype='int64')
+    for attack, row in zip(attacker.character.attacks, attacker.rows):
+        if attack.area_of_effect:
+            damage = area_damage(attacker, row, targets, num_trials, rng) * (hit_points > 0)
+        else:
+            target = pick_target(hit_points, rng)
+            damage = np.zeros(hit_points.shape, dtype='int64')
+            damage[trials, target] = single_target_damage(attacker, row, results, target, targets, rng) * (hit_points[trials, target] > 0)
+        hit_points -= damage
+        dealt += damage
+    return dealt
+
+def simulate_multi_target(character, enemies, num_trials=10000, max_rounds=MAX_FIGHT_ROUNDS, target_policy='focus_fire', memory_budget=256_000_000, rng=RNG):
+    """ Simulates num_trials fights of character against every enemy at once, until all enemies reach 0 hit points or max_rounds have passed
+        Returns a dictionary of histograms of the rounds to kill all enemies, the rounds to kill each enemy and the damage per round
+        (not counting damage past an enemy's remaining hit points), and the number of fights that did not finish """
+    targets = TargetTable.from_enemies(enemies)
+    attacker = Attacker.from_character(character, enemies)
+    hists = {'Rounds To Kill All': RunningHistogram()}
+    hists.update({f"Rounds To Kill {name}": RunningHistogram() for name in targets.names})
+    hists['Damage Per Round'] = RunningHistogram()
+    if not character.attacks:
+        return hists, num_trials
+
+    unfinished = 0
+    chunk_size = max(int(memory_budget // max(estimate_bytes_per_round(attacker.single) * targets.num_targets, 1)), 1)
+    for start in range(0, num_trials, chunk_size):
+        hit_points = np.tile(targets.hit_points, (min(chunk_size, num_trials - start), 1))
+        for r in range(1, max_rounds + 1):
+            before = hit_points.clip(0)
+            take_turn(attacker, targets, hit_points, rng, target_policy=target_policy)
+            after = hit_points.clip(0)
+            hists['Damage Per Round'].update((before - after).sum(axis=1))
+            for name, killed in zip(targets.names, ((before > 0) & (after == 0)).T):
+                hists[f"Rounds To Kill {name}"].update(np.full(killed.sum(), r))
+            # Fights where every enemy is dead are retired
+            done = after.sum(axis=1) == 0
+            hists['Rounds To Kill All'].update(np.full(done.sum(), r))
+            hit_points = hit_points[~done]
+            if len(hit_points) == 0:
+                break
+        unfinished += len(hit_points)
+    return hists, unfinished
+
+def multi_target_summary(results):
+    """ Summary stats of simulate_multi_target, plus the fraction of fights where every enemy was killed """
+    hists, unfinished = results
+    df = pd.DataFrame({name: h.describe() if h.total else pd.Series(np.nan, index=['mean','min','25%','50%','75%','max']) for name, h in hists.items()})
+    finished = hists['Rounds To Kill All'].total
+    df.loc['Finished'] = finished / max(finished + unfinished, 1)
+    return df
+
+def simulate_multi_target_from_characters(characters, enemies, num_trials=10000, max_rounds=MAX_FIGHT_ROUNDS, target_policy='focus_fire', rng=RNG):
+    """ Each character fighting all the enemies alone, returns the results of simulate_multi_target and summary stats per character """
+    results = [simulate_multi_target(c, enemies, num_trials=num_trials, max_rounds=max_rounds, target_policy=target_policy, rng=rng) for c in characters]
+    return results, [multi_target_summary(r) for r in results]
@@ -0,0 +1,137 @@
+""" Numba compiled engine that fuses the attack roll, hit/crit decision and damage rolls into one pass per (attack, round) cell
+    Random numbers come from a counter based splitmix64 stream seeded by the cell index, so results only depend on the seed,
+    not on the number of threads. numba is optional, the engine raises an ImportError when it is selected without numba installed """
+import numpy as np
+
+from computations.context_table import RESULT_COLUMNS
+from utilities.instrumentation import timed, increment
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs): # pylint: disable=unused-argument
+        """ Stand in for numba.njit that leaves the function uncompiled """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+    prange = range
+
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+TO_UNIT = 1.0 / 9007199254740992.0 # 2**-53
+
+### Random Numbers ###
+
+@njit(cache=True)
+def _splitmix64(state):
+    """ Advances a splitmix64 state, returns the new state and a random 64 bit integer """
+    state = state + GOLDEN_GAMMA
+    z = state
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return state, z ^ (z >> np.uint64(31))
+
+@njit(cache=True)
+def _die(state, die_size):
+    """ Rolls one die from the top 53 bits of a splitmix64 output """
+    state, z = _splitmix64(state)
+    return state, int((z >> np.uint64(11)) * TO_UNIT * die_size) + 1
+
+@njit(cache=True)
+def _roll(state, die_size, advantage, disadvantage, reroll_on):
+    """ Rolls one die, rerolling once on reroll_on or lower, with advantage/disadvantage taking the max/min of two rolls """
+    state, roll = _die(state, die_size)
+    if roll <= reroll_on:
+        state, roll = _die(state, die_size)
+    if advantage != disadvantage:
+        state, second = _die(state, die_size)
+        if second <= reroll_on:
+            state, second = _die(state, die_size)
+        roll = max(roll, second) if advantage else min(roll, second)
+    return state, roll
+
+@njit(cache=True)
+def _roll_terms(state, num_die, die_size, advantage, disadvantage, reroll_on):
+    """ Sum of every die of a row of padded dice terms """
+    total = 0
+    for k in range(num_die.shape[0]):
+        for _ in range(num_die[k]):
+            state, roll = _roll(state, die_size[k], advantage, disadvantage, reroll_on)
+            total += roll
+    return state, total
+
+### Kernel ###
+
+@njit(cache=True, parallel=True)
+def _fused_kernel(seed, num_rounds, active, modifier, difficulty_class, crit_on, reroll_on, advantage, disadvantage, always_hit, always_crit, saving_throw,
+                  attack_num_die, attack_die_size, damage_num_die, damage_die_size, damage_modifier, damage_multiplier, damage_advantage, damage_disadvantage, damage_reroll_on,
+                  crit_num_die, crit_die_size, crit_modifier, miss_num_die, miss_die_size, miss_modifier, failed_multiplier, out): # pylint: disable=too-many-arguments,too-many-locals
+    """ Simulates every (row, round) cell of a ContextTable, writing RESULT_COLUMNS to out with shape (columns, rows, rounds) """
+    num_rows = active.shape[0]
+    for cell in prange(num_rows * num_rounds): # pylint: disable=not-an-iterable
+        row = cell // num_rounds
+        r = cell % num_rounds
+        # Each cell has its own stream, so the results do not depend on the order cells are simulated in
+        state, _ = _splitmix64(np.uint64(seed) ^ (np.uint64(cell) * GOLDEN_GAMMA))
+
+        # Attack roll
+        if always_hit[row] or always_crit[row]:
+            roll = 20
+            attack_roll = 20 + modifier[row]
+            hit = True
+            crit = always_crit[row]
+        else:
+            state, roll = _roll(state, 20, advantage[row], disadvantage[row], reroll_on[row])
+            state, bonus = _roll_terms(state, attack_num_die[row], attack_die_size[row], advantage[row], disadvantage[row], reroll_on[row])
+            attack_roll = roll + modifier[row] + bonus
+            if saving_throw[row]:
+                hit = attack_roll < difficulty_class[row]
+                crit = False
+            else:
+                crit = roll >= crit_on[row] and roll != 1
+                hit = (attack_roll >= difficulty_class[row] and roll != 1) or crit
+        hit = hit and active[row]
+        crit = crit and active[row]
+
+        # Damage, truncated towards zero after the multipliers like numerical_simulation.damage_roll
+        hit_damage = 0
+        crit_damage = 0
+        miss_damage = 0
+        if hit:
+            state, dice = _roll_terms(state, damage_num_die[row], damage_die_size[row], damage_advantage[row], damage_disadvantage[row], damage_reroll_on[row])
+            hit_damage = int((damage_modifier[row] + dice) * damage_multiplier[row])
+        if crit:
+            state, dice = _roll_terms(state, crit_num_die[row], crit_die_size[row], damage_advantage[row], damage_disadvantage[row], damage_reroll_on[row])
+            crit_damage = int((crit_modifier[row] + dice) * damage_multiplier[row])
+        if active[row] and not hit:
+            state, dice = _roll_terms(state, miss_num_die[row], miss_die_size[row], damage_advantage[row], damage_disadvantage[row], damage_reroll_on[row])
+            miss_damage = int((miss_modifier[row] + dice) * failed_multiplier[row] * damage_multiplier[row])
+
+        out[0, row, r] = hit_damage + crit_damage + miss_damage
+        out[1, row, r] = hit_damage
+        out[2, row, r] = crit_damage
+        out[3, row, r] = miss_damage
+        out[4, row, r] = attack_roll
+        out[5, row, r] = roll
+        out[6, row, r] = hit
+        out[7, row, r] = hit and not crit
+        out[8, row, r] = crit
+
+@timed(name="roll")
+def simulate_context_table_numba(table, num_rounds, seed):
+    """ Numba version of context_table.simulate_context_table, returns the same dictionary of (characters, attacks, rounds) arrays """
+    if not NUMBA_AVAILABLE:
+        raise ImportError("The numba engine requires numba, install it or use the 'batched' engine")
+    increment('rounds_simulated_total', num_rounds * table.num_characters, engine='numba')
+    out = np.empty((len(RESULT_COLUMNS), table.num_rows, num_rounds), dtype='int32')
+    _fused_kernel(
+        np.uint64(seed), num_rounds, table.active, table.modifier, table.difficulty_class, table.crit_on, table.reroll_on,
+        table.advantage, table.disadvantage, table.always_hit, table.always_crit, table.saving_throw,
+        table.attack_num_die, table.attack_die_size, table.damage_num_die, table.damage_die_size, table.damage_modifier, table.damage_multiplier,
+        table.damage_advantage, table.damage_disadvantage, table.damage_reroll_on,
+        table.crit_num_die, table.crit_die_size, table.crit_modifier, table.miss_num_die, table.miss_die_size, table.miss_modifier, table.failed_multiplier,
+        out)
+    tensor_shape = (table.num_characters, table.max_attacks, num_rounds)
+    return {col: out[ii].reshape(tensor_shape) for ii, col in enumerate(RESULT_COLUMNS)}
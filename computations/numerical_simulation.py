@@ -1,16 +1,27 @@
 """ Numerical simulation of D&D combat
     Uses vectorized numpy operations for speed """
 from dataclasses import asdict
+from time import perf_counter
 import numpy as np
 import pandas as pd
 
-from computations.models import calculate_attack_and_damage_context
+from computations.models import calculate_attack_and_damage_context, compile_spec, targets_armor_class
+from computations.dice import DiceSource, MAX_CARVED_DIE
+from computations.context_table import RESULT_COLUMNS, compile_context_table, simulate_context_table
+from computations.results import CompactResults
+from computations.samplers import die_sampler, dice_sum_sampler, is_transformed
+from computations.stats import RunningHistogram, describe_rows
 from utilities.helper_functions import timeit
+from utilities.instrumentation import timed
 
 # Set random seed for reproducibility
 SEED = 1
 RNG = np.random.default_rng(SEED)
 
+# Adaptive simulations stop once the standard error of mean damage per round is at most this many points of damage
+ADAPTIVE_TOLERANCE = 0.05
+ADAPTIVE_MIN_ROUNDS = 1000
+
 def set_seed(seed=SEED):
     """ Set random seed for reproducibility"""
     return np.random.default_rng(seed)
@@ -18,20 +29,60 @@ def set_seed(seed=SEED):
 def roll(num_rolls, die_size=20, reroll_on=0, rng=RNG):
     """ Roll a die num_rolls times and return the results
         Rerolls dice on an optional reroll value"""
-    rolls = rng.integers(1, high=die_size+1, size=num_rolls)
+    if isinstance(rng, DiceSource) and die_size <= MAX_CARVED_DIE:
+        rolls = rng.dice(die_size, num_rolls) # uint8, sums must be taken with a wider dtype
+    else:
+        rolls = rng.integers(1, high=die_size+1, size=num_rolls)
     if reroll_on > 0:
         rerolls_mask = rolls <= reroll_on
         rolls[rerolls_mask] = rng.integers(1, high=die_size+1, size=np.sum(rerolls_mask))
     return rolls
 
-def roll_adv_dis(num_rolls, advantage=False, disadvantage=False, **kwargs):
-    """ Roll a die num_rolls times, optionally with advantage or disadvantage"""
-    if advantage and not disadvantage:
-        return np.maximum(roll(num_rolls, **kwargs), roll(num_rolls, **kwargs))
-    elif disadvantage and not advantage:
-        return np.minimum(roll(num_rolls, **kwargs), roll(num_rolls, **kwargs))
-    else:
-        return roll(num_rolls, **kwargs)
+def roll_adv_dis(num_rolls, advantage=False, disadvantage=False, die_size=20, reroll_on=0, rng=RNG):
+    """ Roll a die num_rolls times, optionally with advantage or disadvantage
+        Rerolled and advantage/disadvantage dice are drawn from an alias table of their exact distribution, with one uniform per die"""
+    if is_transformed(reroll_on, advantage, disadvantage):
+        return die_sampler(die_size, reroll_on, advantage and not disadvantage, disadvantage and not advantage).sample(num_rolls, rng)
+    return roll(num_rolls, die_size=die_size, rng=rng)
+
+class DicePool:
+    """ Roll planner that gathers every group of dice needed by a context, each group is drawn as one sum and single dice of the same size in one draw
+        Example Usage:
+            pool = DicePool()
+            pool.add('hit', num_hits, [2, 5], [6, 8]) # 2d6+5d8 for each hit
+            pool.add('crit', num_crits, [2, 5, 1], [6, 8, 8])
+            sums = pool.roll(rng=rng) # {'hit': array of num_hits sums, 'crit': array of num_crits sums}
+    """
+    def __init__(self):
+        self.num_rolls = {}
+        self.requests = {} # die_size -> list of (key, num_rolls, num_die)
+
+    def add(self, key, num_rolls, num_die=None, die_size=None):
+        """ Requests num_rolls sums of the dice groups num_die and die_size, i.e. num_die=[2,1], die_size=[6,8] is 2d6+1d8 """
+        self.num_rolls[key] = num_rolls
+        num_die =  [] if num_die is None else num_die
+        die_size = [] if die_size is None else die_size
+        for nd, ds in zip(num_die, die_size):
+            if nd > 0 and ds > 0 and num_rolls > 0:
+                self.requests.setdefault(ds, []).append((key, num_rolls, nd))
+
+    def roll(self, advantage=False, disadvantage=False, reroll_on=0, rng=RNG):
+        """ Rolls every requested group and returns the sum for each request key
+            Groups of several dice are drawn as one sum from the exact distribution of their total, single dice share one draw per die size """
+        sums = {key: np.zeros(n, dtype='int32') for key, n in self.num_rolls.items()}
+        for ds, requests in self.requests.items():
+            for key, n, nd in requests:
+                if nd > 1:
+                    sums[key] += dice_sum_sampler(nd, ds, reroll_on, advantage and not disadvantage, disadvantage and not advantage).sample(n, rng)
+            singles = [(key, n) for key, n, nd in requests if nd == 1]
+            if not singles:
+                continue
+            rolls = roll_adv_dis(sum(n for _, n in singles), advantage, disadvantage, die_size=ds, reroll_on=reroll_on, rng=rng)
+            start = 0
+            for key, n in singles:
+                sums[key] += rolls[start:start+n]
+                start += n
+        return sums
 
 def attack_roll(num_rolls, num_die = None, die_size=None, modifier=0, difficulty_class=15, crit_on=20,always_hit=False,always_crit=False, saving_throw=False,**kwargs):
     """ Roll an attack roll with num_rolls dice, adding attack_modifier to each roll, tracking hits and crits"""
@@ -43,14 +94,14 @@ def attack_roll(num_rolls, num_die = None, die_size=None, modifier=0, difficulty
     if always_crit:
         return np.ones(num_rolls)*20+modifier, np.ones(num_rolls)*20, np.ones(num_rolls, dtype=bool), np.ones(num_rolls, dtype=bool)
 
-    # Normal case
-    rolls = roll_adv_dis(num_rolls,**kwargs)
+    # Normal case, bonus attack dice use the same advantage and rerolls as the d20
+    pool = DicePool()
+    pool.add('die', num_rolls, [1], [20])
+    pool.add('bonus', num_rolls, num_die, die_size)
+    sums = pool.roll(**kwargs)
+    rolls = sums['die']
     # Add modifiers
-    attack_rolls = rolls + modifier
-    num_die =  [] if num_die is None else num_die
-    die_size = [] if die_size is None else die_size
-    for nd, ds in zip(num_die, die_size):
-        attack_rolls += roll_adv_dis(num_rolls * nd, die_size=ds, **kwargs).reshape(-1, nd).sum(axis=1)
+    attack_rolls = rolls + modifier + sums['bonus']
     # Saving throw, a hit is if the roll is lower than the difficulty class, crits are ignored
     if saving_throw:
         hit = attack_rolls < difficulty_class
@@ -72,56 +123,73 @@ def damage_roll(hit, crit, num_die=None, die_size=None, modifier=0, damage_multi
     crit_num_die = [] if crit_num_die is None else crit_num_die
     crit_damage_die = [] if crit_damage_die is None else crit_damage_die
 
+    # Roll all hit, crit and miss dice together
+    miss = ~hit
+    pool = DicePool()
+    pool.add('hit', np.count_nonzero(hit), num_die, die_size)
+    # Crits roll the hit dice twice, plus bonus damage for crits, i.e. half-orc savage attacks, brutal critical, etc.
+    pool.add('crit', np.count_nonzero(crit), num_die + crit_num_die, die_size + crit_damage_die)
+    pool.add('miss', np.count_nonzero(miss), miss_num_die, miss_damage_die)
+    sums = pool.roll(**kwargs)
+
     num_rolls = len(hit)
-    # Roll damage for hits
+    # Damage for hits
     hit_damage = np.zeros(num_rolls, dtype='int32')
-    hits = hit_damage[hit]
-    hits += modifier
-    num_hits = len(hits)
-    for nd, ds in zip(num_die, die_size):
-        hits += np.array([roll_adv_dis(num_hits, die_size=ds, **kwargs) for _ in range(nd)]).sum(axis=0) # a list comp is faster than reshaping a numpy array
-
-    hit_damage[hit] = np.multiply(hits, damage_multiplier)
+    hit_damage[hit] = np.multiply(sums['hit'] + modifier, damage_multiplier)
 
-    # Roll damage for misses/failed saving throws
-    miss = ~hit
+    # Damage for misses/failed saving throws
     miss_damage = np.zeros(num_rolls, dtype='int32')
-    misses = miss_damage[miss]
-    misses += miss_damage_modifier
-    num_misses = len(misses)
-    for nd, ds in zip(miss_num_die, miss_damage_die):
-        misses += np.array([roll_adv_dis(num_misses, die_size=ds, **kwargs) for _ in range(nd)]).sum(axis=0)
-    misses = np.multiply(misses, failed_multiplier)
-    misses = np.multiply(misses, damage_multiplier)
-    miss_damage[miss] = misses
-
-    # Roll damage for crits (roll hit dice twice, traditionally there is no flat modifier for crits)
+    misses = np.multiply(sums['miss'] + miss_damage_modifier, failed_multiplier)
+    miss_damage[miss] = np.multiply(misses, damage_multiplier)
+
+    # Damage for crits (roll hit dice twice, traditionally there is no flat modifier for crits)
     crit_damage = np.zeros(num_rolls, dtype='int32')
-    crits = crit_damage[crit]
-    num_crits = len(crits)
-    for nd, ds in zip(num_die, die_size):
-        crits += np.array([roll_adv_dis(num_crits, die_size=ds, **kwargs) for _ in range(nd)]).sum(axis=0)
-    # Bonus damage for crits, i.e. half-orc savage attacks, brutal critical, etc.
-    crits += crit_damage_modifier
-    for nd, ds in zip(crit_num_die, crit_damage_die):
-        crits += np.array([roll_adv_dis(num_crits, die_size=ds, **kwargs) for _ in range(nd)]).sum(axis=0)
-    crit_damage[crit] = np.multiply(crits, damage_multiplier)
+    crit_damage[crit] = np.multiply(sums['crit'] + crit_damage_modifier, damage_multiplier)
 
     # Track total, hit, crit, and miss/fail damage
     total_damage = hit_damage + crit_damage + miss_damage
     return total_damage, hit_damage, crit_damage, miss_damage
 
+def attack_roll_multi_dc(num_rolls, difficulty_classes, difficulty_class=15, always_hit=False, always_crit=False, saving_throw=False, **kwargs):
+    """ Roll an attack roll once and threshold it against many difficulty classes, only the hit mask depends on the difficulty class
+        Returns hits with shape (len(difficulty_classes), num_rolls) and crits with shape (num_rolls,)"""
+    attack_rolls, rolls, hit, crit = attack_roll(num_rolls, difficulty_class=difficulty_class, always_hit=always_hit, always_crit=always_crit, saving_throw=saving_throw, **kwargs)
+    if always_hit or always_crit:
+        return np.broadcast_to(hit, (len(difficulty_classes), num_rolls)), crit
+    difficulty_classes = np.asarray(difficulty_classes)[:, np.newaxis]
+    if saving_throw:
+        return attack_rolls < difficulty_classes, crit
+    hits = np.logical_and(attack_rolls >= difficulty_classes, rolls != 1)
+    hits |= crit
+    return hits, crit
+
+def attack_multi_dc(num_rolls, difficulty_classes, attack_context, damage_context, **kwargs):
+    """ Roll attack and damage rolls once for num_rolls dice and return the damage against each difficulty class, shape (len(difficulty_classes), num_rolls)
+        Attack totals and damage rolls do not depend on the difficulty class, so every difficulty class sees the same dice"""
+    hits, crit = attack_roll_multi_dc(num_rolls, difficulty_classes, **attack_context, **kwargs)
+    # Crits do not depend on the difficulty class, but a non-crit can be a hit against one and a miss against another, so roll both for every round
+    _, hit_damage, crit_damage, _ = damage_roll(np.ones(num_rolls, dtype=bool), crit, **damage_context, **kwargs)
+    _, _, _, miss_damage = damage_roll(np.zeros(num_rolls, dtype=bool), np.zeros(num_rolls, dtype=bool), **damage_context, **kwargs)
+    return np.where(hits, hit_damage + crit_damage, miss_damage)
+
 def attack(num_rolls, attack_context, damage_context, **kwargs):
     """ Roll attack and damage rolls for num_rolls dice, using attack_context and damage_context"""
     attack_rolls, rolls, hit, crit = attack_roll(num_rolls, **attack_context, **kwargs)
     total_damage, hit_damage, crit_damage, miss_damage = damage_roll(hit, crit, **damage_context, **kwargs)
     return attack_rolls, rolls, hit, crit, total_damage, hit_damage, crit_damage, miss_damage
 
+SUMMARY_COLUMNS = ['mean','min','25%','50%','75%','max']
+
+@timed(name="summarize")
 def describe(g):
-    """ Faster implementation of pandas describe """
-    # desc = pd.concat([g.agg(["mean"]), g.quantile([0,0.25,0.5,0.75,1])])
-    desc = pd.concat([g.agg(["mean"]), g.agg(np.percentile,q=[0,25,50,75,100])])
-    desc.index = ['mean','min','25%','50%','75%','max']
+    """ Faster implementation of pandas describe, using a histogram of each column """
+    desc = describe_rows(g.to_numpy().T)
+    return pd.DataFrame(desc.T, index=SUMMARY_COLUMNS, columns=g.columns)
+
+def describe_multi(values, index='Damage'):
+    """ Same as describe, but for each row of a 2D array, returned as one row per array row """
+    desc = pd.DataFrame(describe_rows(values), columns=SUMMARY_COLUMNS)
+    desc.index = [index]*len(desc)
     return desc
 
 def simulate_rounds(attack_context, damage_context, num_rounds=10000, **kwargs):
@@ -148,7 +216,7 @@ def simulate_rounds_from_contexts(attack_contexts, damage_contexts, attack_names
             attack_df_dict[attack_name] = df_per_attack
         if by_round:
             if df_by_round is None:
-                df_by_round = df_per_attack
+                df_by_round = df_per_attack.copy()
             else:
                 df_by_round = df_by_round.add(df_per_attack, fill_value=0)
 
@@ -161,9 +229,233 @@ def simulate_rounds_from_contexts(attack_contexts, damage_contexts, attack_names
     return attack_df_dict, df_by_round
 
 
+def compact_results(table, results):
+    """ CompactResults of each character from the (characters, attacks, rounds) arrays of simulate_context_table """
+    return [CompactResults.from_arrays(names, {col: results[col][ii, :len(names)] for col in RESULT_COLUMNS}) for ii, names in enumerate(table.attack_names)]
+
+def frames_from_results(table, results, save_memory=False):
+    """ Builds the DataFrames returned by simulate_rounds_from_characters from the (characters, attacks, rounds) arrays of simulate_context_table
+        Results are compacted first, and this is the only place pandas is used by the batched engine """
+    dfs = []
+    df_by_rounds = []
+    dfs_by_attack = []
+    for compact in compact_results(table, results):
+        # All Attacks per Round, with the same layout as concatenating each attack's DataFrame
+        if save_memory:
+            dfs.append(compact.to_frame(columns=["Damage"])[["Damage","Attack"]])
+        else:
+            dfs.append(compact.to_frame())
+
+        # Summary Stats grouped by attack
+        dfs_by_attack.append(pd.concat({n:describe(pd.DataFrame(v)) for n,v in compact.by_attack_name().items()}))
+
+        # Grouped by Round
+        df_by_rounds.append(compact.by_round())
+    return dfs, df_by_rounds, dfs_by_attack
+
+def simulate_rounds_batched(characters, enemy, num_rounds=10000, save_memory=False, paired=False, rng=RNG):
+    """ Simulate rounds of combat for a list of characters against an enemy, with every character and attack compiled into one table and simulated in one batched kernel
+        With paired, every character sees the same dice per round and attack slot (common random numbers) """
+    table = compile_context_table(characters, enemy)
+    results = simulate_context_table(table, num_rounds, rng, paired=paired)
+    return frames_from_results(table, results, save_memory=save_memory)
+
+def estimate_bytes_per_round(table):
+    """ Rough upper bound on the memory simulate_context_table uses per simulated round """
+    dice_per_row = sum(getattr(table, f"{g}_num_die").sum(axis=1, initial=0).max(initial=0) for g in ['attack', 'damage', 'crit', 'miss'])
+    # Result columns plus the uniforms for every die, twice for advantage/disadvantage
+    return table.num_rows * (len(RESULT_COLUMNS)*4 + 2*8*(1 + dice_per_row))
+
+def table_simulator(engine='batched', paired=False):
+    """ Function that simulates a ContextTable with the given engine, either 'batched' or 'numba', as f(table, num_rounds, rng)
+        With paired, characters share random numbers, see simulate_context_table, which only the batched engine supports """
+    if engine == 'numba':
+        if paired:
+            # Characters draw a different number of dice from the kernel's streams, so they would not stay in step
+            raise ValueError("Paired simulations are only supported by the 'batched' engine")
+        from computations.numba_kernel import simulate_context_table_numba # pylint: disable=import-outside-toplevel
+        return lambda table, num_rounds, rng: simulate_context_table_numba(table, num_rounds, seed_from_rng(rng))
+    if engine != 'batched':
+        raise ValueError(f"Unknown simulation engine '{engine}'")
+    return lambda table, num_rounds, rng: simulate_context_table(table, num_rounds, rng, paired=paired)
+
+@timed(name="summarize")
+def update_histograms(table, results, hists_by_round, hists_by_attack):
+    """ Folds the results of simulate_context_table into running histograms per round and per attack of each character in the table """
+    for ii, attack_names in enumerate(table.attack_names):
+        for col in RESULT_COLUMNS:
+            hists_by_round[ii][col].update(results[col][ii, :len(attack_names)].sum(axis=0, dtype='int32'))
+            for jj, name in enumerate(attack_names):
+                hists_by_attack[ii][name][col].update(results[col][ii, jj])
+
+@timed(name="summarize")
+def histogram_frames(hists_by_round, hists_by_attack):
+    """ Summary stats per round and per attack from running histograms, in the describe layout """
+    df_by_rounds = [pd.DataFrame({col: h.describe() for col, h in hists.items()}) for hists in hists_by_round]
+    dfs_by_attack = [pd.concat({name: pd.DataFrame({col: h.describe() for col, h in hists.items()}) for name, hists in by_attack.items()}) for by_attack in hists_by_attack]
+    return df_by_rounds, dfs_by_attack
+
+def simulate_rounds_streaming(characters, enemy, num_rounds=10000, chunk_size=None, memory_budget=256_000_000, engine='batched', paired=False, rng=RNG):
+    """ Simulate rounds of combat in fixed size chunks, folding each chunk into running histograms so memory does not grow with num_rounds
+        chunk_size defaults to the number of rounds that fit in memory_budget bytes, engine is either 'batched' or 'numba'
+        Returns the histograms of every column per round and per attack, then summary stats per round and per attack in the describe layout """
+    simulate_table = table_simulator(engine, paired=paired)
+    table = compile_context_table(characters, enemy)
+    if chunk_size is None:
+        chunk_size = max(int(memory_budget // max(estimate_bytes_per_round(table), 1)), 1)
+
+    hists_by_round = [{col: RunningHistogram() for col in RESULT_COLUMNS} for _ in characters]
+    hists_by_attack = [{name: {col: RunningHistogram() for col in RESULT_COLUMNS} for name in names} for names in table.attack_names]
+    for start in range(0, num_rounds, chunk_size):
+        results = simulate_table(table, min(chunk_size, num_rounds - start), rng)
+        update_histograms(table, results, hists_by_round, hists_by_attack)
+        del results
+
+    return hists_by_round, hists_by_attack, *histogram_frames(hists_by_round, hists_by_attack)
+
+def simulate_rounds_paired(characters, enemy, num_rounds=10000, baseline=0, chunk_size=None, memory_budget=256_000_000, engine='batched', rng=RNG):
+    """ Paired comparison of characters, every character sees the same d20 and dice uniforms per round and attack slot (common random numbers)
+        Returns the histogram of damage per round of each character, the histogram of each other character's damage per round minus the baseline character's
+        keyed by the character's index, so characters with the same name are kept apart, and a summary of each mean difference with its paired standard error and the standard error of the same comparison with independent simulations """
+    simulate_table = table_simulator(engine, paired=True)
+    table = compile_context_table(characters, enemy)
+    if chunk_size is None:
+        chunk_size = max(int(memory_budget // max(estimate_bytes_per_round(table), 1)), 1)
+
+    others = [ii for ii in range(len(characters)) if ii != baseline]
+    hists_by_round = [RunningHistogram() for _ in characters]
+    hists_difference = {ii: RunningHistogram() for ii in others}
+    for start in range(0, num_rounds, chunk_size):
+        results = simulate_table(table, min(chunk_size, num_rounds - start), rng)
+        damage = results['Damage'].sum(axis=1, dtype='int32') # (characters, rounds)
+        for ii, h in enumerate(hists_by_round):
+            h.update(damage[ii])
+        for ii in others:
+            hists_difference[ii].update(damage[ii] - damage[baseline])
+        del results
+
+    base = hists_by_round[baseline]
+    summary = pd.DataFrame({
+        'Mean Difference': [hists_difference[ii].mean() for ii in others],
+        'Std Error (Paired)': [hists_difference[ii].std_error() for ii in others],
+        'Std Error (Independent)': [np.hypot(hists_by_round[ii].std_error(), base.std_error()) for ii in others],
+    }, index=pd.Index([f"{characters[ii].name} - {characters[baseline].name}" for ii in others], name='Comparison'))
+    summary['Variance Reduction'] = (summary['Std Error (Independent)'] / summary['Std Error (Paired)'])**2
+    return hists_by_round, hists_difference, summary
+
+class AdaptiveRounds:
+    """ Schedule of growing batches of rounds for cells, such as characters or armor classes, that are simulated until their mean damage per round is precise enough
+        A cell stops once the standard error of its mean is at most tolerance, every cell stops at max_rounds or once time_budget seconds have passed
+        Example Usage:
+            schedule = AdaptiveRounds(len(characters), tolerance=0.05)
+            for cells, num_rounds in schedule:
+                ... simulate num_rounds more rounds of each cell in cells
+                schedule.record(cells, num_rounds, std_errors) # standard errors of the cells after the batch
+            schedule.report(names) # rounds used and precision of each cell
+    """
+    def __init__(self, num_cells, tolerance=ADAPTIVE_TOLERANCE, time_budget=None, min_rounds=ADAPTIVE_MIN_ROUNDS, max_rounds=1_000_000, growth=2, max_batch=None):
+        self.tolerance = tolerance
+        self.time_budget = time_budget
+        self.min_rounds = min_rounds
+        self.max_rounds = max_rounds
+        self.growth = growth
+        self.max_batch = max_batch
+        self.rounds = np.zeros(num_cells, dtype='int64')
+        self.std_errors = np.full(num_cells, np.inf)
+        self.converged = np.zeros(num_cells, dtype=bool)
+        self.elapsed = 0.0
+
+    def __iter__(self):
+        start = perf_counter()
+        batch = self.min_rounds
+        rounds_per_second = None
+        while True:
+            cells = np.flatnonzero(~self.converged & (self.rounds < self.max_rounds))
+            self.elapsed = perf_counter() - start
+            if len(cells) == 0 or (self.time_budget is not None and self.elapsed >= self.time_budget):
+                return
+            size = min(batch, self.max_rounds - int(self.rounds[cells].max()), self.max_batch or batch)
+            if rounds_per_second is not None and self.time_budget is not None:
+                # Do not start a batch that would overrun the budget by much
+                size = max(min(size, int((self.time_budget - self.elapsed) * rounds_per_second)), 1)
+            batch_start = perf_counter()
+            yield cells, size
+            rounds_per_second = size / max(perf_counter() - batch_start, 1e-9)
+            # Grow geometrically, but not past the rounds the slowest cell is predicted to need from its standard error
+            needed = self.rounds[cells] * ((self.std_errors[cells] / self.tolerance)**2 - 1)
+            needed = needed[np.isfinite(needed) & ~self.converged[cells]]
+            batch = int(size * self.growth)
+            if len(needed):
+                batch = min(batch, max(int(1.1 * needed.max()) + 1, self.min_rounds))
+
+    def record(self, cells, num_rounds, std_errors):
+        """ Records num_rounds more rounds of each cell and their standard errors """
+        self.rounds[cells] += num_rounds
+        self.std_errors[cells] = std_errors
+        self.converged[cells] = np.asarray(std_errors) <= self.tolerance
+
+    def report(self, index=None):
+        """ Rounds used, standard error of the mean damage per round and whether tolerance was reached, one row per cell """
+        return pd.DataFrame({'Rounds': self.rounds, 'Std Error': self.std_errors, 'Converged': self.converged}, index=index)
+
+def simulate_rounds_adaptive(characters, enemy, tolerance=ADAPTIVE_TOLERANCE, time_budget=None, min_rounds=ADAPTIVE_MIN_ROUNDS, max_rounds=1_000_000,
+                             memory_budget=256_000_000, engine='batched', rng=RNG):
+    """ Same as simulate_rounds_streaming, but each character is simulated in growing batches until its mean damage per round is within tolerance,
+        all characters stop at max_rounds or after time_budget seconds
+        Returns the same as simulate_rounds_streaming plus a report of the rounds used and standard error per character """
+    simulate_table = table_simulator(engine)
+    contexts = [calculate_attack_and_damage_context(c, enemy) for c in characters]
+    max_batch = max(int(memory_budget // max(estimate_bytes_per_round(compile_context_table(characters, enemy, contexts)), 1)), 1)
+
+    hists_by_round = [{col: RunningHistogram() for col in RESULT_COLUMNS} for _ in characters]
+    hists_by_attack = [{a.name: {col: RunningHistogram() for col in RESULT_COLUMNS} for a in c.attacks} for c in characters]
+    schedule = AdaptiveRounds(len(characters), tolerance=tolerance, time_budget=time_budget, min_rounds=min_rounds, max_rounds=max_rounds, max_batch=max_batch)
+    for cells, num_rounds in schedule:
+        # Only characters that have not converged are simulated
+        table = compile_context_table([characters[ii] for ii in cells], enemy, contexts=[contexts[ii] for ii in cells])
+        results = simulate_table(table, num_rounds, rng)
+        update_histograms(table, results, [hists_by_round[ii] for ii in cells], [hists_by_attack[ii] for ii in cells])
+        del results
+        schedule.record(cells, num_rounds, [hists_by_round[ii]['Damage'].std_error() for ii in cells])
+
+    return hists_by_round, hists_by_attack, *histogram_frames(hists_by_round, hists_by_attack), schedule.report(pd.Index([c.name for c in characters], name='Character'))
+
+def simulate_rounds_numba(characters, enemy, num_rounds=10000, save_memory=False, rng=RNG):
+    """ Same as simulate_rounds_batched, but simulated by the fused numba kernel with its own counter based random stream seeded from rng """
+    from computations.numba_kernel import simulate_context_table_numba # pylint: disable=import-outside-toplevel
+    table = compile_context_table(characters, enemy)
+    results = simulate_context_table_numba(table, num_rounds, seed_from_rng(rng))
+    return frames_from_results(table, results, save_memory=save_memory)
+
+def seed_from_rng(rng=RNG):
+    """ Draws a seed for a SeedSequence from a generator, so parallel runs are repeatable for a repeatable rng """
+    return int(rng.integers(0, 2**63))
+
+def check_parallel_options(engine='batched', **options):
+    """ Raises a ValueError for options the process pool simulations would ignore, they always use the batched engine and take only an rng """
+    if engine != 'batched':
+        raise ValueError(f"Parallel simulations only support the 'batched' engine, not '{engine}'")
+    unsupported = [name for name, value in options.items() if name != 'rng' and value is not None and value is not False]
+    if unsupported:
+        raise ValueError(f"Parallel simulations do not support {', '.join(unsupported)}")
+
 @timeit
-def simulate_rounds_from_characters(characters, enemy, num_rounds=10000, save_memory=False, **kwargs):
-    """ Simulate rounds of combat for a list of characters against an enemy"""
+def simulate_rounds_from_characters(characters, enemy, num_rounds=10000, save_memory=False, engine='batched', max_workers=None, **kwargs):
+    """ Simulate rounds of combat for a list of characters against an enemy
+        engine is either 'batched', which simulates all characters and attacks at once, 'numba', which does the same in a fused compiled kernel (requires numba),
+        or 'per_attack', which simulates each attack separately
+        Setting max_workers simulates each character in a separate process with the batched engine"""
+    if max_workers:
+        check_parallel_options(engine, **kwargs)
+        from computations.parallel import simulate_rounds_parallel # pylint: disable=import-outside-toplevel
+        return simulate_rounds_parallel(characters, enemy, num_rounds=num_rounds, save_memory=save_memory, seed=seed_from_rng(kwargs.get('rng', RNG)), max_workers=max_workers)
+    if engine == 'batched':
+        return simulate_rounds_batched(characters, enemy, num_rounds=num_rounds, save_memory=save_memory, **kwargs)
+    if engine == 'numba':
+        return simulate_rounds_numba(characters, enemy, num_rounds=num_rounds, save_memory=save_memory, **kwargs)
+    if engine != 'per_attack':
+        raise ValueError(f"Unknown simulation engine '{engine}'")
+
     dfs = []
     df_by_rounds = []
     dfs_by_attack = []
@@ -197,21 +489,136 @@ def simulate_rounds_from_characters(characters, enemy, num_rounds=10000, save_me
         df_by_rounds.append(df_by_round)
     return dfs, df_by_rounds, dfs_by_attack
 
+def armor_class_sweep_damage(character, enemy, armor_classes, num_rounds=10000, contexts=None, **kwargs):
+    """ Damage of a character against multiple armor classes, rolling the dice once for all armor classes
+        Returns the damage per round with shape (armor classes, rounds) and the damage per attack name with shape (armor classes, rounds * attacks with the name) """
+    armor_classes = np.asarray(armor_classes)
+    # Contexts only depend on the armor class through the difficulty class, which is replaced below
+    attack_contexts, damage_contexts = calculate_attack_and_damage_context(character, enemy) if contexts is None else contexts
+    damage_by_round = np.zeros((len(armor_classes), num_rounds), dtype='int32')
+    damage_by_attack = {}
+    for a, d, attack_ in zip(attack_contexts, damage_contexts, character.attacks):
+        if targets_armor_class(attack_):
+            difficulty_classes = armor_classes
+        else:
+            difficulty_classes = np.full(len(armor_classes), a.difficulty_class)
+        damage = attack_multi_dc(num_rounds, difficulty_classes, asdict(a), asdict(d), **kwargs)
+        damage_by_round += damage
+        damage_by_attack.setdefault(attack_.name, []).append(damage)
+    # Attacks with the same name are pooled, the same as simulate_rounds_from_contexts
+    return damage_by_round, {name: np.hstack(damages) for name, damages in damage_by_attack.items()}
+
+def armor_class_sweep_stats(character, enemy, armor_classes, num_rounds=10000, by_round=True, **kwargs):
+    """ Simulate rounds of combat for a character against multiple armor classes, rolling the dice once for all armor classes
+        Returns summary stats per armor class, keyed by None when by_round, otherwise by attack name"""
+    damage_by_round, damage_by_attack = armor_class_sweep_damage(character, enemy, armor_classes, num_rounds=num_rounds, **kwargs)
+    if by_round:
+        return {None: describe_rows(damage_by_round)}
+    return {name: describe_rows(damage) for name, damage in damage_by_attack.items()}
+
+def armor_class_sweep_adaptive(character, enemy, armor_classes, by_round=True, tolerance=ADAPTIVE_TOLERANCE, time_budget=None,
+                               min_rounds=ADAPTIVE_MIN_ROUNDS, max_rounds=1_000_000, memory_budget=256_000_000, **kwargs):
+    """ Same as armor_class_sweep_stats, but each armor class is simulated in growing batches until its mean damage per round is within tolerance
+        Returns the summary stats and the AdaptiveRounds precision report per armor class """
+    armor_classes = np.asarray(armor_classes)
+    contexts = calculate_attack_and_damage_context(character, enemy)
+    # Each batch holds a damage array per attack and armor class, plus about as much again in temporaries
+    max_batch = max(int(memory_budget // (2 * 4 * len(armor_classes) * max(len(character.attacks), 1))), 1)
+    hists_by_round = [RunningHistogram() for _ in armor_classes]
+    hists_by_attack = {a.name: [RunningHistogram() for _ in armor_classes] for a in character.attacks}
+    schedule = AdaptiveRounds(len(armor_classes), tolerance=tolerance, time_budget=time_budget, min_rounds=min_rounds, max_rounds=max_rounds, max_batch=max_batch)
+    for cells, num_rounds in schedule:
+        damage_by_round, damage_by_attack = armor_class_sweep_damage(character, enemy, armor_classes[cells], num_rounds=num_rounds, contexts=contexts, **kwargs)
+        for ii, cell in enumerate(cells):
+            hists_by_round[cell].update(damage_by_round[ii])
+            if not by_round:
+                for name, damage in damage_by_attack.items():
+                    hists_by_attack[name][cell].update(damage[ii])
+        schedule.record(cells, num_rounds, [hists_by_round[cell].std_error() for cell in cells])
+
+    def stats(hists):
+        return np.array([h.describe().to_numpy() for h in hists])
+    report = schedule.report(armor_classes)
+    if by_round:
+        return {None: stats(hists_by_round)}, report
+    return {name: stats(hists) for name, hists in hists_by_attack.items()}, report
+
+def armor_class_sweep_frames(character, stats, armor_classes, precision=None):
+    """ Converts the output of armor_class_sweep_stats to the rows returned by simulate_rounds_from_characters_multi_acs
+        precision is the report of armor_class_sweep_adaptive, which adds the rounds used and standard error of each armor class """
+    df_multi_ac = []
+    for name, values in stats.items():
+        df_ac = pd.DataFrame(values, columns=SUMMARY_COLUMNS)
+        df_ac.index = ['Damage']*len(df_ac)
+        if precision is not None:
+            df_ac['Rounds'] = precision['Rounds'].to_numpy()
+            df_ac['Std Error'] = precision['Std Error'].to_numpy()
+        if name is not None:
+            df_ac['Character-Attack'] = f"{character.name}-{name}"
+        df_ac['Character'] = character.name
+        df_ac['Armor Class'] = armor_classes
+        df_multi_ac.append(df_ac)
+    return df_multi_ac
+
+def simulate_armor_class_sweep(characters, enemy, armor_classes, num_rounds=10000, by_round=True, tolerance=None, time_budget=None, **kwargs):
+    """ Simulate rounds of combat for a list of characters against multiple armor classes, rolling the dice once for all armor classes
+        Every armor class sees the same dice (common random numbers), so damage vs armor class curves are smooth
+        Setting tolerance or time_budget simulates each armor class adaptively with num_rounds as the maximum, the time budget is shared by all characters """
+    armor_classes = np.asarray(armor_classes)
+    adaptive = tolerance is not None or time_budget is not None
+    start = perf_counter()
+    df_multi_ac = []
+    for ii, c in enumerate(characters):
+        if adaptive:
+            # Characters left split the time left evenly
+            budget = None if time_budget is None else max(time_budget - (perf_counter() - start), 0) / (len(characters) - ii)
+            stats, precision = armor_class_sweep_adaptive(c, enemy, armor_classes, by_round=by_round, tolerance=ADAPTIVE_TOLERANCE if tolerance is None else tolerance,
+                                                          time_budget=budget, max_rounds=num_rounds, **kwargs)
+        else:
+            stats, precision = armor_class_sweep_stats(c, enemy, armor_classes, num_rounds=num_rounds, by_round=by_round, **kwargs), None
+        df_multi_ac += armor_class_sweep_frames(c, stats, armor_classes, precision)
+
+    # Order by armor class, then character, then attack
+    return pd.concat(df_multi_ac).sort_values('Armor Class', kind='stable')
+
 @timeit
-def simulate_rounds_from_characters_multi_acs(characters, enemy, armor_classes=None, num_rounds=10000, by_round=True, **kwargs):
-    """ Simulate rounds of combat for a list of characters against multiple armor classes"""
+def simulate_rounds_from_characters_multi_acs(characters, enemy, armor_classes=None, num_rounds=10000, by_round=True, roll_once=True, max_workers=None,
+                                             ac_chunks=None, tolerance=None, time_budget=None, **kwargs):
+    """ Simulate rounds of combat for a list of characters against multiple armor classes
+        With roll_once the dice are rolled once and thresholded against every armor class, otherwise each armor class is simulated separately
+        Setting max_workers fans the characters and ac_chunks chunks of their armor classes out to separate processes, always rolling once with the batched engine,
+        ac_chunks defaults to enough chunks for every worker to have a task
+        Setting tolerance or time_budget stops each armor class once its mean damage per round is precise enough, see simulate_armor_class_sweep,
+        this always rolls once in this process and adds Rounds and Std Error columns """
 
     if not armor_classes:
         armor_classes = range(10, 26)
 
+    if max_workers:
+        if not roll_once:
+            raise ValueError("Parallel armor class sweeps always roll once, set roll_once or leave max_workers unset")
+        check_parallel_options(tolerance=tolerance, time_budget=time_budget, **kwargs)
+        if ac_chunks is None:
+            ac_chunks = -(-max_workers // max(len(characters), 1))
+        from computations.parallel import simulate_armor_class_sweep_parallel # pylint: disable=import-outside-toplevel
+        return simulate_armor_class_sweep_parallel(characters, enemy, armor_classes, num_rounds=num_rounds, by_round=by_round, seed=seed_from_rng(kwargs.get('rng', RNG)),
+                                                   max_workers=max_workers, ac_chunks=ac_chunks)
+
+    if tolerance is not None or time_budget is not None:
+        return simulate_armor_class_sweep(characters, enemy, armor_classes, num_rounds=num_rounds, by_round=by_round, tolerance=tolerance, time_budget=time_budget, **kwargs)
+
+    if roll_once:
+        return simulate_armor_class_sweep(characters, enemy, armor_classes, num_rounds=num_rounds, by_round=by_round, **kwargs)
+
     df_multi_ac = []
 
+    # Compile once, then only the difficulty class changes per armor class
+    specs = [compile_spec(c, enemy) for c in characters]
     for ac in armor_classes:
-        enemy.armor_class = ac
-        for c in characters:
+        for c, spec in zip(characters, specs):
             # Attack and Damage Contexts
-            attack_contexts, damage_contexts = calculate_attack_and_damage_context(c, enemy)
-            attack_names = [a.name for a in c.attacks]
+            attack_contexts, damage_contexts = spec.with_armor_class(ac).contexts()
+            attack_names = spec.attack_names
             # Simulate all attacks
             if by_round:
                 _, df_by_round = simulate_rounds_from_contexts(attack_contexts, damage_contexts, attack_names, cols='Damage', by_round=by_round, num_rounds=num_rounds, **kwargs)
@@ -0,0 +1,134 @@
+""" Build optimizer, searching boolean Character flags and point-buy ability scores for the builds with the highest damage per round
+    Builds are ranked by their exact mean damage per round with branch and bound. Mean damage never decreases when an ability score increases,
+    so a partial build with every unassigned ability at the highest score the remaining points afford bounds all of its completions,
+    and partial builds whose bound is below the k-th best build so far are pruned. Builds that compile to the same attacks are the same build,
+    so only the one with the fewest flags and points spent is kept. The top builds are then simulated together,
+    with common random numbers, for confidence intervals """
+from dataclasses import replace
+from itertools import combinations
+from statistics import NormalDist
+import heapq
+import pandas as pd
+
+from computations.analytic import expected_damage_per_round
+from computations.experiments import point_name, simulate_variants, vary
+from computations.models import compile_spec
+from computations.numerical_simulation import RNG
+
+FIGHTING_STYLES = ['archery', 'dueling', 'GWF', 'TWF'] # A character has at most one fighting style
+FEATS = ['GWM', 'sharpshooter', 'savage_attacker', 'tavern_brawler']
+BUILD_FLAGS = FEATS + FIGHTING_STYLES
+# 5e point buy, every score starts at 8 and can be bought up to 15
+POINT_BUY_COSTS = {8: 0, 9: 1, 10: 2, 11: 3, 12: 4, 13: 5, 14: 7, 15: 9}
+POINT_BUY_POINTS = 27
+
+def relevant_abilities(character, flags=BUILD_FLAGS):
+    """ Abilities that can change the damage of the character's attacks, the others are left at their current scores """
+    abilities = [a.ability_stat for a in character.attacks]
+    if ('tavern_brawler' in flags or character.tavern_brawler) and any(a.type in ['unarmed', 'thrown'] for a in character.attacks):
+        abilities.append('strength')
+    if character.lifedrinker or character.agonizing_blast:
+        abilities.append('charisma')
+    if character.empowered_evocation:
+        abilities.append('intelligence')
+    return list(dict.fromkeys(abilities))
+
+def flag_combinations(flags=BUILD_FLAGS, max_feats=None):
+    """ Every assignment of the flags with at most one fighting style and at most max_feats other flags, as dictionaries """
+    styles = [f for f in flags if f in FIGHTING_STYLES]
+    others = [f for f in flags if f not in FIGHTING_STYLES]
+    max_feats = len(others) if max_feats is None else max_feats
+    for num_feats in range(max_feats + 1):
+        for chosen in combinations(others, num_feats):
+            for style in [None] + styles:
+                yield {f: (f in chosen or f == style) for f in flags}
+
+def _max_affordable(points):
+    """ Highest score a single ability can be bought up to with points """
+    return max(score for score, cost in POINT_BUY_COSTS.items() if cost <= points)
+
+def optimize_build(character, enemy, flags=BUILD_FLAGS, abilities=None, points=POINT_BUY_POINTS, racial_bonuses=None, max_feats=None,
+                   top_k=5, num_rounds=100_000, confidence=0.95, engine='batched', rng=RNG):
+    """ Finds the top_k builds of a character by exact mean damage per round against enemy, over the boolean flags and point-buy scores of abilities
+        abilities defaults to relevant_abilities, racial_bonuses such as {'strength': 2} are added after point buy
+        Returns a frame of the top builds with their flags, final scores, exact mean and simulated mean with a confidence interval, and a dictionary of search statistics """
+    abilities = relevant_abilities(character, flags) if abilities is None else abilities
+    racial_bonuses = {} if racial_bonuses is None else racial_bonuses
+    stats = {'builds': 0, 'evaluated': 0, 'pruned': 0, 'duplicates': 0}
+
+    def final_scores(scores):
+        return {a: s + racial_bonuses.get(a, 0) for a, s in zip(abilities, scores)}
+
+    def build(flag_values, scores):
+        return vary(character, **flag_values, **final_scores(scores))
+
+    def evaluate(flag_values, scores):
+        stats['evaluated'] += 1
+        return expected_damage_per_round(build(flag_values, scores), enemy)
+
+    def num_completions(index, remaining):
+        """ Number of point-buy completions of the abilities from index on, including odd scores that are skipped """
+        if index == len(abilities):
+            return 1
+        return sum(num_completions(index + 1, remaining - cost) for cost in POINT_BUY_COSTS.values() if cost <= remaining)
+
+    best = [] # min heap of (mean, -order found, flags, scores, spec) holding the top_k builds, of equal means the latest found is dropped first
+    in_best = {} # spec of every build in best to its entry
+    def kth_best():
+        return best[0][0] if len(best) == top_k else -float('inf')
+
+    def branch(flag_values, scores, remaining, bound):
+        index = len(scores)
+        if bound <= kth_best():
+            stats['pruned'] += num_completions(index, remaining)
+            return
+        if index == len(abilities):
+            # The bound of a complete build is its mean
+            stats['builds'] += 1
+            spec = compile_spec(build(flag_values, scores), enemy)
+            if spec in in_best:
+                # The same build, keep whichever has fewer flags and then fewer points spent
+                stats['duplicates'] += 1
+                old = in_best[spec]
+                if (sum(flag_values.values()), points - remaining) >= (sum(old[2].values()), sum(POINT_BUY_COSTS[s] for s in old[3])):
+                    return
+                entry = (old[0], old[1], flag_values, scores, spec)
+                best[best.index(old)] = entry
+                in_best[spec] = entry
+                return
+            entry = (bound, -stats['builds'], flag_values, scores, spec)
+            heapq.heappush(best, entry)
+            in_best[spec] = entry
+            if len(best) > top_k:
+                del in_best[heapq.heappop(best)[4]]
+            return
+        # Highest scores first, so good builds are found early and prune more
+        bonus = racial_bonuses.get(abilities[index], 0)
+        for score in sorted(POINT_BUY_COSTS, reverse=True):
+            cost = POINT_BUY_COSTS[score]
+            # An odd final score has the same modifier as the cheaper score below it
+            if cost > remaining or ((score + bonus) % 2 == 1 and score > min(POINT_BUY_COSTS)):
+                continue
+            child = scores + (score,)
+            child_bound = evaluate(flag_values, child + (_max_affordable(remaining - cost),) * (len(abilities) - len(child)))
+            branch(flag_values, child, remaining - cost, child_bound)
+
+    # Flag assignments with the highest bounds are searched first, and of equal bounds the ones with fewer flags, so flags that add nothing are pruned
+    roots = [(evaluate(f, (_max_affordable(points),) * len(abilities)), f) for f in flag_combinations(flags, max_feats)]
+    for bound, flag_values in sorted(roots, key=lambda r: (-r[0], sum(r[1].values()))):
+        branch(flag_values, (), points, bound)
+
+    # Simulate the top builds together for confidence intervals
+    top = sorted(best, key=lambda b: (-b[0], -b[1]))
+    variants = [replace(build(f, s), name=point_name({**{k: v for k, v in f.items() if v}, **final_scores(s)})) for _, _, f, s, _ in top]
+    hists = simulate_variants(variants, enemy, num_rounds=num_rounds, engine=engine, rng=rng)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    df = pd.DataFrame([{**f, **final_scores(s)} for _, _, f, s, _ in top])
+    df['Name'] = [v.name for v in variants]
+    df['Expected DPR'] = [mean for mean, *_ in top]
+    df['Simulated DPR'] = [h.mean() for h in hists]
+    df['Std Error'] = [h.std_error() for h in hists]
+    df['CI Low'] = df['Simulated DPR'] - z * df['Std Error']
+    df['CI High'] = df['Simulated DPR'] + z * df['Std Error']
+    stats['candidates'] = sum(num_completions(0, points) for _ in flag_combinations(flags, max_feats))
+    return df, stats
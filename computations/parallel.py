@@ -0,0 +1,110 @@
+""" Process pool execution of the numerical simulations
+    Each character (and chunk of armor classes) is simulated in a separate process with its own random stream spawned from one SeedSequence,
+    so results are reproducible regardless of the number of workers. Results are written to shared memory instead of being pickled """
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+
+from computations.context_table import RESULT_COLUMNS, compile_context_table, simulate_context_table
+from computations.numerical_simulation import SEED, SUMMARY_COLUMNS, frames_from_results, armor_class_sweep_stats, armor_class_sweep_frames
+
+### Shared Memory ###
+
+def _create_shared_array(shape, dtype):
+    """ Creates a zeroed array backed by a new shared memory block """
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    array[...] = 0
+    return shm, array
+
+def _attach_shared_array(name, shape, dtype):
+    """ Attaches to a shared memory block created by the parent process """
+    # Workers share the parent's resource tracker, so the block is only unlinked once by the parent
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+### Workers ###
+
+def _simulate_character_worker(character, enemy, num_rounds, seed, index, shm_name, shape):
+    """ Simulates a single character and writes its results to slot index of the shared results array """
+    table = compile_context_table([character], enemy)
+    results = simulate_context_table(table, num_rounds, np.random.default_rng(seed))
+    shm, shared = _attach_shared_array(shm_name, shape, 'int32')
+    try:
+        for ii, col in enumerate(RESULT_COLUMNS):
+            shared[ii, index, :table.max_attacks] = results[col][0]
+    finally:
+        del shared
+        shm.close()
+
+def _armor_class_sweep_worker(character, enemy, armor_classes, num_rounds, by_round, seed, index, ac_slice, shm_name, shape):
+    """ Simulates a character against a chunk of armor classes and writes the summary stats to the shared stats array
+        The seed only depends on the character, so every chunk of armor classes sees the same dice """
+    stats = armor_class_sweep_stats(character, enemy, armor_classes[ac_slice], num_rounds=num_rounds, by_round=by_round, rng=np.random.default_rng(seed))
+    shm, shared = _attach_shared_array(shm_name, shape, float)
+    try:
+        for jj, values in enumerate(stats.values()):
+            shared[index, jj, ac_slice] = values
+    finally:
+        del shared
+        shm.close()
+
+### Parallel Simulations ###
+
+def spawn_seeds(seed, num):
+    """ Independent child seeds, the i-th child is the same no matter how many workers are used """
+    return np.random.SeedSequence(seed).spawn(num)
+
+def simulate_rounds_parallel(characters, enemy, num_rounds=10000, save_memory=False, seed=SEED, max_workers=None):
+    """ Parallel version of simulate_rounds_from_characters, simulating each character in a separate process """
+    table = compile_context_table(characters, enemy)
+    shape = (len(RESULT_COLUMNS), table.num_characters, table.max_attacks, num_rounds)
+    shm, shared = _create_shared_array(shape, 'int32')
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_simulate_character_worker, c, enemy, num_rounds, s, ii, shm.name, shape)
+                for ii, (c, s) in enumerate(zip(characters, spawn_seeds(seed, len(characters))))
+            ]
+            for f in futures:
+                f.result()
+        results = {col: shared[ii] for ii, col in enumerate(RESULT_COLUMNS)}
+        frames = frames_from_results(table, results, save_memory=save_memory)
+        del results
+    finally:
+        del shared
+        shm.close()
+        shm.unlink()
+    return frames
+
+def simulate_armor_class_sweep_parallel(characters, enemy, armor_classes, num_rounds=10000, by_round=True, seed=SEED, max_workers=None, ac_chunks=1):
+    """ Parallel version of simulate_armor_class_sweep, fanning characters and chunks of armor classes out to separate processes """
+    armor_classes = np.asarray(armor_classes)
+    num_keys = [1 if by_round else len(dict.fromkeys(a.name for a in c.attacks)) for c in characters]
+    shape = (len(characters), max(num_keys, default=0), len(armor_classes), len(SUMMARY_COLUMNS))
+    ac_slices = [slice(chunk[0], chunk[-1]+1) for chunk in np.array_split(np.arange(len(armor_classes)), ac_chunks) if len(chunk) > 0]
+    shm, shared = _create_shared_array(shape, float)
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_armor_class_sweep_worker, c, enemy, armor_classes, num_rounds, by_round, s, ii, ac_slice, shm.name, shape)
+                for ii, (c, s) in enumerate(zip(characters, spawn_seeds(seed, len(characters))))
+                for ac_slice in ac_slices
+            ]
+            for f in futures:
+                f.result()
+
+        df_multi_ac = []
+        for ii, c in enumerate(characters):
+            keys = [None] if by_round else list(dict.fromkeys(a.name for a in c.attacks))
+            stats = {k: shared[ii, jj].copy() for jj, k in enumerate(keys)}
+            df_multi_ac += armor_class_sweep_frames(c, stats, armor_classes)
+    finally:
+        del shared
+        shm.close()
+        shm.unlink()
+
+    # Order by armor class, then character, then attack
+    return pd.concat(df_multi_ac).sort_values('Armor Class', kind='stable')
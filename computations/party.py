@@ -0,0 +1,97 @@
+""" Party simulation, several characters taking turns in initiative order against shared enemy hit points
+    Initiative is rolled per trial and kept as a (trials, members) permutation. Each round every member's attacks are simulated once for all trials,
+    then for each initiative position the trials where a member acts there take its turn, so a party costs about as much as its members alone """
+import numpy as np
+import pandas as pd
+
+from computations.multi_target import Attacker, TargetTable, take_turn
+from computations.numerical_simulation import RNG, estimate_bytes_per_round
+from computations.stats import RunningHistogram
+from computations.turns_to_kill import MAX_FIGHT_ROUNDS
+
+def roll_initiative(characters, num_trials, rng):
+    """ Turn order of the party in each trial, d20 + dexterity modifier + initiative bonus, ties go to the higher dexterity modifier then at random
+        Returns a (trials, members) array, the member acting at each position """
+    dexterity = np.array([c.dexterity_ability_modifier for c in characters], dtype=float)
+    bonus = np.array([c.initiative for c in characters], dtype=float)
+    totals = rng.integers(1, 21, size=(num_trials, len(characters))) + dexterity + bonus
+    keys = totals + dexterity / 100 + rng.random(totals.shape) / 10_000
+    return np.argsort(-keys, axis=1)
+
+def simulate_party(characters, enemies, num_trials=10000, max_rounds=MAX_FIGHT_ROUNDS, target_policy='focus_fire', memory_budget=256_000_000, rng=RNG):
+    """ Simulates num_trials fights of the party against every enemy, until all enemies reach 0 hit points or max_rounds have passed
+        Damage past an enemy's remaining hit points is not counted
+        Returns a dictionary of histograms of the rounds to kill all enemies, to kill each enemy and the party damage per round,
+        a list of histograms of each member's damage per round, a frame of each member's share of the damage, and the number of unfinished fights
+        Members are tracked by their position in characters, so members with the same name are kept apart """
+    targets = TargetTable.from_enemies(enemies)
+    attackers = [Attacker.from_character(c, enemies) for c in characters]
+    hists = {'Rounds To Kill All': RunningHistogram()}
+    hists.update({f"Rounds To Kill {name}": RunningHistogram() for name in targets.names})
+    hists['Party Damage Per Round'] = RunningHistogram()
+    member_hists = [RunningHistogram() for _ in characters]
+    totals = pd.DataFrame(0.0, index=range(len(characters)), columns=['Damage', 'Killing Blows', 'Acts First'])
+    if not any(c.attacks for c in characters):
+        return hists, member_hists, party_members_frame(characters, totals, 0, num_trials), num_trials
+
+    unfinished = 0
+    rounds_fought = 0
+    bytes_per_trial = sum(estimate_bytes_per_round(a.single) for a in attackers) * targets.num_targets
+    chunk_size = max(int(memory_budget // max(bytes_per_trial, 1)), 1)
+    for start in range(0, num_trials, chunk_size):
+        n = min(chunk_size, num_trials - start)
+        hit_points = np.tile(targets.hit_points, (n, 1))
+        order = roll_initiative(characters, n, rng)
+        totals['Acts First'] += np.bincount(order[:, 0], minlength=len(characters))
+        for r in range(1, max_rounds + 1):
+            rounds_fought += len(hit_points)
+            start_of_round = hit_points.clip(0)
+            results = [a.simulate(len(hit_points), rng) for a in attackers]
+            member_damage = np.zeros((len(characters), len(hit_points)), dtype='int64')
+            for position in range(len(characters)):
+                for m, attacker in enumerate(attackers):
+                    trials = np.flatnonzero(order[:, position] == m)
+                    if len(trials) == 0 or not attacker.character.attacks:
+                        continue
+                    hp = hit_points[trials]
+                    before = hp.clip(0)
+                    take_turn(attacker, targets, hp, rng, target_policy=target_policy,
+                              results={k: v[..., trials] for k, v in results[m].items()})
+                    after = hp.clip(0)
+                    hit_points[trials] = hp
+                    member_damage[m, trials] = (before - after).sum(axis=1)
+                    totals.loc[m, 'Killing Blows'] += ((before > 0) & (after == 0)).sum()
+            for h, damage in zip(member_hists, member_damage):
+                h.update(damage)
+            totals['Damage'] += member_damage.sum(axis=1)
+            hists['Party Damage Per Round'].update(member_damage.sum(axis=0))
+            end_of_round = hit_points.clip(0)
+            for name, killed in zip(targets.names, ((start_of_round > 0) & (end_of_round == 0)).T):
+                hists[f"Rounds To Kill {name}"].update(np.full(killed.sum(), r))
+            # Fights where every enemy is dead are retired, along with their turn order
+            done = end_of_round.sum(axis=1) == 0
+            hists['Rounds To Kill All'].update(np.full(done.sum(), r))
+            hit_points = hit_points[~done]
+            order = order[~done]
+            if len(hit_points) == 0:
+                break
+        unfinished += len(hit_points)
+    return hists, member_hists, party_members_frame(characters, totals, rounds_fought, num_trials), unfinished
+
+def party_members_frame(characters, totals, rounds_fought, num_trials):
+    """ Each member's damage per round, share of the party's damage, killing blows per fight and how often it acts first
+        totals has a row per member in order, the frame is indexed by the members' names """
+    df = pd.DataFrame(index=pd.Index([c.name for c in characters]))
+    df['DPR'] = totals['Damage'].to_numpy() / max(rounds_fought, 1)
+    df['Damage Share'] = totals['Damage'].to_numpy() / max(totals['Damage'].sum(), 1)
+    df['Killing Blows'] = totals['Killing Blows'].to_numpy() / max(num_trials, 1)
+    df['Acts First'] = totals['Acts First'].to_numpy() / max(num_trials, 1)
+    return df
+
+def party_summary(results):
+    """ Summary stats of the fight histograms of simulate_party, plus the fraction of fights where every enemy was killed """
+    hists, _, _, unfinished = results
+    df = pd.DataFrame({name: h.describe() if h.total else pd.Series(np.nan, index=['mean','min','25%','50%','75%','max']) for name, h in hists.items()})
+    finished = hists['Rounds To Kill All'].total
+    df.loc['Finished'] = finished / max(finished + unfinished, 1)
+    return df
@@ -0,0 +1,89 @@
+""" Compact columnar container for simulation results
+    Each column is stored with the narrowest dtype that holds it, hit and crit flags are bit-packed and the round index is implicit,
+    so a round of one attack takes 11 bytes and 2 bits instead of 40 bytes. DataFrames are only built on demand """
+from dataclasses import dataclass, field
+import numpy as np
+import pandas as pd
+
+from computations.context_table import RESULT_COLUMNS
+
+# Narrowest dtype each column is stored as, wider dtypes are only used if the values do not fit
+DTYPE_POLICY = {
+    'Damage': 'int16',
+    'Damage (From Hit)': 'int16',
+    'Damage (From Crit)': 'int16',
+    'Damage (Miss/Fail)': 'int16',
+    'Attack Roll': 'int16',
+    'Attack Roll (Die)': 'uint8',
+}
+WIDENING = ['uint8', 'int16', 'int32', 'int64']
+FLAG_COLUMNS = ['Hit', 'Hit (Crit)'] # Hit (Non-Crit) is derived from these
+
+def fit_dtype(values, dtype):
+    """ Returns the narrowest dtype from dtype up that can hold every value, so narrowing never overflows """
+    if values.size == 0:
+        return np.dtype(dtype)
+    low, high = values.min(), values.max()
+    for candidate in WIDENING[WIDENING.index(dtype):]:
+        info = np.iinfo(candidate)
+        if info.min <= low and high <= info.max:
+            return np.dtype(candidate)
+    raise OverflowError(f"Values from {low} to {high} do not fit in {WIDENING[-1]}")
+
+@dataclass
+class CompactResults:
+    """ Simulation results of one character, every column has shape (attacks, rounds), or (attacks, ceil(rounds/8)) for packed flags """
+    attack_names: list = field(default_factory=list)
+    num_rounds: int = 0
+    columns: dict = field(default_factory=dict)
+    flags: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_arrays(cls, attack_names, arrays):
+        """ Compacts a dictionary of RESULT_COLUMNS (attacks, rounds) arrays, such as one character of simulate_context_table """
+        num_rounds = arrays['Damage'].shape[-1]
+        columns = {}
+        for col, dtype in DTYPE_POLICY.items():
+            values = np.asarray(arrays[col])
+            columns[col] = values.astype(fit_dtype(values, dtype), copy=False)
+        flags = {col: np.packbits(np.asarray(arrays[col], dtype=bool), axis=-1) for col in FLAG_COLUMNS}
+        return cls(attack_names=list(attack_names), num_rounds=num_rounds, columns=columns, flags=flags)
+
+    @property
+    def nbytes(self):
+        """ Memory used by the stored columns """
+        return sum(v.nbytes for v in self.columns.values()) + sum(v.nbytes for v in self.flags.values())
+
+    def column(self, col):
+        """ Full (attacks, rounds) array of a column, flags are unpacked as uint8 """
+        if col in self.columns:
+            return self.columns[col]
+        if col == 'Hit (Non-Crit)':
+            return self.column('Hit') & (1 - self.column('Hit (Crit)'))
+        return np.unpackbits(self.flags[col], axis=-1, count=self.num_rounds)
+
+    def by_round(self):
+        """ Sum of every attack per round, the same as df_by_round of simulate_rounds_from_characters """
+        rounds = pd.Index(np.arange(1, self.num_rounds + 1, dtype='int32'), name='Round')
+        return pd.DataFrame({col: self.column(col).sum(axis=0, dtype='int32') for col in RESULT_COLUMNS}, index=rounds)
+
+    def by_attack_name(self):
+        """ Dictionary of RESULT_COLUMNS arrays per attack name, attacks with the same name are stacked """
+        values_by_name = {}
+        for name in dict.fromkeys(self.attack_names):
+            slots = [jj for jj, n in enumerate(self.attack_names) if n == name]
+            values_by_name[name] = {col: self.column(col)[slots].ravel() for col in RESULT_COLUMNS}
+        return values_by_name
+
+    def to_frame(self, columns=None):
+        """ One row per attack per round with an Attack and Round column, attacks with the same name are stacked
+            columns selects a subset of RESULT_COLUMNS, which avoids unpacking unused flags """
+        columns = RESULT_COLUMNS if columns is None else columns
+        names = list(dict.fromkeys(self.attack_names))
+        slots = [jj for name in names for jj, n in enumerate(self.attack_names) if n == name]
+        categories = sorted(names)
+        codes = np.repeat([categories.index(self.attack_names[jj]) for jj in slots], self.num_rounds).astype('int8')
+        df = pd.DataFrame({col: self.column(col)[slots].ravel() for col in columns})
+        df.insert(0, 'Round', np.tile(np.arange(1, self.num_rounds + 1, dtype='int32'), len(slots)))
+        df.insert(0, 'Attack', pd.Categorical.from_codes(codes, categories=categories))
+        return df
@@ -0,0 +1,84 @@
+""" Samplers that draw from exact dice distributions with a single uniform per sample
+    Rerolled, advantage and disadvantage dice otherwise need two to four draws and masks per die, and sums of N dice need N draws and a reduction """
+from dataclasses import dataclass, field
+from functools import lru_cache
+import numpy as np
+
+from computations.analytic import die_pmf, dice_sum_pmf
+
+MAX_SUM_SAMPLERS = 256
+
+@dataclass
+class AliasTable:
+    """ Walker/Vose alias table, value offset + i is picked with probability probs[i] using a single uniform """
+    offset: int = 0
+    threshold: np.ndarray = field(default_factory=lambda: np.ones(1))
+    alias: np.ndarray = field(default_factory=lambda: np.zeros(1, dtype='int32'))
+
+    @classmethod
+    def from_pmf(cls, pmf):
+        """ Builds the table from a DiscretePMF """
+        n = len(pmf.probs)
+        scaled = pmf.probs / pmf.probs.sum() * n
+        threshold = np.ones(n)
+        alias = np.arange(n, dtype='int32')
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            threshold[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Anything left over is 1 up to rounding error
+        threshold.flags.writeable = False
+        alias.flags.writeable = False
+        return cls(offset=pmf.offset, threshold=threshold, alias=alias)
+
+    def lookup(self, uniforms):
+        """ Maps uniforms in [0, 1) to values, the integer part of uniforms*n picks a column and the fractional part picks it or its alias """
+        scaled = uniforms * len(self.threshold)
+        column = np.minimum(scaled.astype('int32'), len(self.threshold) - 1) # Guard against uniforms*n rounding up to n
+        values = np.where(scaled - column < self.threshold[column], column, self.alias[column])
+        return values.astype('int32') + self.offset
+
+    def sample(self, size, rng):
+        """ Draws size values """
+        return self.lookup(rng.random(size))
+
+@lru_cache(maxsize=None)
+def die_sampler(die_size=20, reroll_on=0, advantage=False, disadvantage=False):
+    """ Cached alias table of a single die, rerolling once on reroll_on or lower, optionally with advantage or disadvantage """
+    return AliasTable.from_pmf(die_pmf(die_size, reroll_on=reroll_on, advantage=advantage, disadvantage=disadvantage))
+
+def is_transformed(reroll_on=0, advantage=False, disadvantage=False):
+    """ True if a die is not a plain uniform roll, which is when an alias table saves draws """
+    return reroll_on > 0 or advantage != disadvantage
+
+@dataclass
+class InverseCDFTable:
+    """ Cumulative distribution of a DiscretePMF, a uniform u maps to the first value whose cumulative probability is above u
+        The mapping is monotonic, so the same uniforms give the same quantiles for different distributions """
+    offset: int = 0
+    cdf: np.ndarray = field(default_factory=lambda: np.ones(1))
+
+    @classmethod
+    def from_pmf(cls, pmf):
+        """ Builds the table from a DiscretePMF """
+        cdf = np.cumsum(pmf.probs / pmf.probs.sum())
+        cdf[-1] = 1.0 # Uniforms are below 1, so the last value is always reachable despite rounding
+        cdf.flags.writeable = False
+        return cls(offset=pmf.offset, cdf=cdf)
+
+    def lookup(self, uniforms):
+        """ Maps uniforms in [0, 1) to values """
+        return np.searchsorted(self.cdf, uniforms, side='right').astype('int32') + self.offset
+
+    def sample(self, size, rng):
+        """ Draws size values """
+        return self.lookup(rng.random(size))
+
+@lru_cache(maxsize=MAX_SUM_SAMPLERS)
+def dice_sum_sampler(num_die, die_size, reroll_on=0, advantage=False, disadvantage=False):
+    """ Least recently used cache of inverse CDF tables of the sum of num_die dice, each rolled like die_sampler """
+    return InverseCDFTable.from_pmf(dice_sum_pmf(num_die, die_size, reroll_on=reroll_on, advantage=advantage, disadvantage=disadvantage))
@@ -1,6 +1,10 @@
 """ Statistical Computations """
+import numpy as np
+import pandas as pd
 from scipy import stats
 
+from computations.analytic import DiscretePMF
+
 def get_distributions(dfs,column="damage"):
     """ Returns a list of distributions for a given column in a list of dataframes, used by some plots"""
     dists = []
@@ -10,3 +14,122 @@ def get_distributions(dfs,column="damage"):
         dist = stats.rv_discrete(values=values)
         dists.append(dist)
     return dists
+
+SUMMARY_QUANTILES = [0, 0.25, 0.5, 0.75, 1]
+MAX_HISTOGRAM_BINS = 10_000_000 # Histograms with more bins than this fall back to sorting
+
+def histogram_rows(values):
+    """ Histogram of each row of a 2D integer array with a single bincount
+        Returns the offset of the histograms and a (rows, width) array of counts """
+    values = np.asarray(values)
+    if values.dtype == bool:
+        values = values.view('int8')
+    offset = int(values.min())
+    width = int(values.max()) - offset + 1
+    shifted = np.subtract(values, offset, dtype='int64') + np.arange(len(values), dtype='int64')[:, np.newaxis] * width
+    counts = np.bincount(shifted.ravel(), minlength=len(values)*width).reshape(len(values), width)
+    return offset, counts
+
+def quantiles_from_counts(counts, offset, q):
+    """ Quantiles of each row of a (rows, width) histogram, with the same linear interpolation as np.percentile
+        Returns a (rows, len(q)) array """
+    q = np.asarray(q, dtype=float)
+    cumulative = np.cumsum(counts, axis=1)
+    total = cumulative[:, -1:]
+    position = q * (total - 1)
+    below = np.floor(position).astype('int64')
+    above = np.minimum(below + 1, total - 1)
+    # Shifting each row of cumulative counts above the previous one makes one sorted array, so all rows are searched at once
+    rows, width = counts.shape
+    shift = np.arange(rows, dtype='int64')[:, np.newaxis] * (int(total.max()) + 1)
+    flat = (cumulative + shift).ravel()
+    def value_at(sorted_position):
+        # Index of the first bin whose cumulative count exceeds the sorted position
+        return offset + np.searchsorted(flat, sorted_position + shift, side='right') - np.arange(rows)[:, np.newaxis] * width
+    value_below = value_at(below)
+    return value_below + (position - below) * (value_at(above) - value_below)
+
+def describe_rows(values, q=SUMMARY_QUANTILES):
+    """ Mean and quantiles of each row of a 2D array, returned as a (rows, 1 + len(q)) array
+        Integer arrays, which is all simulation results, are summarized from a bincount histogram in O(values + support) instead of sorting """
+    values = np.asarray(values)
+    if values.size == 0:
+        return np.full((len(values), 1 + len(q)), np.nan)
+    is_integer = values.dtype == bool or np.issubdtype(values.dtype, np.integer)
+    if not is_integer or len(values) * (int(values.max()) - int(values.min()) + 1) > max(MAX_HISTOGRAM_BINS, values.size):
+        return np.vstack([values.mean(axis=1), np.percentile(values, q=np.multiply(q, 100), axis=1)]).T
+    offset, counts = histogram_rows(values)
+    support = np.arange(offset, offset + counts.shape[1])
+    means = counts @ support / counts.sum(axis=1)
+    return np.column_stack([means, quantiles_from_counts(counts, offset, q)])
+
+class RunningHistogram:
+    """ Histogram of integer values that is updated one chunk at a time, so summary stats of any number of rounds use constant memory
+        Quantiles match np.percentile (linear interpolation) over all the values that were added """
+    def __init__(self):
+        self.offset = 0
+        self.counts = np.zeros(0, dtype='int64')
+        self.total = 0
+        self.sum = 0
+        self.sum_of_squares = 0
+
+    def update(self, values):
+        """ Adds a chunk of integer values """
+        values = np.asarray(values).ravel()
+        if len(values) == 0:
+            return self
+        low, high = int(values.min()), int(values.max())
+        if self.total == 0:
+            self.offset = low
+            self.counts = np.zeros(high - low + 1, dtype='int64')
+        elif low < self.offset or high >= self.offset + len(self.counts):
+            # Grow the histogram to cover the new values
+            new_offset = min(low, self.offset)
+            counts = np.zeros(max(high, self.offset + len(self.counts) - 1) - new_offset + 1, dtype='int64')
+            counts[self.offset-new_offset:self.offset-new_offset+len(self.counts)] = self.counts
+            self.offset, self.counts = new_offset, counts
+        self.counts += np.bincount(np.subtract(values, self.offset, dtype='int64'), minlength=len(self.counts))
+        self.total += len(values)
+        # Moments are accumulated as python ints so they can not overflow
+        self.sum += int(values.sum(dtype='int64'))
+        self.sum_of_squares += int(np.dot(values.astype('int64'), values.astype('int64')))
+        return self
+
+    # pylint: disable=missing-function-docstring
+    @property
+    def support(self):
+        return np.arange(self.offset, self.offset + len(self.counts))
+
+    @property
+    def min(self):
+        return self.offset + int(np.flatnonzero(self.counts)[0])
+
+    @property
+    def max(self):
+        return self.offset + int(np.flatnonzero(self.counts)[-1])
+
+    def mean(self):
+        return self.sum / self.total
+
+    def std(self):
+        """ Sample standard deviation, the same as pandas """
+        if self.total < 2:
+            return np.nan
+        variance = (self.sum_of_squares - self.sum**2 / self.total) / (self.total - 1)
+        return float(np.sqrt(max(variance, 0)))
+
+    def std_error(self):
+        """ Standard error of the mean """
+        return self.std() / np.sqrt(self.total) if self.total >= 2 else np.inf
+
+    def quantile(self, q):
+        """ Quantiles with linear interpolation between the two nearest values, the same as np.percentile(values, 100*q) """
+        return quantiles_from_counts(self.counts[np.newaxis], self.offset, np.atleast_1d(q))[0]
+
+    def to_pmf(self):
+        """ Normalized histogram, so it can be plotted and summarized like an exact distribution """
+        return DiscretePMF(self.offset, self.counts / self.total)
+
+    def describe(self):
+        """ Summary stats in the same layout as numerical_simulation.describe """
+        return pd.Series([self.mean(), *self.quantile(SUMMARY_QUANTILES)], index=['mean','min','25%','50%','75%','max'])
@@ -0,0 +1,64 @@
+""" Turns to kill simulation, many independent fights of one character against an enemy are run at once as arrays
+    Each trial has its own enemy hit points, which every attack of a round reduces in attack order, and trials are retired once the enemy is dead,
+    so later rounds only simulate the fights that are still going """
+import numpy as np
+import pandas as pd
+
+from computations.context_table import compile_context_table, simulate_context_table
+from computations.numerical_simulation import RNG, estimate_bytes_per_round
+from computations.stats import RunningHistogram
+
+MAX_FIGHT_ROUNDS = 1000
+
+def kill_attack(damage, hit_points):
+    """ Applies the damage of each attack of a round in order, damage has shape (attacks, trials) and hit_points shape (trials,)
+        Returns whether each trial's enemy died this round, the attack (0 based) that killed it and the damage past its remaining hit points """
+    dealt = np.cumsum(damage, axis=0, dtype='int64')
+    reached = dealt >= hit_points
+    killed = reached[-1]
+    attack = reached.argmax(axis=0)
+    overkill = dealt[attack, np.arange(len(hit_points))] - hit_points
+    return killed, attack, overkill
+
+def simulate_turns_to_kill(character, enemy, num_trials=100_000, max_rounds=MAX_FIGHT_ROUNDS, memory_budget=256_000_000, rng=RNG):
+    """ Simulates num_trials fights of character against enemy until the enemy reaches 0 hit points or max_rounds have passed
+        Attacks after the killing blow in a round are not made, and fights are simulated in chunks that fit in memory_budget bytes
+        Returns histograms of the rounds to kill, the attacks to kill (counting every attack of earlier rounds) and the overkill of the killing blow,
+        and the number of fights that did not finish """
+    table = compile_context_table([character], enemy)
+    num_attacks = len(table.attack_names[0])
+    rounds_to_kill = RunningHistogram()
+    attacks_to_kill = RunningHistogram()
+    overkill = RunningHistogram()
+    if num_attacks == 0:
+        return rounds_to_kill, attacks_to_kill, overkill, num_trials
+
+    unfinished = 0
+    chunk_size = max(int(memory_budget // max(estimate_bytes_per_round(table), 1)), 1)
+    for start in range(0, num_trials, chunk_size):
+        hit_points = np.full(min(chunk_size, num_trials - start), enemy.hit_points, dtype='int64')
+        for r in range(1, max_rounds + 1):
+            # Only the fights that are still going are simulated
+            damage = simulate_context_table(table, len(hit_points), rng)['Damage'][0, :num_attacks]
+            killed, attack, waste = kill_attack(damage, hit_points)
+            rounds_to_kill.update(np.full(killed.sum(), r))
+            attacks_to_kill.update((r - 1) * num_attacks + attack[killed] + 1)
+            overkill.update(waste[killed])
+            hit_points = hit_points[~killed] - damage[:, ~killed].sum(axis=0, dtype='int64')
+            if len(hit_points) == 0:
+                break
+        unfinished += len(hit_points)
+    return rounds_to_kill, attacks_to_kill, overkill, unfinished
+
+def turns_to_kill_summary(results):
+    """ Summary stats of the rounds to kill, attacks to kill and overkill of simulate_turns_to_kill, plus the fraction of fights that finished """
+    rounds_to_kill, attacks_to_kill, overkill, unfinished = results
+    hists = {'Rounds To Kill': rounds_to_kill, 'Attacks To Kill': attacks_to_kill, 'Overkill': overkill}
+    df = pd.DataFrame({col: h.describe() if h.total else pd.Series(np.nan, index=['mean','min','25%','50%','75%','max']) for col, h in hists.items()})
+    df.loc['Finished'] = rounds_to_kill.total / max(rounds_to_kill.total + unfinished, 1)
+    return df
+
+def simulate_turns_to_kill_from_characters(characters, enemy, num_trials=100_000, max_rounds=MAX_FIGHT_ROUNDS, rng=RNG):
+    """ Turns to kill of each character fighting the enemy alone, returns the results of simulate_turns_to_kill and summary stats per character """
+    results = [simulate_turns_to_kill(c, enemy, num_trials=num_trials, max_rounds=max_rounds, rng=rng) for c in characters]
+    return results, [turns_to_kill_summary(r) for r in results]
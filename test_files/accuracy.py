@@ -0,0 +1,205 @@
+""" Accuracy vs speed report of every simulation engine, checked against the brute force exact distributions of computations/exact.py
+Each engine simulates small configurations (few dice, one or two attacks) at several round counts, and the damage per round of each character is compared
+to the exact distribution by total variation distance and mean error, next to the time it took. The curve of error vs time per engine is the evidence
+for picking default round counts. The analytic engine is exact, so it is run once per configuration and its error should be floating point noise.
+Run from the repository root:
+    python -m test_files.accuracy run --output accuracy_results.csv
+    python -m test_files.accuracy run --engines batched numba --sizes 1000 100000 --repeat 3
+"""
+import argparse
+import sys
+from time import perf_counter
+import numpy as np
+import pandas as pd
+
+from computations.models import Character, Enemy, Attack
+from computations.analytic import damage_pmfs_from_characters
+from computations.dice import DiceSource
+from computations.exact import exact_round_pmfs
+from computations.numerical_simulation import simulate_rounds_from_characters, simulate_rounds_streaming
+from computations.stats import RunningHistogram
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+SEED = 1
+TV_THRESHOLD = 0.01 # Total variation distance considered accurate enough for the recommended round counts
+MAX_PER_ATTACK_ROUNDS = 100_000 # The per attack engine builds a DataFrame per attack, larger runs only show it is slow
+
+### Configurations ###
+
+def longsword():
+    """ One 1d8 weapon attack """
+    return [Character(name='Longsword', level=5, strength=16, attacks=[Attack(name='Longsword', damage='1d8')])], Enemy()
+
+def great_weapon_advantage():
+    """ 2d6 with great weapon fighting rerolls, advantage and crits on 19, against a resistant enemy so damage is truncated """
+    return [Character(name='Greatsword', level=5, strength=18, GWF=True, advantage=True, crit_on=19,
+                      attacks=[Attack(name='Greatsword', two_handed=True, damage='2d6')])], Enemy(resistance=True)
+
+def blessed_reroll():
+    """ A bonus 1d4 attack die rolled with the d20 rerolling 1s, next to the same attack with disadvantage """
+    mace = [Attack(name='Mace', damage='1d6')]
+    return [
+        Character(name='Blessed Lucky', level=3, strength=16, attack_reroll_on=1, bonus_attack_die_mod_list=['1d4'], attacks=mace),
+        Character(name='Blessed Disadvantage', level=3, strength=16, disadvantage=True, bonus_attack_die_mod_list=['1d4'], attacks=mace),
+    ], Enemy()
+
+def saving_throw_cantrip():
+    """ A 2d12 saving throw spell with half damage on a success """
+    return [Character(name='Toll The Dead', level=5, wisdom=18, attacks=[Attack(name='Toll The Dead', type='spell', ability_stat='wisdom', damage='2d12',
+                                                                               saving_throw=True, saving_throw_stat='wisdom')])], Enemy()
+
+def two_attacks():
+    """ Two attacks per round with savage attacker and a raging brutal critical greataxe """
+    return [
+        Character(name='Rapiers', level=5, strength=16, savage_attacker=True, attacks=[Attack(name=f"Rapier{ii+1}", damage='1d8') for ii in range(2)]),
+        Character(name='Greataxe', level=9, strength=18, raging=True, brutal_critical=True, attacks=[Attack(name=f"Greataxe{ii+1}", damage='1d12', two_handed=True) for ii in range(2)]),
+    ], Enemy()
+
+CONFIGS = {
+    'longsword': longsword,
+    'great_weapon_advantage': great_weapon_advantage,
+    'blessed_reroll': blessed_reroll,
+    'saving_throw_cantrip': saving_throw_cantrip,
+    'two_attacks': two_attacks,
+}
+
+### Engines ###
+
+def histogram_pmf(values):
+    """ Empirical distribution of simulated damage """
+    return RunningHistogram().update(values).to_pmf()
+
+def engine_per_attack(characters, enemy, num_rounds, seed):
+    """ The original engine, one DataFrame per attack """
+    _, df_by_rounds, _ = simulate_rounds_from_characters(characters, enemy, num_rounds=num_rounds, engine='per_attack', rng=np.random.default_rng(seed))
+    return [histogram_pmf(df['Damage']) for df in df_by_rounds]
+
+def engine_batched(characters, enemy, num_rounds, seed):
+    """ Every character and attack in one batched numpy kernel """
+    _, df_by_rounds, _ = simulate_rounds_from_characters(characters, enemy, num_rounds=num_rounds, save_memory=True, rng=np.random.default_rng(seed))
+    return [histogram_pmf(df['Damage']) for df in df_by_rounds]
+
+def engine_numba(characters, enemy, num_rounds, seed):
+    """ The fused numba kernel """
+    _, df_by_rounds, _ = simulate_rounds_from_characters(characters, enemy, num_rounds=num_rounds, save_memory=True, engine='numba', rng=np.random.default_rng(seed))
+    return [histogram_pmf(df['Damage']) for df in df_by_rounds]
+
+def engine_streaming(characters, enemy, num_rounds, seed):
+    """ The batched kernel folded into running histograms """
+    hists_by_round, _, _, _ = simulate_rounds_streaming(characters, enemy, num_rounds=num_rounds, rng=np.random.default_rng(seed))
+    return [hists['Damage'].to_pmf() for hists in hists_by_round]
+
+def engine_streaming_paired(characters, enemy, num_rounds, seed):
+    """ Streaming with common random numbers and inverse CDF dice """
+    hists_by_round, _, _, _ = simulate_rounds_streaming(characters, enemy, num_rounds=num_rounds, paired=True, rng=np.random.default_rng(seed))
+    return [hists['Damage'].to_pmf() for hists in hists_by_round]
+
+def engine_dice_source(characters, enemy, num_rounds, seed):
+    """ Streaming with dice carved from raw bits """
+    hists_by_round, _, _, _ = simulate_rounds_streaming(characters, enemy, num_rounds=num_rounds, rng=DiceSource(seed=seed, method='carve'))
+    return [hists['Damage'].to_pmf() for hists in hists_by_round]
+
+def engine_analytic(characters, enemy, num_rounds, seed): # pylint: disable=unused-argument
+    """ Exact convolutions, independent of the number of rounds """
+    _, pmfs_by_round = damage_pmfs_from_characters(characters, enemy)
+    return [pmfs['Damage'] for pmfs in pmfs_by_round]
+
+ENGINES = {
+    'per_attack': engine_per_attack,
+    'batched': engine_batched,
+    'numba': engine_numba,
+    'streaming': engine_streaming,
+    'streaming_paired': engine_streaming_paired,
+    'dice_source': engine_dice_source,
+    'analytic': engine_analytic,
+}
+EXACT_ENGINES = ['analytic'] # Run once per configuration, at no particular number of rounds
+
+### Report ###
+
+def total_variation(p, q):
+    """ Total variation distance between two DiscretePMF, half the sum of the absolute differences of their probabilities """
+    low = min(p.offset, q.offset)
+    high = max(p.offset + len(p.probs), q.offset + len(q.probs))
+    a = np.zeros(high - low)
+    b = np.zeros(high - low)
+    a[p.offset-low:p.offset-low+len(p.probs)] = p.probs
+    b[q.offset-low:q.offset-low+len(q.probs)] = q.probs
+    return 0.5 * float(np.abs(a - b).sum())
+
+def run_report(configs=None, engines=None, sizes=None, repeat=1, seed=SEED):
+    """ Runs every engine on every configuration at every size, repeat times with different seeds
+        Returns one row per (configuration, engine, rounds, repeat, character) with the total variation distance and mean error
+        against the exact distribution and the engine's wall time for all the characters of the configuration """
+    rows = []
+    for config in (configs or CONFIGS):
+        characters, enemy = CONFIGS[config]()
+        exact = exact_round_pmfs(characters, enemy)
+        for engine in (engines or ENGINES):
+            simulate = ENGINES[engine]
+            try:
+                simulate(characters, enemy, 10, seed) # Warm up, so compilation and caches are not timed
+            except ImportError as e:
+                print(f"Skipping {engine}: {e}", flush=True)
+                continue
+            engine_sizes = [None] if engine in EXACT_ENGINES else [n for n in (sizes or SIZES) if engine != 'per_attack' or n <= MAX_PER_ATTACK_ROUNDS]
+            for num_rounds in engine_sizes:
+                for r in range(repeat):
+                    start = perf_counter()
+                    pmfs = simulate(characters, enemy, num_rounds, seed + r)
+                    seconds = perf_counter() - start
+                    for c, pmf, reference in zip(characters, pmfs, exact):
+                        rows.append({
+                            'config': config,
+                            'engine': engine,
+                            'rounds': num_rounds,
+                            'repeat': r,
+                            'character': c.name,
+                            'tv_distance': total_variation(pmf, reference),
+                            'mean_error': pmf.mean() - reference.mean(),
+                            # Mean error in standard errors of the mean, an unbiased engine stays within a few at any number of rounds
+                            'mean_error_z': (pmf.mean() - reference.mean()) / np.sqrt(reference.variance() / num_rounds) if num_rounds else np.nan,
+                            'exact_mean': reference.mean(),
+                            'seconds': seconds,
+                        })
+                print(f"{config}/{engine}/{num_rounds or 'exact'}: {rows[-1]['seconds']:.3f} sec", flush=True)
+    return pd.DataFrame(rows)
+
+def speed_accuracy_curve(report):
+    """ Worst total variation distance, worst absolute mean error (also in standard errors) and mean time over configurations and characters,
+        per engine and number of rounds, exact engines are at 0 rounds """
+    df = report.assign(abs_mean_error=report['mean_error'].abs(), abs_mean_error_z=report['mean_error_z'].abs(), rounds=report['rounds'].fillna(0).astype('int64'))
+    return df.groupby(['engine', 'rounds']).agg(tv_distance=('tv_distance', 'max'), abs_mean_error=('abs_mean_error', 'max'),
+                                                abs_mean_error_z=('abs_mean_error_z', 'max'), seconds=('seconds', 'mean'))
+
+def recommended_rounds(curve, threshold=TV_THRESHOLD):
+    """ Fewest rounds at which each engine's worst total variation distance is below threshold, or NaN if none is """
+    accurate = curve[curve['tv_distance'] <= threshold].reset_index()
+    return accurate.groupby('engine')['rounds'].min().reindex(curve.index.get_level_values('engine').unique()).astype('Int64')
+
+def main(argv=None):
+    """ Command line entry point, returns the exit code """
+    parser = argparse.ArgumentParser(description="Accuracy vs speed of the simulation engines against exact distributions")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="Run the report, print the speed/accuracy curve and write every row as CSV")
+    run.add_argument('--output', default='accuracy_results.csv')
+    run.add_argument('--configs', nargs='+', choices=list(CONFIGS))
+    run.add_argument('--engines', nargs='+', choices=list(ENGINES))
+    run.add_argument('--sizes', nargs='+', type=int)
+    run.add_argument('--repeat', type=int, default=1)
+    run.add_argument('--threshold', type=float, default=TV_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    report = run_report(args.configs, args.engines, args.sizes, repeat=args.repeat)
+    report.to_csv(args.output, index=False)
+    curve = speed_accuracy_curve(report)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(curve.to_string(float_format=lambda x: f"{x:.4g}"))
+        print(f"\nFewest rounds with a total variation distance of at most {args.threshold}:")
+        print(recommended_rounds(curve, args.threshold).to_string())
+    # The exact engine must agree with the brute force enumeration
+    exact_rows = report[report['engine'].isin(EXACT_ENGINES)]
+    return 1 if (exact_rows['tv_distance'] > 1e-9).any() else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+""" Benchmark suite for the simulation engine, with fixed workloads and a stored baseline to compare against
+Every (workload, stage, rounds) case runs in a fresh process, so the peak RSS of each case is its own.
+Run from the repository root:
+    python -m test_files.benchmarks run --output benchmark_results.json
+    python -m test_files.benchmarks compare benchmark_results.json
+    python -m test_files.benchmarks run --output test_files/benchmark_baseline.json # Refresh the baseline on the reference machine
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+from time import perf_counter
+import numpy as np
+
+from computations.models import Character, Enemy, Attack
+from computations.numerical_simulation import simulate_rounds_from_characters, simulate_rounds_from_characters_multi_acs, simulate_rounds_streaming
+from components.plots import add_tables, generate_pmf_plot, generate_line_plots
+
+SIZES = [1_000, 100_000, 1_000_000]
+BASELINE_PATH = 'test_files/benchmark_baseline.json'
+SEED = 1
+REGRESSION_TOLERANCE = 0.25 # Fraction slower or larger than the baseline that counts as a regression
+MIN_REGRESSION = {'seconds': 0.05, 'peak_rss_mb': 20} # Smaller absolute changes are timer and allocator noise
+
+### Workloads ###
+
+def app_fighters():
+    """ The four Fighters from app.py """
+    attacks = [Attack(name=f"Greatsword{ii+1}", two_handed=True, ability_stat="strength", damage='2d6', type='weapon (melee)') for ii in range(3)]
+    fighter = Character(name='Fighter', level=12, attacks=attacks, strength=20)
+    return [
+        fighter,
+        replace(fighter, name='Fighter GWF + Crit On 19', GWF=True, crit_on=19),
+        replace(fighter, name='Fighter Advantage', advantage=True),
+        replace(fighter, name='Fighter GWM + Advantage', GWM=True, advantage=True),
+    ], Enemy(armor_class=18)
+
+def dice_heavy_paladin():
+    """ A Paladin that rolls many damage dice per attack, smites, improved smite, rerolls and savage attacker """
+    attacks = [Attack(name=f"Greatsword{ii+1}", two_handed=True, damage='2d6', bonus_damage_die_mod_list=['1d4']) for ii in range(2)]
+    return [Character(name='Paladin', level=11, strength=20, charisma=16, attacks=attacks, divine_smite=True, divine_smite_level=4,
+                      improved_divine_smite=True, GWF=True, savage_attacker=True)], Enemy()
+
+def spell_save_warlock():
+    """ A Warlock with a saving throw cantrip and agonizing eldritch blasts """
+    toll = Attack(name='Toll The Dead', type='spell', ability_stat='charisma', damage='2d12', saving_throw=True, saving_throw_stat='wisdom')
+    blasts = [Attack(name=f"Eldritch Blast{ii+1}", type='spell', ability_stat='charisma', damage='1d10') for ii in range(3)]
+    return [Character(name='Warlock', level=11, charisma=20, agonizing_blast=True, attacks=[toll] + blasts)], Enemy()
+
+def build_archetypes():
+    """ Every Build ideas archetype in the ReadMe, approximated with the fields the models have """
+    def weapon(name, damage, num=1, **kwargs):
+        return [Attack(name=f"{name}{ii+1}" if num > 1 else name, damage=damage, **kwargs) for ii in range(num)]
+    dex_ranged = {'type': 'weapon (ranged)', 'ability_stat': 'dexterity'}
+    return [
+        Character(name='Bladesinger', level=6, dexterity=18, intelligence=18, attacks=weapon('Rapier', '1d8', 2, ability_stat='dexterity', bonus_damage_die_mod_list=['1d8'])),
+        Character(name='Ice Sorcerer', level=5, charisma=18, attacks=weapon('Ray Of Frost', '2d8', type='spell', ability_stat='charisma', advantage=True)),
+        Character(name='Fire Sorcerer', level=6, charisma=18, elemental_affinity=True,
+                  attacks=weapon('Scorching Ray', '2d6', 3, type='spell', ability_stat='charisma', bonus_damage_die_mod_list=['4'])),
+        Character(name='Gloomstalker Assassin', level=5, dexterity=20, sharpshooter=True, archery=True, advantage=True,
+                  attacks=weapon('Hand Crossbow', '1d6', 3, **dex_ranged) + weapon('Dread Ambusher', '1d6', bonus_damage_die_mod_list=['1d8'], **dex_ranged)),
+        Character(name='War Cleric', level=8, strength=18, attacks=weapon('Warhammer', '1d8', 2, bonus_damage_die_mod_list=['1d8'])),
+        Character(name='Life Cleric', level=8, wisdom=20, attacks=weapon('Sacred Flame', '2d8', type='spell', ability_stat='wisdom', saving_throw=True)),
+        Character(name='Barbarian Cleave', level=9, strength=20, raging=True, brutal_critical=True, GWM=True, advantage=True,
+                  attacks=weapon('Greataxe', '1d12', 2, two_handed=True)),
+        Character(name='Bard Crossbow', level=8, dexterity=20, sharpshooter=True,
+                  attacks=weapon('Light Crossbow', '1d8', 2, **dex_ranged) + weapon('Hand Crossbow', '1d6', **dex_ranged)),
+        Character(name='Pure Fighter', level=20, strength=20, GWF=True, GWM=True, attacks=weapon('Greatsword', '2d6', 4, two_handed=True)),
+    ], Enemy()
+
+WORKLOADS = {
+    'app_fighters': app_fighters,
+    'dice_heavy_paladin': dice_heavy_paladin,
+    'spell_save_warlock': spell_save_warlock,
+    'build_archetypes': build_archetypes,
+}
+
+### Stages ###
+# Each stage prepares its inputs and returns the work to time, as a function without arguments
+
+def stage_simulate(characters, enemy, num_rounds, rng):
+    """ Materialized per round simulation, as the DPR Distribution used before streaming """
+    return lambda: simulate_rounds_from_characters(characters, enemy, num_rounds=num_rounds, save_memory=True, rng=rng)
+
+def stage_armor_class_sweep(characters, enemy, num_rounds, rng):
+    """ DPR vs Armor Class over the app's armor classes """
+    return lambda: simulate_rounds_from_characters_multi_acs(characters, enemy, armor_classes=list(range(10, 26)), num_rounds=num_rounds, rng=rng)
+
+def stage_summary(characters, enemy, num_rounds, rng):
+    """ Streamed histograms and the summary tables built from them """
+    def work():
+        _, _, df_by_rounds, _ = simulate_rounds_streaming(characters, enemy, num_rounds=num_rounds, rng=rng)
+        add_tables(df_by_rounds, characters, by_round=True, width=3, summarized=True)
+    return work
+
+def stage_figure(characters, enemy, num_rounds, rng):
+    """ The DPR distribution and DPR vs Armor Class figures, the simulations they plot are run before the timer """
+    hists_by_round, _, _, _ = simulate_rounds_streaming(characters, enemy, num_rounds=num_rounds, rng=rng)
+    pmfs_by_round = [{col: h.to_pmf() for col, h in hists.items()} for hists in hists_by_round]
+    df_acs = simulate_rounds_from_characters_multi_acs(characters, enemy, armor_classes=list(range(10, 26)), num_rounds=min(num_rounds, 10_000), rng=rng)
+    def work():
+        generate_pmf_plot(characters, pmfs_by_round)
+        generate_line_plots(df_acs, order=[c.name for c in characters])
+    return work
+
+STAGES = {
+    'simulate': stage_simulate,
+    'armor_class_sweep': stage_armor_class_sweep,
+    'summary': stage_summary,
+    'figure': stage_figure,
+}
+
+### Running ###
+
+def case_key(case):
+    """ Identifies a case across result files """
+    return f"{case['workload']}/{case['stage']}/{case['rounds']}"
+
+def run_case(workload, stage, num_rounds, seed=SEED):
+    """ Times one case in the current process, returns its wall time, rounds per second (over all characters) and peak RSS
+        Only the work returned by the stage is timed, the peak RSS includes preparing its inputs """
+    characters, enemy = WORKLOADS[workload]()
+    work = STAGES[stage](characters, enemy, num_rounds, np.random.default_rng(seed))
+    start = perf_counter()
+    work()
+    seconds = perf_counter() - start
+    return {
+        'workload': workload,
+        'stage': stage,
+        'rounds': num_rounds,
+        'characters': len(characters),
+        'seconds': seconds,
+        'rounds_per_second': num_rounds * len(characters) / seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, # KB on linux
+    }
+
+def run_suite(workloads=None, stages=None, sizes=None, repeat=1, seed=SEED):
+    """ Runs every case in a fresh process, keeping the fastest of repeat runs, and returns the results with the environment they ran in """
+    cases = [(w, s, n) for w in (workloads or WORKLOADS) for s in (stages or STAGES) for n in (sizes or SIZES)]
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for workload, stage, num_rounds in cases:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(run_case, workload, stage, num_rounds, seed).result())
+        best = min(runs, key=lambda r: r['seconds'])
+        best['peak_rss_mb'] = max(r['peak_rss_mb'] for r in runs)
+        results.append(best)
+        print(f"{case_key(best)}: {best['seconds']:.3f} sec, {best['rounds_per_second']:,.0f} rounds/sec, {best['peak_rss_mb']:.0f} MB", flush=True)
+    return {
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor()},
+        'results': results,
+    }
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """ Cases whose wall time or peak RSS is more than tolerance above the baseline, as (key, metric, baseline value, new value)
+        Cases missing from the baseline are skipped """
+    baseline_cases = {case_key(c): c for c in baseline['results']}
+    regressions = []
+    for case in results['results']:
+        reference = baseline_cases.get(case_key(case))
+        if reference is None:
+            continue
+        for metric in ['seconds', 'peak_rss_mb']:
+            if case[metric] > reference[metric] * (1 + tolerance) and case[metric] - reference[metric] > MIN_REGRESSION[metric]:
+                regressions.append((case_key(case), metric, reference[metric], case[metric]))
+    return regressions
+
+def main(argv=None):
+    """ Command line entry point, returns the exit code """
+    parser = argparse.ArgumentParser(description="Benchmark the simulation engine")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="Run the benchmarks and write the results as JSON")
+    run.add_argument('--output', default='benchmark_results.json')
+    run.add_argument('--workloads', nargs='+', choices=list(WORKLOADS))
+    run.add_argument('--stages', nargs='+', choices=list(STAGES))
+    run.add_argument('--sizes', nargs='+', type=int)
+    run.add_argument('--repeat', type=int, default=1)
+    check = commands.add_parser('compare', help="Compare results against the baseline, exits with 1 on regressions")
+    check.add_argument('results')
+    check.add_argument('--baseline', default=BASELINE_PATH)
+    check.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_suite(args.workloads, args.stages, args.sizes, repeat=args.repeat)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.results, encoding='utf-8') as f:
+        results = json.load(f)
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+    for key, metric, before, after in regressions:
+        print(f"REGRESSION {key} {metric}: {before:.3f} -> {after:.3f} ({after/before - 1:+.0%})")
+    print(f"{len(regressions)} regressions in {len(results['results'])} cases, tolerance {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
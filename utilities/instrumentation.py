@@ -0,0 +1,246 @@
+""" Lightweight instrumentation, nested timing spans, counters and gauges exported in the Prometheus text format
+    Spans nest per thread, so a span opened inside another is recorded under its path, i.e. request/simulate/roll,
+    which shows which stage of a slow request was slow. Instrumentation is off by default and everything is then a no-op returning shared objects,
+    set INSTRUMENTATION=on in the environment or call enable() to record metrics
+    Example Usage:
+        with span("roll"):
+            increment("rounds_simulated_total", num_rounds)
+        set_gauge("result_bytes", nbytes, kind="Summary")
+        register_metrics_endpoint(app.server) # GET /metrics from the same host, when INSTRUMENTATION=on
+"""
+from contextlib import nullcontext
+from functools import wraps
+import os
+from threading import Lock, local
+from time import perf_counter
+
+PREFIX = 'dnd_'
+SPAN_METRIC = 'span_seconds'
+SPAN_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Help text of the metrics recorded by the app, other metrics are still exported without help
+METRIC_HELP = {
+    SPAN_METRIC: 'Time spent in each instrumented span, labelled by its nested path',
+    'rounds_simulated_total': 'Rounds simulated by the context table kernels, summed over characters',
+    'rng_draws_total': 'Random numbers drawn by the context table kernel',
+    'callbacks_total': 'Dash callback calls',
+    'result_bytes': 'Approximate size of the latest result of each kind',
+    'result_cache_bytes': 'Bytes held by the result cache',
+    'result_cache_requests_total': 'Result cache lookups, by whether they were a hit or a miss',
+    'response_bytes': 'Size of the latest Dash callback response',
+}
+
+_enabled = os.environ.get('INSTRUMENTATION', 'off').lower() in ['on', '1', 'true']
+LOOPBACK_ADDRESSES = ['127.0.0.1', '::1'] # The only clients served the metrics
+_lock = Lock()
+_local = local()
+_counters = {}   # (name, labels) -> value
+_gauges = {}     # (name, labels) -> value
+_histograms = {} # (name, labels) -> [bucket counts, sum, count]
+_NULL_SPAN = nullcontext()
+
+def enable(enabled=True):
+    """ Turns recording on or off, recorded metrics are kept """
+    global _enabled # pylint: disable=global-statement
+    _enabled = enabled
+
+def is_enabled():
+    """ True if metrics are being recorded """
+    return _enabled
+
+def reset():
+    """ Clears every recorded metric """
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def increment(name, value=1, **labels):
+    """ Adds value to a counter """
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """ Sets a gauge to value """
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+def observe(name, value, **labels):
+    """ Records value in a histogram with SPAN_BUCKETS """
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, [[0] * len(SPAN_BUCKETS), 0.0, 0])
+        for ii, bound in enumerate(SPAN_BUCKETS):
+            if value <= bound:
+                histogram[0][ii] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+def _span_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+class Span:
+    """ Times a block and records it under the path of the spans open in this thread """
+    __slots__ = ('name', 'path', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.path = None
+        self.start = None
+
+    def __enter__(self):
+        stack = _span_stack()
+        stack.append(self.name)
+        self.path = '/'.join(stack)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = perf_counter() - self.start
+        stack = _span_stack()
+        if stack and stack[-1] == self.name:
+            stack.pop()
+        observe(SPAN_METRIC, elapsed, span=self.path)
+        return False
+
+def span(name):
+    """ Context manager timing a block as a span, a shared no-op when disabled """
+    return Span(name) if _enabled else _NULL_SPAN
+
+def timed(f=None, name=None):
+    """ Decorator timing every call of a function as a span, named after the function unless name is given
+        Example Usage:
+            @timed
+            def simulate(...): ...
+            @timed(name="figure")
+            def generate_pmf_plot(...): ...
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+        @wraps(func)
+        def wrap(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(span_name):
+                return func(*args, **kwargs)
+        return wrap
+    return decorator(f) if f is not None else decorator
+
+class CountingRNG:
+    """ Wraps a random generator or DiceSource, counting the numbers it draws in rng_draws_total """
+    def __init__(self, rng):
+        self.unwrapped = rng
+
+    def random(self, size=None, *args, **kwargs):
+        """ Same as the wrapped random """
+        increment('rng_draws_total', _size(size))
+        return self.unwrapped.random(size, *args, **kwargs)
+
+    def integers(self, low, high=None, size=None, *args, **kwargs):
+        """ Same as the wrapped integers """
+        increment('rng_draws_total', _size(size))
+        return self.unwrapped.integers(low, high, size, *args, **kwargs)
+
+    def dice(self, die_size, size):
+        """ Same as DiceSource.dice """
+        increment('rng_draws_total', _size(size))
+        return self.unwrapped.dice(die_size, size)
+
+    def __getattr__(self, name):
+        return getattr(self.unwrapped, name)
+
+def _size(size):
+    if size is None:
+        return 1
+    if not hasattr(size, '__iter__'): # int or numpy integer
+        return int(size)
+    total = 1
+    for s in size:
+        total *= int(s)
+    return total
+
+def counting_rng(rng):
+    """ rng wrapped to count its draws, or rng itself when disabled """
+    return CountingRNG(rng) if _enabled and not isinstance(rng, CountingRNG) else rng
+
+### Export ###
+
+def _format_labels(labels, extra=()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+def render_prometheus():
+    """ Every recorded metric in the Prometheus text exposition format """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+    lines = []
+    for kind, metrics in [('counter', counters), ('gauge', gauges), ('histogram', histograms)]:
+        for name in sorted({name for name, _ in metrics}):
+            full_name = PREFIX + name
+            if name in METRIC_HELP:
+                lines.append(f"# HELP {full_name} {METRIC_HELP[name]}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for (metric_name, labels), value in sorted(metrics.items(), key=lambda item: item[0]):
+                if metric_name != name:
+                    continue
+                if kind != 'histogram':
+                    lines.append(f"{full_name}{_format_labels(labels)} {value}")
+                    continue
+                buckets, total, count = value
+                for bound, bucket_count in zip(SPAN_BUCKETS, buckets):
+                    lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', bound)])} {bucket_count}")
+                lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+    return '\n'.join(lines) + '\n'
+
+def register_metrics_endpoint(server, path='/metrics'):
+    """ Serves render_prometheus at path on a Flask server, and times each Dash callback request as the request span with its response size
+        Nothing is registered unless instrumentation is enabled, and the metrics are only served to requests from loopback, so a scraper
+        has to run on the same host. Returns the view function, or None when disabled """
+    if not _enabled:
+        return None
+    from flask import Response, abort, g, request # pylint: disable=import-outside-toplevel
+
+    def is_callback():
+        return request.path.endswith('_dash-update-component')
+
+    @server.before_request
+    def start_request_span():
+        if _enabled and is_callback():
+            g.request_span = Span('request').__enter__()
+
+    @server.after_request
+    def record_response_bytes(response):
+        if _enabled and is_callback() and response.content_length is not None:
+            set_gauge('response_bytes', response.content_length)
+        return response
+
+    @server.teardown_request
+    def end_request_span(_):
+        request_span = g.pop('request_span', None)
+        if request_span is not None:
+            request_span.__exit__(None, None, None)
+
+    @server.route(path)
+    def metrics():
+        if request.remote_addr not in LOOPBACK_ADDRESSES:
+            abort(404)
+        return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+    return metrics